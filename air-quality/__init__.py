@@ -0,0 +1,95 @@
+import logging
+import azure.functions as func
+from __app__.shared_code.TableLayout import parseDay
+from __app__.shared_code.TableClient import getTableServiceOrError
+from __app__.shared_code.AirQuality import pollutantNames, limitValues, queryAirQuality, airQualityValues
+from __app__.shared_code.DeviceQueries import dateValidation
+from __app__.shared_code.ResponseCache import buildCacheKey, cachedResponse
+from __app__.shared_code.ResponseEncoding import responseFormats, dumpJson, toColumns
+from __app__.shared_code.Metrics import invocation
+
+
+## Function to query the daily air quality of a device: the
+# days are returned as a list or as columns, together with the
+# summary of the range (exceedance days and hours, max AQI)
+def getAirQuality(tableService, devName, startTime, endTime, responseFormat = "rows"):
+    jsonResponse = {}
+    days = []
+
+    summary = {
+        "days"              : 0,
+        "maxAqi"            : None,
+        "exceedanceDays"    : {name: 0 for name in pollutantNames},
+        "exceedanceHours"   : {name: 0 for name in pollutantNames},
+        "limits"            : limitValues
+    }
+
+    with invocation("air-quality", device = devName, startTime = startTime, endTime = endTime) as invocationMetrics:
+        try:
+            for entity in queryAirQuality(tableService, devName, parseDay(startTime), parseDay(endTime)):
+                values = airQualityValues(entity)
+                days.append(values)
+
+                summary["days"] += 1
+                if values["aqi"] is not None and (summary["maxAqi"] is None or values["aqi"] > summary["maxAqi"]):
+                    summary["maxAqi"] = values["aqi"]
+
+                for name in pollutantNames:
+                    summary["exceedanceDays"][name] += int(values["exceeds" + name])
+                    summary["exceedanceHours"][name] += values["exceedHours" + name]
+
+            # Build json responses
+            if responseFormat == "columns":
+                response = toColumns(days)
+            else:
+                response = { "days" : days }
+            response["summary"] = summary
+            jsonResponse = dumpJson(response)
+
+        except Exception as error:
+            logging.info(error)
+
+        invocationMetrics.count("jsonBytes", len(jsonResponse))
+
+    return jsonResponse
+
+
+## Main function
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+
+    # Get params
+    deviceName = req.params.get('device-name')
+    if not deviceName or deviceName == "" or not deviceName.isalnum():
+        return func.HttpResponse(
+                "Unable to parse requested device name",
+                status_code = 400)
+
+    startTime = req.params.get('from')
+    endTime = req.params.get('to')
+    if not startTime or not dateValidation(startTime):
+        return func.HttpResponse(
+                "Unable to parse start date format: should be YYYY-mm-dd",
+                status_code = 400)
+
+    if not endTime or not dateValidation(endTime):
+        return func.HttpResponse(
+                "Unable to parse end date format: should be YYYY-mm-dd",
+                status_code = 400)
+
+    responseFormat = req.params.get('format', "rows")
+    if responseFormat not in responseFormats:
+        return func.HttpResponse(
+                "Unable to parse requested format: should be one of " + ", ".join(responseFormats),
+                status_code = 400)
+
+    # Instantiate db connection
+    tableService, errorResponse = getTableServiceOrError()
+    if errorResponse is not None:
+        return errorResponse
+
+    logging.info("Requested air quality of device " + deviceName + " for data range " + startTime + " - " + endTime)
+
+    # Return response, the air quality only changes with the ingest
+    cacheKey = buildCacheKey("air-quality", { "device-name": deviceName, "from": startTime, "to": endTime, "format": responseFormat })
+    return cachedResponse(req, cacheKey, lambda: getAirQuality(tableService, deviceName, startTime, endTime, responseFormat))
\ No newline at end of file
@@ -0,0 +1,184 @@
+import logging
+import json
+import os
+import datetime
+import concurrent.futures
+import azure.functions as func
+from __app__.pull_sensor_data import buildSession, buildDate, ingestRange, maxWorkers, maxHostConnections, maxRetries
+from __app__.shared_code.TableClient import getTableService, connectionErrorResponse
+from __app__.shared_code.TableLayout import devicesTableName, samplesTableName, dayFormat, parseDay
+from __app__.shared_code.Rollups import rollupsTableName
+from __app__.shared_code.Checkpoints import checkpointsTableName, buildJobId, loadCheckpoints, saveCheckpoint
+from __app__.shared_code.DevicePositions import positionsTableName
+from __app__.shared_code.AirQuality import airQualityTableName
+from __app__.shared_code.Metrics import invocation, withMetrics
+
+
+## Days requested to the sensor service with a single request
+defaultChunkDays = int(os.environ.get("BACKFILL_CHUNK_DAYS", "7"))
+
+
+## Util function to split the requested range in chunks
+# of chunkDays days
+def splitRange(startDay, endDay, chunkDays):
+    chunks = []
+    chunkStart = startDay
+
+    while chunkStart <= endDay:
+        chunkEnd = min(chunkStart + datetime.timedelta(days = chunkDays - 1), endDay)
+        chunks.append((chunkStart, chunkEnd))
+        chunkStart = chunkEnd + datetime.timedelta(days = 1)
+
+    return chunks
+
+
+## Util function to build the checkpoint key of a chunk
+def buildUnitKey(device, chunkStart):
+    return device + "_" + chunkStart.strftime(dayFormat)
+
+
+## Function to query Azure db to get all configured devices
+def getRegisteredDevices(tableService):
+    entities = tableService.query_entities(devicesTableName, filter = "PartitionKey eq 'Device'")
+    return [entity.DeviceName for entity in entities]
+
+
+## Function to ingest the chunks of a device one after the
+# other: every chunk updates the period rollups, the position
+# and the air quality of the device reading them back, so the
+# chunks of the same device must not run concurrently. Each
+# completed chunk is checkpointed. A list of (unit key, stored
+# days, error) is returned
+def backfillDevice(session, tableService, jobId, device, deviceChunks):
+    outcomes = []
+
+    for chunkStart, chunkEnd in deviceChunks:
+        unitKey = buildUnitKey(device, chunkStart)
+        try:
+            storedDays = ingestRange(session, tableService, device, buildDate(chunkStart), buildDate(chunkEnd))
+            saveCheckpoint(tableService, jobId, unitKey, StoredDays = storedDays)
+            outcomes.append((unitKey, storedDays, None))
+        except Exception as error:
+            outcomes.append((unitKey, 0, error))
+
+    return outcomes
+
+
+## Function to ingest the given devices over the requested
+# range. Every device range is split in chunks, each chunk is
+# fetched with a single request. Devices are processed in
+# parallel, the chunks of a device in order.
+# Completed chunks are checkpointed: running the same backfill
+# again only processes the chunks not completed yet
+def runBackfill(tableService, devices, startDay, endDay, chunkDays):
+    jobId = buildJobId("backfill", ",".join(sorted(devices)), startDay.strftime(dayFormat),
+                       endDay.strftime(dayFormat), str(chunkDays))
+
+    completed = loadCheckpoints(tableService, jobId)
+
+    chunks = {}
+    for device in devices:
+        for chunkStart, chunkEnd in splitRange(startDay, endDay, chunkDays):
+            if buildUnitKey(device, chunkStart) not in completed:
+                chunks.setdefault(device, []).append((chunkStart, chunkEnd))
+
+    result = {
+        "job"           : jobId,
+        "chunks"        : sum(len(deviceChunks) for deviceChunks in chunks.values()) + len(completed),
+        "skipped"       : len(completed),
+        "storedDays"    : 0,
+        "failed"        : []
+    }
+
+    with buildSession(maxHostConnections, maxRetries) as session:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = maxWorkers) as executor:
+            futures = [executor.submit(withMetrics(backfillDevice), session, tableService, jobId, device, deviceChunks)
+                       for device, deviceChunks in chunks.items()]
+
+            for future in concurrent.futures.as_completed(futures):
+                for unitKey, storedDays, error in future.result():
+                    if error is None:
+                        result["storedDays"] += storedDays
+                    else:
+                        logging.info("Unable to backfill " + unitKey + ": " + str(error))
+                        result["failed"].append(unitKey)
+
+    return result
+
+
+## Util function to evaluate if requested date
+# format is corrects
+def dateValidation(dateStr):
+    try:
+        parseDay(dateStr)
+        return True
+    except ValueError:
+        return False
+
+
+## Main function
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+
+    # Get params
+    devices = []
+    devicesParam = req.params.get('devices')
+    if devicesParam:
+        devices = [device.strip() for device in devicesParam.split(",") if device.strip()]
+        if not all(device.isalnum() for device in devices):
+            return func.HttpResponse(
+                    "Unable to parse requested device names",
+                    status_code = 400
+                )
+
+    startTime = req.params.get('from')
+    endTime = req.params.get('to')
+    if not startTime or not endTime or not dateValidation(startTime) or not dateValidation(endTime):
+        return func.HttpResponse(
+                "Unable to parse requested date range: should be YYYY-mm-dd",
+                status_code = 400
+            )
+
+    startDay = parseDay(startTime)
+    endDay = parseDay(endTime)
+    if startDay > endDay:
+        return func.HttpResponse(
+                "Start date should not be after end date",
+                status_code = 400
+            )
+
+    chunkDays = defaultChunkDays
+    chunkParam = req.params.get('chunk-days')
+    if chunkParam:
+        if not chunkParam.isdigit() or int(chunkParam) == 0:
+            return func.HttpResponse(
+                    "Unable to parse requested chunk days",
+                    status_code = 400
+                )
+        chunkDays = int(chunkParam)
+
+    # Instantiate db connection
+    tableService = None
+    try:
+        tableService = getTableService()
+        tableService.create_table(samplesTableName)
+        tableService.create_table(rollupsTableName)
+        tableService.create_table(checkpointsTableName)
+        tableService.create_table(positionsTableName)
+        tableService.create_table(airQualityTableName)
+
+        if not devices:
+            devices = getRegisteredDevices(tableService)
+    except Exception as error:
+        return connectionErrorResponse(error)
+
+    logging.info("Requested backfill of " + str(len(devices)) + " devices for data range " + startTime + " - " + endTime)
+
+    # Failed chunks are retried by sending the same request again
+    with invocation("backfill-data", devices = len(devices), startDay = startTime, endDay = endTime) as invocationMetrics:
+        result = runBackfill(tableService, devices, startDay, endDay, chunkDays)
+        invocationMetrics.count("storedDays", result["storedDays"])
+        invocationMetrics.count("failedChunks", len(result["failed"]))
+    statusCode = 500 if result["failed"] else 200
+
+    return func.HttpResponse(json.dumps(result), mimetype="application/json", status_code=statusCode)
\ No newline at end of file
@@ -0,0 +1,127 @@
+## Cold import times of the function entry points. Every function
+# module is imported in a fresh interpreter with -X importtime,
+# as the functions host does when a worker starts. Run it from
+# the project root with the function app requirements installed:
+#
+#   python -m benchmarks.import_times --output imports.json
+#
+# For each function the wall time of the import (median of the
+# runs), the cumulative import time reported by the interpreter
+# and the heaviest top level modules are written as json. Modules
+# imported by the interpreter startup are not counted
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+from benchmarks.run_benchmarks import projectRoot, gitRevision
+
+
+## Code run by the child interpreter: the function app is
+# loaded as the __app__ package, then the function imported
+importCode = """
+import importlib, sys, time, types
+start = time.perf_counter()
+appPackage = types.ModuleType("__app__")
+appPackage.__path__ = [{root!r}]
+sys.modules["__app__"] = appPackage
+if {name!r}:
+    importlib.import_module("__app__." + {name!r})
+print(time.perf_counter() - start)
+"""
+
+importTimePattern = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+## Function returning the names of the functions of the app
+def listFunctions():
+    return sorted(entry.name for entry in os.scandir(projectRoot)
+                  if entry.is_dir() and os.path.exists(os.path.join(entry.path, "function.json")))
+
+
+## Function importing a function module in a fresh interpreter.
+# The wall time and the -X importtime records, as (module,
+# self us, cumulative us, depth) tuples, are returned
+def importOnce(name):
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", importCode.format(root = projectRoot, name = name)],
+                               cwd = projectRoot, stdout = subprocess.PIPE, stderr = subprocess.PIPE, check = True)
+
+    records = []
+    for line in completed.stderr.decode("utf-8").splitlines():
+        match = importTimePattern.match(line)
+        if match:
+            selfTime, cumulative, indent, module = match.groups()
+            records.append((module, int(selfTime), int(cumulative), (len(indent) - 1) // 2))
+
+    return float(completed.stdout.decode("utf-8").strip().splitlines()[-1]), records
+
+
+## Function returning the modules imported by the interpreter
+# startup, without importing any function
+def startupModules():
+    wallTime, records = importOnce("")
+    return set(record[0] for record in records)
+
+
+## Function measuring the cold import of a function
+def measureFunction(name, repeat, top, excluded):
+    wallTimes = []
+    cumulativeTimes = []
+    heaviest = {}
+
+    for r in range(repeat):
+        wallTime, records = importOnce(name)
+        wallTimes.append(wallTime)
+
+        topLevel = [record for record in records if record[3] == 0 and record[0] not in excluded]
+        cumulativeTimes.append(sum(record[2] for record in topLevel))
+
+        for module, selfTime, cumulative, depth in topLevel:
+            heaviest.setdefault(module, []).append(cumulative)
+
+    modules = sorted(((statistics.median(times), module) for module, times in heaviest.items()), reverse = True)
+
+    return {
+        "name": name,
+        "repeat": repeat,
+        "wallMedian": statistics.median(wallTimes),
+        "wallMin": min(wallTimes),
+        "cumulativeMedianUs": statistics.median(cumulativeTimes),
+        "modules": len(heaviest),
+        "heaviest": [{"module": module, "cumulativeUs": cumulative} for cumulative, module in modules[:top]]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Cold import times of the function entry points")
+    parser.add_argument("--functions", help = "comma separated functions, all of them if not given")
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--top", type = int, default = 10, help = "heaviest modules reported")
+    parser.add_argument("--output", help = "json file of the results, printed if not given")
+    args = parser.parse_args()
+
+    functions = args.functions.split(",") if args.functions else listFunctions()
+    excluded = startupModules()
+
+    report = {
+        "revision": gitRevision(),
+        "timestamp": datetime.datetime.utcnow().replace(tzinfo = datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [measureFunction(name, args.repeat, args.top, excluded) for name in functions]
+    }
+
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            json.dump(report, outputFile, indent = 2)
+    else:
+        json.dump(report, sys.stdout, indent = 2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
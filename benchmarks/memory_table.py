@@ -0,0 +1,127 @@
+## In-memory stand-in of the azure.storage.table TableService,
+# implementing the calls used by the functions: tables are
+# dicts sorted by (PartitionKey, RowKey) on query, filters
+# support 'and' of eq/ne/gt/ge/lt/le comparisons with strings.
+# Batches are applied at once, their entities are decoded from
+# the request bodies as the service stores them
+import re
+import json
+import threading
+from azure.common import AzureConflictHttpError, AzureMissingResourceHttpError
+from azure.storage.table import Entity
+
+
+comparisonPattern = re.compile(r"\s*(\w+)\s+(eq|ne|gt|ge|lt|le)\s+'((?:[^']|'')*)'\s*")
+
+operators = {
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+    "gt": lambda a, b: a > b,
+    "ge": lambda a, b: a >= b,
+    "lt": lambda a, b: a < b,
+    "le": lambda a, b: a <= b
+}
+
+
+## Util function to parse a filter as a list of
+# (property, operator, value) comparisons
+def parseFilter(requestQuery):
+    if not requestQuery:
+        return []
+
+    comparisons = []
+    for part in re.split(r"\s+and\s+", requestQuery.strip()):
+        match = comparisonPattern.fullmatch(part)
+        if match is None:
+            raise ValueError("Unsupported filter: " + part)
+
+        name, operator, value = match.groups()
+        comparisons.append((name, operators[operator], value.replace("''", "'")))
+
+    return comparisons
+
+
+## Page of a query, with the continuation token
+class QueryPage(list):
+    next_marker = None
+
+
+class MemoryTableService:
+
+    def __init__(self):
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.writes = 0
+
+    def create_table(self, tableName, fail_on_exist = False):
+        with self.lock:
+            if tableName in self.tables:
+                return False
+            self.tables[tableName] = {}
+            return True
+
+    def insert_or_replace_entity(self, tableName, entity):
+        with self.lock:
+            self.writes += 1
+            self.tables.setdefault(tableName, {})[(entity["PartitionKey"], entity["RowKey"])] = Entity(entity)
+
+    ## Entity group transaction: the operations are checked
+    # before any is applied, so a failing batch changes nothing
+    def commit_batch(self, tableName, batch):
+        from azure.storage.table._deserialization import _convert_json_to_entity
+
+        operations = []
+        for rowKey, request in batch._requests:
+            entity = None
+            if request.body:
+                entity = _convert_json_to_entity(json.loads(request.body.decode("utf-8")), None, None)
+                entity.pop("etag", None)
+            operations.append((batch._partition_key, rowKey, request.method, "If-Match" in request.headers, entity))
+
+        with self.lock:
+            table = self.tables.setdefault(tableName, {})
+
+            for partitionKey, rowKey, method, conditional, entity in operations:
+                exists = (partitionKey, rowKey) in table
+                if method == "POST" and exists:
+                    raise AzureConflictHttpError("The specified entity already exists", 409)
+                if (method == "DELETE" or conditional) and not exists:
+                    raise AzureMissingResourceHttpError("The specified resource does not exist", 404)
+
+            for partitionKey, rowKey, method, conditional, entity in operations:
+                key = (partitionKey, rowKey)
+                if method == "DELETE":
+                    del table[key]
+                elif method == "MERGE" and key in table:
+                    table[key].update(entity)
+                else:
+                    table[key] = entity
+
+            self.writes += len(operations)
+
+        return [None] * len(operations)
+
+    def query_entities(self, tableName, filter = None, select = None, num_results = None, marker = None, **kwargs):
+        comparisons = parseFilter(filter)
+
+        with self.lock:
+            self.queries += 1
+            rows = sorted(self.tables.get(tableName, {}).items())
+
+        matching = [entity for key, entity in rows
+                    if all(name in entity and compare(entity[name], value) for name, compare, value in comparisons)]
+
+        start = marker["index"] if marker else 0
+        end = len(matching) if num_results is None else start + num_results
+
+        page = QueryPage()
+        for entity in matching[start:end]:
+            if select:
+                entity = Entity((name, entity[name]) for name in ["PartitionKey", "RowKey"] + select.split(",") if name in entity)
+            page.append(Entity(entity))
+
+        if end < len(matching):
+            page.next_marker = {"index": end}
+
+        return page
@@ -0,0 +1,262 @@
+## Benchmarks of the ingest and query paths, run them from the
+# project root with the function app requirements installed:
+#
+#   python -m benchmarks.run_benchmarks --output results.json
+#
+# The csv files are synthetic (see sensor_csv) and the table
+# is kept in memory (see memory_table), so timings measure the
+# code of the functions without network. Results are written as
+# json to compare versions: one record per case with its params
+# and the timings of the repeated runs, in seconds
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+
+projectRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+## Util function to import the modules of the function app, which
+# is loaded by the functions host as the __app__ package
+def importApp(moduleName):
+    if "__app__" not in sys.modules:
+        appPackage = types.ModuleType("__app__")
+        appPackage.__path__ = [projectRoot]
+        sys.modules["__app__"] = appPackage
+
+    return importlib.import_module("__app__." + moduleName)
+
+
+## Util function returning the commit of the working tree
+def gitRevision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd = projectRoot,
+                                       stderr = subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+## Function timing run(setup()) repeat times, the setup is
+# not timed. A record with the timings is returned
+def measure(name, params, setup, run, repeat):
+    timings = []
+    for r in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "name": name,
+        "params": params,
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "max": max(timings)
+    }
+
+
+## Benchmarks of the parsing of a day: parseCsv, averageSamples
+# (with the daily averages) and buildJson, at different rates
+def benchmarkParsing(samplesRates, repeat):
+    from benchmarks.sensor_csv import generateDayRows
+
+    pull = importApp("pull_sensor_data")
+    structures = importApp("pull_sensor_data.DataStructures")
+
+    day = datetime.date(2020, 3, 7)
+    results = []
+
+    for samplesPerHour in samplesRates:
+        rows = generateDayRows("bench", day, samplesPerHour = samplesPerHour)
+        params = {"samplesPerHour": samplesPerHour, "rows": len(rows)}
+
+        def parsed():
+            samplesDict = {}
+            dailyAverages = structures.DailyAverage()
+            pull.parseCsv(iter(rows), samplesDict, dailyAverages, structures.StructuredDate())
+            return samplesDict, dailyAverages
+
+        def averaged():
+            samplesDict, dailyAverages = parsed()
+            dailyAverages.finalize()
+            pull.averageSamples(samplesDict)
+            return samplesDict, dailyAverages
+
+        def averageAll(state):
+            samplesDict, dailyAverages = state
+            dailyAverages.finalize()
+            pull.averageSamples(samplesDict)
+
+        results.append(measure("parseCsv", params, lambda: None,
+                               lambda state: parsed(), repeat))
+        results.append(measure("averageSamples", params, parsed, averageAll, repeat))
+        results.append(measure("buildJson", params, averaged,
+                               lambda state: pull.buildJson(state[0], state[1], day.strftime("%Y-%m-%d")), repeat))
+
+    return results
+
+
+## Function filling the in-memory table through the ingest of
+# the given devices, for the days up to today: samples, rollups,
+# positions and air quality are written as the functions do
+def populateTables(tableService, devices, days, samplesPerHour):
+    from benchmarks.sensor_csv import CsvSession
+
+    pull = importApp("pull_sensor_data")
+    createTables(tableService)
+
+    today = datetime.date.today()
+    startDay = today - datetime.timedelta(days = days - 1)
+
+    with CsvSession(samplesPerHour = samplesPerHour) as session:
+        for device in devices:
+            pull.ingestRange(session, tableService, device, pull.buildDate(startDay), pull.buildDate(today))
+
+
+## Util function to create the tables written by the ingest
+def createTables(tableService):
+    for moduleName, tableName in (("shared_code.TableLayout", "samplesTableName"), ("shared_code.Rollups", "rollupsTableName"),
+                                  ("shared_code.DevicePositions", "positionsTableName"), ("shared_code.AirQuality", "airQualityTableName")):
+        tableService.create_table(getattr(importApp(moduleName), tableName))
+
+
+## Benchmarks of the ingest of a device: ingestRange of the
+# requested days, from the download to the air quality, into
+# an empty in-memory table
+def benchmarkIngest(samplesRates, ingestDays, repeat):
+    from benchmarks.memory_table import MemoryTableService
+    from benchmarks.sensor_csv import CsvSession
+
+    pull = importApp("pull_sensor_data")
+
+    endDay = datetime.date(2020, 3, 7)
+    startDay = endDay - datetime.timedelta(days = ingestDays - 1)
+    results = []
+
+    for samplesPerHour in samplesRates:
+        params = {"samplesPerHour": samplesPerHour, "days": ingestDays}
+
+        def emptyTables():
+            tableService = MemoryTableService()
+            createTables(tableService)
+            return tableService
+
+        results.append(measure("ingestRange", params, emptyTables,
+                               lambda tableService: pull.ingestRange(CsvSession(samplesPerHour = samplesPerHour), tableService, "bench",
+                                                                     pull.buildDate(startDay), pull.buildDate(endDay)),
+                               repeat))
+
+    return results
+
+
+## Benchmarks of the read paths: getDeviceInfo and queryQuantiles
+# over the requested ranges, getDeviceSummary and the first page
+# of the export of all the devices, with the given numbers of
+# devices stored in the same table
+def benchmarkQueries(deviceCounts, storedDays, ranges, samplesPerHour, repeat):
+    from benchmarks.memory_table import MemoryTableService
+
+    layout = importApp("shared_code.TableLayout")
+    rollups = importApp("shared_code.Rollups")
+    deviceData = importApp("device-data")
+    summaryData = importApp("summary-data")
+    deviceQueries = importApp("shared_code.DeviceQueries")
+    bulkExport = importApp("shared_code.BulkExport")
+
+    today = datetime.date.today()
+    results = []
+
+    for deviceCount in deviceCounts:
+        tableService = MemoryTableService()
+        devices = ["bench" + str(d) for d in range(deviceCount)]
+        populateTables(tableService, devices, storedDays, samplesPerHour)
+
+        for requestedDays in ranges:
+            startTime = (today - datetime.timedelta(days = requestedDays)).strftime("%Y-%m-%d")
+            endTime = today.strftime("%Y-%m-%d")
+            params = {"devices": deviceCount, "storedDays": storedDays, "requestedDays": requestedDays}
+
+            results.append(measure("getDeviceInfo", params, lambda: None,
+                                   lambda state: deviceData.getDeviceInfo(layout.samplesTableName, tableService, devices[0], startTime, endTime),
+                                   repeat))
+            results.append(measure("queryQuantiles", params, lambda: None,
+                                   lambda state: deviceQueries.queryQuantiles(tableService, devices[0], startTime, endTime),
+                                   repeat))
+
+        params = {"devices": deviceCount, "storedDays": storedDays}
+        results.append(measure("getDeviceSummary", params, lambda: None,
+                               lambda state: summaryData.getDeviceSummary(rollups.rollupsTableName, tableService, devices[0]),
+                               repeat))
+
+        startDay = today - datetime.timedelta(days = storedDays)
+        for exportFormat in bulkExport.exportFormats:
+            params = {"devices": deviceCount, "storedDays": storedDays, "format": exportFormat}
+            results.append(measure("buildExportPage", params, lambda: None,
+                                   lambda state: bulkExport.buildExportPage(tableService, devices, startDay, today, exportFormat),
+                                   repeat))
+
+    return results
+
+
+## Util function to parse a comma separated list of integers
+def intList(value):
+    return [int(item) for item in value.split(",") if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks of the ingest and query paths")
+    parser.add_argument("--samples-rates", type = intList, default = [12, 60, 360],
+                        help = "samples per hour of the parsed days")
+    parser.add_argument("--devices", type = intList, default = [1, 10],
+                        help = "numbers of stored devices")
+    parser.add_argument("--stored-days", type = int, default = 400)
+    parser.add_argument("--ranges", type = intList, default = [1, 7, 19, 90, 365],
+                        help = "requested days of the read paths")
+    parser.add_argument("--stored-samples-rate", type = int, default = 12,
+                        help = "samples per hour of the stored days")
+    parser.add_argument("--ingest-days", type = int, default = 7,
+                        help = "days of the ingested range")
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--only", choices = ["parsing", "ingest", "queries"])
+    parser.add_argument("--output", help = "json file of the results, printed if not given")
+    args = parser.parse_args()
+
+    # Downloads are served by the csv stand-in, they are not cached
+    os.environ.setdefault("RAW_CACHE_ENABLED", "false")
+
+    results = []
+    if args.only in (None, "parsing"):
+        results += benchmarkParsing(args.samples_rates, args.repeat)
+    if args.only in (None, "ingest"):
+        results += benchmarkIngest(args.samples_rates, args.ingest_days, args.repeat)
+    if args.only in (None, "queries"):
+        results += benchmarkQueries(args.devices, args.stored_days, args.ranges, args.stored_samples_rate, args.repeat)
+
+    report = {
+        "revision": gitRevision(),
+        "timestamp": datetime.datetime.utcnow().replace(tzinfo = datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            json.dump(report, outputFile, indent = 2)
+    else:
+        json.dump(report, sys.stdout, indent = 2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+## Generator of synthetic csv files in the layout returned by
+# the sensorwebhub get_geodata_csv api: a header whose first
+# column is the device name, then one row per sample
+#
+#   device, longitude, latitude, 'YYYY-mm-dd HH:MM:SS', co2, temp,
+#   rad, o3, no2, co, voc, pm2.5, pm10, ds18
+#
+# Rows are listed from the most recent to the oldest. Gaps
+# (hours without samples) and out of order hours are
+# generated with the given probabilities
+import io
+import datetime
+import random
+import urllib.parse
+
+
+## Channels ranges and decimals, in the csv column order
+channelRanges = (
+    (380.0, 500.0, 2),      # co2
+    (-5.0, 35.0, 2),        # temp
+    (0.0, 1.0, 2),          # rad
+    (0.0, 200.0, 3),        # o3
+    (0.0, 100.0, 2),        # no2
+    (0.0, 10.0, 3),         # co
+    (0.0, 5.0, 2),          # voc
+    (0.0, 90.0, 2),         # pm2.5
+    (0.0, 120.0, 2),        # pm10
+    (-5.0, 35.0, 2)         # ds18
+)
+
+
+## Function returning the csv header of a device
+def buildHeader(deviceName):
+    return [deviceName, "longitude", "latitude", "date", "co2", "temp", "rad",
+            "o3", "no2", "co", "voc", "pm2_5", "pm10", "ds18"]
+
+
+## Function returning the hours of a day with samples, from the
+# most recent. Some hours are skipped, some adjacent ones swapped
+def buildHours(generator, gapProbability, swapProbability):
+    hours = [h for h in range(23, -1, -1) if generator.random() >= gapProbability]
+
+    for i in range(len(hours) - 1):
+        if generator.random() < swapProbability:
+            hours[i], hours[i + 1] = hours[i + 1], hours[i]
+
+    return hours
+
+
+## Function generating the rows of a day of a device. Values
+# follow a random walk, as the real channels do, and the
+# position drifts slightly (mobile stations)
+def generateDayRows(deviceName, day, samplesPerHour = 60, gapProbability = 0.05, swapProbability = 0.02, seed = None):
+    generator = random.Random(seed if seed is not None else deviceName + day.isoformat())
+    dateStr = day.strftime("%Y-%m-%d")
+
+    longitude = 11.0 + generator.random()
+    latitude = 43.5 + generator.random()
+    values = [generator.uniform(low, high) for low, high, digits in channelRanges]
+
+    rows = []
+    secondsStep = 3600.0 / samplesPerHour
+    for hour in buildHours(generator, gapProbability, swapProbability):
+        for sample in range(samplesPerHour - 1, -1, -1):
+            seconds = int(sample * secondsStep)
+            values = [min(high, max(low, value + generator.gauss(0, (high - low) / 100)))
+                      for value, (low, high, digits) in zip(values, channelRanges)]
+            longitude += generator.gauss(0, 1e-5)
+            latitude += generator.gauss(0, 1e-5)
+
+            row = [deviceName, "%.7f" % longitude, "%.7f" % latitude,
+                   "%s %02d:%02d:%02d" % (dateStr, hour, seconds // 60, seconds % 60)]
+            row += [str(round(value, digits)) for value, (low, high, digits) in zip(values, channelRanges)]
+            rows.append(row)
+
+    return rows
+
+
+## Function generating the rows of a range of days, from the
+# most recent day as the api does
+def generateRangeRows(deviceName, startDay, endDay, **options):
+    rows = []
+    day = endDay
+    while day >= startDay:
+        rows += generateDayRows(deviceName, day, **options)
+        day -= datetime.timedelta(days = 1)
+
+    return rows
+
+
+## Util function to format rows as the csv body of the api
+def formatCsv(deviceName, rows):
+    lines = [",".join(buildHeader(deviceName))]
+    lines += [",".join(row) for row in rows]
+
+    return "\r\n".join(lines) + "\r\n"
+
+
+## Response of the api stand-in, streamed as the real one
+class CsvResponse:
+    status_code = 200
+
+    def __init__(self, body):
+        self.raw = io.BytesIO(body)
+        self.headers = {}
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+## Stand-in of the http session of the ingest: the api
+# requests are answered with the generated csv of the
+# requested device and days
+class CsvSession:
+    def __init__(self, **options):
+        self.options = options
+        self.requests = 0
+
+    def get(self, url, stream = False, timeout = None, headers = None):
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        dateParams = [int(params[name][0]) for name in ("year", "month", "day", "year2", "month2", "day2")]
+        deviceName = params["station_id"][0]
+
+        rows = generateRangeRows(deviceName, datetime.date(*dateParams[:3]), datetime.date(*dateParams[3:]), **self.options)
+        self.requests += 1
+
+        return CsvResponse(formatCsv(deviceName, rows).encode("utf-8"))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
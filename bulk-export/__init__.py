@@ -0,0 +1,101 @@
+import logging
+import azure.functions as func
+from __app__.shared_code.TableLayout import parseDay
+from __app__.shared_code.TableClient import getTableServiceOrError
+from __app__.shared_code.BulkExport import exportFormats, exportMimetypes, queryDeviceNames, decodeCursor, buildExportPage
+from __app__.shared_code.DeviceQueries import dateValidation
+from __app__.shared_code.ResponseEncoding import parseAcceptEncoding
+from __app__.shared_code.Metrics import invocation
+
+
+## Header holding the cursor of the next page of an export
+cursorHeader = "X-Export-Cursor"
+
+
+## Function to export the hourly samples of many devices as
+# a page of ndjson or csv records. Without devices all the
+# registered ones are exported. The body and the cursor of
+# the next page (None at the end) are returned
+def getExportPage(tableService, deviceNames, startTime, endTime, exportFormat = "ndjson", cursor = None, compress = False):
+    with invocation("bulk-export", devices = len(deviceNames) if deviceNames else None, startTime = startTime,
+                    endTime = endTime, format = exportFormat, resumed = cursor is not None) as invocationMetrics:
+        if not deviceNames:
+            deviceNames = queryDeviceNames(tableService)
+        else:
+            deviceNames = sorted(set(deviceNames))
+
+        body, nextCursor = buildExportPage(tableService, deviceNames, parseDay(startTime), parseDay(endTime),
+                                           exportFormat, cursor, compress)
+
+        invocationMetrics.count("bodyBytes", len(body))
+
+    return body, nextCursor
+
+
+## Main function
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+
+    # Get params, devices are optional
+    deviceNames = []
+    devices = req.params.get('devices')
+    if devices:
+        deviceNames = devices.split(",")
+        if not all(deviceName.isalnum() for deviceName in deviceNames):
+            return func.HttpResponse(
+                    "Unable to parse requested devices: should be a comma separated list of device names",
+                    status_code = 400)
+
+    startTime = req.params.get('from')
+    endTime = req.params.get('to')
+    if not startTime or not dateValidation(startTime):
+        return func.HttpResponse(
+                "Unable to parse start date format: should be YYYY-mm-dd",
+                status_code = 400)
+
+    if not endTime or not dateValidation(endTime):
+        return func.HttpResponse(
+                "Unable to parse end date format: should be YYYY-mm-dd",
+                status_code = 400)
+
+    exportFormat = req.params.get('format', "ndjson")
+    if exportFormat not in exportFormats:
+        return func.HttpResponse(
+                "Unable to parse requested format: should be one of " + ", ".join(exportFormats),
+                status_code = 400)
+
+    # Resume after the previous page
+    cursor = req.params.get('cursor')
+    if cursor is not None:
+        cursor = decodeCursor(cursor)
+        if cursor is None:
+            return func.HttpResponse(
+                    "Unable to parse requested cursor",
+                    status_code = 400)
+
+    # Pages are compressed as they are built when gzip is accepted
+    compress = parseAcceptEncoding(req.headers.get("Accept-Encoding") or "").get("gzip", 0.0) > 0
+
+    # Instantiate db connection
+    tableService, errorResponse = getTableServiceOrError()
+    if errorResponse is not None:
+        return errorResponse
+
+    logging.info("Requested export of " + (devices or "all devices") + " for data range " + startTime + " - " + endTime)
+
+    try:
+        body, nextCursor = getExportPage(tableService, deviceNames, startTime, endTime, exportFormat, cursor, compress)
+    except Exception as error:
+        # A partial page would look like the end of the export
+        logging.info(error)
+        return func.HttpResponse(
+                "Unable to export the requested data",
+                status_code=500)
+
+    headers = {"Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    if nextCursor is not None:
+        headers[cursorHeader] = nextCursor
+
+    return func.HttpResponse(body, status_code = 200, mimetype = exportMimetypes[exportFormat], headers = headers)
\ No newline at end of file
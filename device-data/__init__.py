@@ -1,96 +1,45 @@
 import logging
-import json
-import requests
-import datetime
-import pytz
 import azure.functions as func
-import azure.storage.table
-from azure.storage.table import TableService, Entity
-
-## Function to query the Azure db with requested params
-def getDeviceInfo(tableName, tableService, devName, startTime, endTime):
-    response = {}
+from __app__.shared_code.TableLayout import samplesTableName
+from __app__.shared_code.TableClient import getTableServiceOrError
+from __app__.shared_code.Channels import channelNames
+from __app__.shared_code.Downsampling import downsampleModes
+from __app__.shared_code.DeviceQueries import iterDeviceInfo, iterDownsampledInfo, buildSeriesColumns, queryQuantiles, appendMember, dateValidation, maxPoints
+from __app__.shared_code.ResponseEncoding import responseFormats, dumpJson, encodedResponse
+from __app__.shared_code.Metrics import invocation
+
+
+## Function to query the Azure db with requested params,
+# downsampled when the number of points is given. The
+# quantiles of the range are added on request
+def getDeviceInfo(tableName, tableService, devName, startTime, endTime, points = None, mode = "mean", channelIndex = 0, responseFormat = "rows", withQuantiles = False):
     jsonResponse = {}
-    samples = []
-    dailySample = {}
-    reduceDataSet = False
-    samplesThreshold = 20
-    entitiesCount = 0
-
-    requestedDays = daysBetween(startTime, endTime)
-
-    # Adding time to requested days in order to correctly query the dbs
-    startTime = datetime.datetime.strptime(startTime + " 00:00:00", "%Y-%m-%d %H:%M:%S")
-    endTime = datetime.datetime.strptime(endTime + " 23:59:59", "%Y-%m-%d %H:%M:%S")
-    startTime = str(int(startTime.replace(tzinfo=pytz.utc).timestamp()))
-    endTime = str(int(endTime.replace(tzinfo=pytz.utc).timestamp()))
-
-    requestQuery = "PartitionKey eq 'AirSample' and DeviceName eq '" + devName +  "' and RowKey ge '" + startTime + "' and RowKey le '" + endTime + "'"
-    try:
-        entities = tableService.query_entities(tableName, filter = requestQuery)
-        entitiesCount = sum(1 for x in entities)
-        
-        # If the dataset need to be shorter (a lot of data has been requested)
-        if requestedDays >= samplesThreshold and entitiesCount >= samplesThreshold:
-            reduceDataSet = True
-
-        for entity in entities:
-            sample = json.loads(entity.SampleValues)
-            if reduceDataSet:
-                dailySample = {
-                    "time"          : sample["day"],
-                    "missingData"   : "false",
-                    "avgTemp"       : sample["avgDailyTemp"],
-                    "avgCo2"        : sample["avgDailyCo2"],
-                    "avgRad"        : sample["avgDailyRad"],
-                    "avgO3"         : sample["avgDailyO3"],
-                    "avgNo2"        : sample["avgDailyNo2"],
-                    "avgCo"         : sample["avgDailyCo"],
-                    "avgVoc"        : sample["avgDailyVoc"],
-                    "avgPm2_5"      : sample["avgDailyPm2_5"],
-                    "avgPm10"       : sample["avgDailyPm10"],
-                    "avgDs18"       : sample["avgDailyDs18"]
-                }
-                samples.append(dailySample.copy())
-            else:
-                samples += sample["data"]
-
-        # Build the response and converting it to jsons
-        response = { "samples" : samples }
-        jsonResponse = json.dumps(response) 
-
-    except Exception as error:
-        logging.info(error)
-
-    return jsonResponse
 
+    with invocation("device-data", device = devName, startTime = startTime, endTime = endTime, points = points) as invocationMetrics:
+        try:
+            # Build the response as json chunks
+            if responseFormat == "columns":
+                jsonResponse = dumpJson(buildSeriesColumns(tableName, tableService, devName, startTime, endTime, points, mode, channelIndex))
+            elif points is None:
+                jsonResponse = "".join(iterDeviceInfo(tableName, tableService, devName, startTime, endTime))
+            else:
+                jsonResponse = "".join(iterDownsampledInfo(tableName, tableService, devName, startTime, endTime, points, mode, channelIndex))
 
-## Util function to evaluate date difference
-def daysBetween(d1, d2):
-    d1 = datetime.datetime.strptime(d1, "%Y-%m-%d")
-    d2 = datetime.datetime.strptime(d2, "%Y-%m-%d")
-    return abs((d2 - d1).days)
+            if withQuantiles:
+                jsonResponse = appendMember(jsonResponse, "quantiles", queryQuantiles(tableService, devName, startTime, endTime))
 
+        except Exception as error:
+            logging.info(error)
 
-## Util function to evaluate if requested date
-# format is corrects
-def dateValidation(dateStr):
-    dateFormat = "%Y-%m-%d"
+        invocationMetrics.count("jsonBytes", len(jsonResponse))
 
-    try:
-      datetime.datetime.strptime(dateStr, dateFormat)
-      return True
-    except ValueError:
-      return False
+    return jsonResponse
 
 
 ## Main function
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
-    accountName = ""
-    accountKey = ""
-
     # Get params
     deviceName = req.params.get('device-name')
     if not deviceName or deviceName == "" or not deviceName.isalnum():
@@ -126,19 +75,52 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 status_code = 400
             )
 
-    # Instantiate db connection
-    tableName = 'AirSamples'
-    tableService = None
-    try:
-        tableService = TableService(account_name=accountName, account_key=accountKey)
-    except Exception as error:
-        logging.info(error)
+    responseFormat = req.params.get('format', "rows")
+    if responseFormat not in responseFormats:
+        return func.HttpResponse(
+                "Unable to parse requested format: should be one of " + ", ".join(responseFormats),
+                status_code = 400
+            )
+
+    # Optional downsampling
+    points = req.params.get('points')
+    if points is not None:
+        if not points.isdigit() or not 0 < int(points) <= maxPoints:
+            return func.HttpResponse(
+                    "Unable to parse requested points: should be between 1 and " + str(maxPoints),
+                    status_code = 400
+                )
+        points = int(points)
+
+    mode = req.params.get('mode', "mean")
+    if mode not in downsampleModes:
         return func.HttpResponse(
-                "Unable to connect to Azure Table",
-                status_code=500)
+                "Unable to parse requested mode: should be one of " + ", ".join(downsampleModes),
+                status_code = 400
+            )
+
+    channel = req.params.get('channel', channelNames[0])
+    if channel not in channelNames:
+        return func.HttpResponse(
+                "Unable to parse requested channel: should be one of " + ", ".join(channelNames),
+                status_code = 400
+            )
+
+    quantiles = req.params.get('quantiles', "false")
+    if quantiles not in ("true", "false"):
+        return func.HttpResponse(
+                "Unable to parse requested quantiles: should be true or false",
+                status_code = 400
+            )
+
+    # Instantiate db connection
+    tableName = samplesTableName
+    tableService, errorResponse = getTableServiceOrError()
+    if errorResponse is not None:
+        return errorResponse
 
     logging.info("Requested device " + deviceName + " data for data range " + startTime + " - " + endTime)
 
     # Return response
-    jsonResponse = getDeviceInfo(tableName, tableService, deviceName, startTime, endTime)
-    return func.HttpResponse(jsonResponse, mimetype="application/json")
\ No newline at end of file
+    jsonResponse = getDeviceInfo(tableName, tableService, deviceName, startTime, endTime, points, mode, channelNames.index(channel), responseFormat, quantiles == "true")
+    return encodedResponse(req, jsonResponse, mimetype="application/json")
\ No newline at end of file
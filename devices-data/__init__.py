@@ -0,0 +1,154 @@
+import logging
+import os
+import concurrent.futures
+import azure.functions as func
+from __app__.shared_code.TableLayout import samplesTableName
+from __app__.shared_code.TableClient import getTableServiceOrError
+from __app__.shared_code.Channels import channelNames
+from __app__.shared_code.Downsampling import downsampleModes
+from __app__.shared_code.DeviceQueries import iterDeviceInfo, iterDownsampledInfo, buildSeriesColumns
+from __app__.shared_code.DeviceQueries import dateValidation, maxPoints
+from __app__.shared_code.SpatialIndex import getSpatialIndex, parseBoundingBox
+from __app__.shared_code.ResponseEncoding import responseFormats, dumpJson, encodedResponse
+from __app__.shared_code.Metrics import invocation, withMetrics
+
+
+## Batch settings
+maxWorkers = int(os.environ.get("DEVICES_DATA_MAX_WORKERS", "8"))
+maxDevices = int(os.environ.get("DEVICES_DATA_MAX_DEVICES", "50"))
+
+## Function returning the json of a single device, with
+# the same shape of the device-data response or as columns
+def getDeviceJson(tableService, devName, startTime, endTime, responseFormat, points, mode, channelIndex):
+    if responseFormat == "columns":
+        return dumpJson(buildSeriesColumns(samplesTableName, tableService, devName, startTime, endTime, points, mode, channelIndex))
+
+    if points is None:
+        return "".join(iterDeviceInfo(samplesTableName, tableService, devName, startTime, endTime))
+
+    return "".join(iterDownsampledInfo(samplesTableName, tableService, devName, startTime, endTime, points, mode, channelIndex))
+
+
+## Function to query the data of the given devices, at most
+# maxWorkers queries run concurrently. The combined json is
+# returned, devices are in the requested order and the ones
+# that failed are listed apart
+def getDevicesInfo(tableService, devices, startTime, endTime, responseFormat, points = None, mode = "mean", channelIndex = 0):
+    deviceJsons = {}
+    failed = []
+
+    with invocation("devices-data", devices = len(devices), startTime = startTime, endTime = endTime, points = points) as invocationMetrics:
+        with concurrent.futures.ThreadPoolExecutor(max_workers = maxWorkers) as executor:
+            futures = {}
+            for device in devices:
+                future = executor.submit(withMetrics(getDeviceJson), tableService, device, startTime, endTime, responseFormat, points, mode, channelIndex)
+                futures[future] = device
+
+            for future in concurrent.futures.as_completed(futures):
+                device = futures[future]
+                try:
+                    deviceJsons[device] = future.result()
+                except Exception as error:
+                    logging.error("Query of " + device + " failed: " + str(error))
+                    failed.append(device)
+
+        chunks = [dumpJson(device) + ":" + deviceJsons[device] for device in devices if device in deviceJsons]
+        jsonResponse = '{"devices":{' + ",".join(chunks) + '},"failed":' + dumpJson(sorted(failed)) + '}'
+
+        invocationMetrics.count("failedDevices", len(failed))
+        invocationMetrics.count("jsonBytes", len(jsonResponse))
+
+    return jsonResponse
+
+
+## Main function
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+
+    # Get params
+    devicesParam = req.params.get('devices')
+    boxParam = req.params.get('bbox')
+    if not devicesParam and not boxParam:
+        return func.HttpResponse(
+                "Either the devices or the bounding box should be requested",
+                status_code = 400
+            )
+
+    devices = []
+    if devicesParam:
+        devices = list(dict.fromkeys(devicesParam.split(",")))
+        if not all(device.isalnum() for device in devices):
+            return func.HttpResponse(
+                    "Unable to parse requested devices",
+                    status_code = 400
+                )
+
+    boundingBox = None
+    if boxParam:
+        boundingBox = parseBoundingBox(boxParam)
+        if boundingBox is None:
+            return func.HttpResponse(
+                    "Unable to parse requested bounding box: should be minLat,minLon,maxLat,maxLon",
+                    status_code = 400
+                )
+
+    startTime = req.params.get('from')
+    endTime = req.params.get('to')
+    if not startTime or not endTime or not dateValidation(startTime) or not dateValidation(endTime):
+        return func.HttpResponse(
+                "Unable to parse requested dates format: should be YYYY-mm-dd",
+                status_code = 400
+            )
+
+    responseFormat = req.params.get('format', "rows")
+    if responseFormat not in responseFormats:
+        return func.HttpResponse(
+                "Unable to parse requested format: should be one of " + ", ".join(responseFormats),
+                status_code = 400
+            )
+
+    # Optional downsampling
+    points = req.params.get('points')
+    if points is not None:
+        if not points.isdigit() or not 0 < int(points) <= maxPoints:
+            return func.HttpResponse(
+                    "Unable to parse requested points: should be between 1 and " + str(maxPoints),
+                    status_code = 400
+                )
+        points = int(points)
+
+    mode = req.params.get('mode', "mean")
+    channel = req.params.get('channel', channelNames[0])
+    if mode not in downsampleModes or channel not in channelNames:
+        return func.HttpResponse(
+                "Unable to parse requested downsampling mode or channel",
+                status_code = 400
+            )
+
+    # Instantiate db connection
+    tableService, errorResponse = getTableServiceOrError()
+    if errorResponse is not None:
+        return errorResponse
+
+    if boundingBox is not None:
+        try:
+            inBox = [device["deviceName"] for device in getSpatialIndex(tableService).inBox(*boundingBox)]
+        except Exception as error:
+            logging.info(error)
+            return func.HttpResponse(
+                    "Unable to query the devices inside the bounding box",
+                    status_code=500)
+
+        # Both given: the requested devices inside the box
+        devices = [device for device in devices if device in inBox] if devices else inBox
+
+    if len(devices) > maxDevices:
+        return func.HttpResponse(
+                "Too many devices requested: at most " + str(maxDevices),
+                status_code = 400
+            )
+
+    logging.info("Requested " + str(len(devices)) + " devices data for data range " + startTime + " - " + endTime)
+
+    jsonResponse = getDevicesInfo(tableService, devices, startTime, endTime, responseFormat, points, mode, channelNames.index(channel))
+    return encodedResponse(req, jsonResponse, mimetype="application/json")
\ No newline at end of file
@@ -0,0 +1,28 @@
+import logging
+import azure.functions as func
+from __app__.shared_code.TableClient import getTableServiceOrError
+from __app__.shared_code.ResponseEncoding import dumpJson, encodedResponse
+from __app__.shared_code.SpatialIndex import getSpatialIndex, parseBoundingBox
+
+
+## Main function
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+
+    # Get params
+    boundingBox = parseBoundingBox(req.params.get('bbox', ""))
+    if boundingBox is None:
+        return func.HttpResponse(
+                "Unable to parse requested bounding box: should be minLat,minLon,maxLat,maxLon",
+                status_code = 400
+            )
+
+    # Instantiate db connection
+    tableService, errorResponse = getTableServiceOrError()
+    if errorResponse is not None:
+        return errorResponse
+
+    logging.info("Requested devices inside " + req.params.get('bbox'))
+
+    devices = getSpatialIndex(tableService).inBox(*boundingBox)
+    return encodedResponse(req, dumpJson({ "devices" : devices }), mimetype="application/json")
\ No newline at end of file
@@ -0,0 +1,70 @@
+import logging
+import threading
+import azure.functions as func
+from __app__.pull_sensor_data import buildSession, buildDate, ingestRange, maxHostConnections, maxRetries
+from __app__.shared_code.TableClient import getTableService
+from __app__.shared_code.Checkpoints import buildJobId, isCompleted, saveCheckpoint
+from __app__.shared_code.IngestQueue import maxDequeueCount, parseUnitMessage
+from __app__.shared_code.Metrics import invocation
+
+
+session = None
+sessionLock = threading.Lock()
+
+
+## Function returning the http session shared
+# by the invocations of the worker process
+def getSession():
+    global session
+
+    if session is None:
+        with sessionLock:
+            if session is None:
+                session = buildSession(maxHostConnections, maxRetries)
+
+    return session
+
+
+## Function to ingest the unit (device/day) of a message.
+# Malformed messages are discarded, units already completed
+# by the same dispatch are skipped. Failures are raised so
+# the message is delivered again, up to maxDequeueCount
+# times before it is moved to the poison queue. The shared
+# table client and http session are used unless given
+def handleUnit(body, dequeueCount = 1, tableService = None, session = None):
+    try:
+        device, day, dispatchId = parseUnitMessage(body)
+    except ValueError as error:
+        logging.error("Discarding ingest message " + repr(body) + ": " + str(error))
+        return False
+
+    if tableService is None:
+        tableService = getTableService()
+    if session is None:
+        session = getSession()
+
+    jobId = buildJobId("ingest", dispatchId, str(day))
+
+    if isCompleted(tableService, jobId, device):
+        logging.info("Skipping duplicated ingest of " + device + " for " + str(day))
+        return False
+
+    try:
+        storedDays = ingestRange(session, tableService, device, buildDate(day))
+    except Exception as error:
+        if dequeueCount >= maxDequeueCount:
+            logging.error("Ingest of " + device + " for " + str(day) + " failed for the last time: " + str(error))
+        raise
+
+    saveCheckpoint(tableService, jobId, device, StoredDays = storedDays)
+    logging.info("Ingested " + str(storedDays) + " days of " + device)
+
+    return True
+
+
+## Main function
+def main(msg: func.QueueMessage) -> None:
+    logging.info('Python queue trigger function processed a message.')
+
+    with invocation("ingest_worker", dequeueCount = msg.dequeue_count):
+        handleUnit(msg.get_body().decode('utf-8'), msg.dequeue_count)
\ No newline at end of file
@@ -0,0 +1,59 @@
+import logging
+import azure.functions as func
+from __app__.shared_code.TableClient import getTableServiceOrError
+from __app__.shared_code.ResponseEncoding import dumpJson, encodedResponse
+from __app__.shared_code.SpatialIndex import getSpatialIndex
+
+
+## Maximum number of devices of a single request
+maxNearest = 100
+
+
+## Util function to parse a coordinate, None is
+# returned if it is not valid
+def parseCoordinate(valueStr, limit):
+    try:
+        value = float(valueStr)
+    except (TypeError, ValueError):
+        return None
+
+    if not -limit <= value <= limit:
+        return None
+
+    return value
+
+
+## Main function
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    logging.info('Python HTTP trigger function processed a request.')
+
+    # Get params
+    latitude = parseCoordinate(req.params.get('lat'), 90)
+    longitude = parseCoordinate(req.params.get('lon'), 180)
+    if latitude is None or longitude is None:
+        return func.HttpResponse(
+                "Unable to parse requested position",
+                status_code = 400
+            )
+
+    k = req.params.get('k', "5")
+    if not k.isdigit() or not 0 < int(k) <= maxNearest:
+        return func.HttpResponse(
+                "Unable to parse requested number of devices: should be between 1 and " + str(maxNearest),
+                status_code = 400
+            )
+
+    # Instantiate db connection
+    tableService, errorResponse = getTableServiceOrError()
+    if errorResponse is not None:
+        return errorResponse
+
+    logging.info("Requested " + k + " devices nearest to " + str(latitude) + ", " + str(longitude))
+
+    devices = []
+    for distance, device in getSpatialIndex(tableService).nearest(latitude, longitude, int(k)):
+        deviceEntry = dict(device)
+        deviceEntry["distance"] = round(distance, 3)
+        devices.append(deviceEntry)
+
+    return encodedResponse(req, dumpJson({ "devices" : devices }), mimetype="application/json")
\ No newline at end of file
@@ -0,0 +1,114 @@
+import itertools
+import datetime
+from array import array
+from __app__.pull_sensor_data.DataStructures import HourlyBucket
+from __app__.shared_code.QuantileSketch import sketchColumns
+from __app__.shared_code.SampleCodec import hoursNumber
+
+
+## Csv columns holding the channels, in the same order
+# of the hourly values (temp, co2, rad, o3, no2, co, voc,
+# pm2.5, pm10, ds18)
+channelColumns = (5, 4, 6, 7, 8, 9, 10, 11, 12, 13)
+longitudeColumn = 1
+latitudeColumn = 2
+dateColumn = 3
+
+## Csv columns of the daily values, the channels
+# followed by latitude and longitude
+dailyColumns = channelColumns + (latitudeColumn, longitudeColumn)
+channelsNumber = len(channelColumns)
+
+
+## Util function returning the 'YYYY-mm-dd hh' part
+# of a row date, used to group rows by hour
+def rowHour(row):
+    return row[dateColumn].split(':')[0]
+
+
+## Util function to parse the date of a row,
+# 'YYYY-mm-dd hh:mm[:ss]' with or without the leading zeros
+def parseRowDate(dateStr):
+    day, time = dateStr.split(' ')
+    return datetime.datetime(*map(int, day.split('-')), *map(int, time.split(':')))
+
+
+## Generator of the runs of rows of the same hour, each one
+# given as the list of its columns
+def hourRuns(csvRows):
+    for hourKey, hourRows in itertools.groupby(csvRows, key = rowHour):
+        yield list(zip(*hourRows))
+
+
+## Function to fold a run of rows of the same hour into the
+# bucket of the hour (hourlyBuckets is indexed by hour) and
+# into the daily values. The run is converted into typed
+# columns and reduced once per column, the quantile sketches
+# of the run are built once and merged both into the hour
+# and into the day. Every sample counts for its hour: hours
+# without samples are the only missing ones, whatever the
+# order the hours are listed in
+def foldHourRun(columns, hourlyBuckets, dailyAverages):
+    values = [array('d', map(float, columns[c])) for c in dailyColumns]
+    runSketches = sketchColumns(values[:channelsNumber])
+    dailyAverages.addColumns(values)
+    dailyAverages.addSketches(runSketches)
+
+    bucket = hourlyBuckets[parseRowDate(columns[dateColumn][0]).hour]
+    bucket.addColumns(values[:channelsNumber])
+    bucket.addSketches(runSketches)
+
+
+## Util function to build the samples dict of a day given the
+# buckets of its hours: keys are from the most recent hour
+# (lastHour) to the oldest one
+def buildSamplesDict(keyPrefix, hourlyBuckets, lastHour = hoursNumber - 1):
+    return {keyPrefix + str(h).zfill(2): hourlyBuckets[h] for h in range(lastHour, -1, -1)}
+
+
+## Function to aggregate the csv rows of a day by hour.
+# The rows of every hour are folded by foldHourRun, the
+# produced samplesDict holds the 24 hours of the day from the
+# most recent one, the hours without samples are placeholders
+def aggregateRows(csvRows, samplesDict, dailyAverages, processedDate):
+    rowsNumber = 0
+    hourlyBuckets = [HourlyBucket(missing = True) for h in range(hoursNumber)]
+
+    for columns in hourRuns(csvRows):
+        rowsNumber += len(columns[0])
+
+        # Splitting date, the same for the whole run
+        dateArray = columns[dateColumn][-1].split('-')
+        processedDate.year = dateArray[0]
+        processedDate.month = dateArray[1]
+        processedDate.day = dateArray[2].split(' ')[0]
+        processedDate.hour = dateArray[2].split(' ')[1].split(':')[0]
+
+        foldHourRun(columns, hourlyBuckets, dailyAverages)
+
+    if rowsNumber:
+        keyPrefix = processedDate.year + '-' + processedDate.month + '-' + processedDate.day + '_'
+        samplesDict.update(buildSamplesDict(keyPrefix, hourlyBuckets))
+
+    return rowsNumber
+
+
+## Function to add the csv rows to the buckets of the hours
+# of a day (a list indexed by hour) and to the daily values,
+# with the same fold of aggregateRows, so partial aggregates
+# of the same day can be merged together.
+# The number of rows and the most recent date are returned
+def accumulateRows(csvRows, hourlyBuckets, dailyAverages):
+    rowsNumber = 0
+    latestDate = None
+
+    for columns in hourRuns(csvRows):
+        rowsNumber += len(columns[0])
+
+        runDate = max(map(parseRowDate, columns[dateColumn]))
+        if latestDate is None or runDate > latestDate:
+            latestDate = runDate
+
+        foldHourRun(columns, hourlyBuckets, dailyAverages)
+
+    return rowsNumber, latestDate
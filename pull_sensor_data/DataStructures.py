@@ -1,40 +1,134 @@
-## Class used to mantain averages values
-class DailyAverage:
+import math
+import struct
+from array import array
+from operator import add
+from __app__.shared_code.Channels import channelNames, dailyNames
+from __app__.shared_code.QuantileSketch import QuantileSketch
+
+
+countStruct = struct.Struct("<I")
+
+
+## Base class used to accumulate the sums and the
+# number of samples of a fixed set of channels, and
+# the quantile sketches of the sampled channels
+class ChannelAccumulator:
+    __slots__ = ("sums", "count", "averages", "sketches")
+
+    channelsNumber = len(channelNames)
+    decimals = (2,) * len(channelNames)
+
     def __init__(self):
-        self.avgDailyTemp    = 0
-        self.avgDailyCo2     = 0
-        self.avgDailyRad     = 0
-        self.avgDailyO3      = 0
-        self.avgDailyNo2     = 0
-        self.avgDailyCo      = 0
-        self.avgDailyVoc     = 0
-        self.avgDailyPm2_5   = 0
-        self.avgDailyPm10    = 0
-        self.avgDailyDs18    = 0
-        self.avgLatitude     = 0
-        self.avgLongitude    = 0
-
-    def averageValues(self, valuesNumber):
-        float("{:.2f}".format(self.avgDailyTemp / valuesNumber))
-
-        self.avgDailyTemp   = float("{:.2f}".format(self.avgDailyTemp / valuesNumber))
-        self.avgDailyCo2    = float("{:.2f}".format(self.avgDailyCo2 / valuesNumber))
-        self.avgDailyRad    = float("{:.2f}".format(self.avgDailyRad / valuesNumber)) 
-        self.avgDailyO3     = float("{:.2f}".format(self.avgDailyO3 / valuesNumber))   
-        self.avgDailyNo2    = float("{:.2f}".format(self.avgDailyNo2 / valuesNumber))  
-        self.avgDailyCo     = float("{:.2f}".format(self.avgDailyCo / valuesNumber))   
-        self.avgDailyVoc    = float("{:.2f}".format(self.avgDailyVoc / valuesNumber))   
-        self.avgDailyPm2_5  = float("{:.2f}".format(self.avgDailyPm2_5 / valuesNumber))   
-        self.avgDailyPm10   = float("{:.2f}".format(self.avgDailyPm10 / valuesNumber))  
-        self.avgDailyDs18   = float("{:.2f}".format(self.avgDailyDs18 / valuesNumber))   
-        self.avgLatitude    = float("{:.7f}".format(self.avgLatitude / valuesNumber))   
-        self.avgLongitude   = float("{:.7f}".format(self.avgLongitude / valuesNumber))   
+        self.sums       = array('d', bytes(8 * self.channelsNumber))
+        self.count      = 0
+        self.averages   = None
+        self.sketches   = [QuantileSketch() for name in channelNames]
+
+    ## Add a run of samples, given as one typed column per channel
+    def addColumns(self, columns):
+        self.sums = array('d', [total + math.fsum(column) for column, total in zip(columns, self.sums)])
+        self.count += len(columns[0])
+
+    ## Add already reduced sums of count samples
+    def add(self, sums, count):
+        self.sums = array('d', map(add, self.sums, sums))
+        self.count += count
+
+    ## Add the sketches of a run of samples, one per channel
+    def addSketches(self, sketches):
+        for sketch, other in zip(self.sketches, sketches):
+            sketch.merge(other)
+
+    ## Combine with another accumulator (partial days, shards...)
+    def merge(self, other):
+        self.add(other.sums, other.count)
+        for sketch, otherSketch in zip(self.sketches, other.sketches):
+            sketch.merge(otherSketch)
+
+    ## Binary representation: the count followed by the sums.
+    # Sketches have a variable size, they are stored apart
+    def toBytes(self):
+        return countStruct.pack(self.count) + self.sums.tobytes()
+
+    ## Build an accumulator given its binary representation
+    @classmethod
+    def fromBytes(cls, buffer):
+        accumulator = cls()
+        accumulator.count = countStruct.unpack_from(buffer)[0]
+        accumulator.sums = array('d', bytes(buffer[countStruct.size:cls.packedSize()]))
+        return accumulator
+
+    @classmethod
+    def packedSize(cls):
+        return countStruct.size + 8 * cls.channelsNumber
+
+    ## Evaluate the rounded averages
+    def finalize(self):
+        if self.count == 0:
+            self.averages = [0] * self.channelsNumber
+        else:
+            self.averages = [round(total / self.count, digits) for total, digits in zip(self.sums, self.decimals)]
+
+        return self.averages
+
+
+## Class used to mantain the samples of an hour
+class HourlyBucket(ChannelAccumulator):
+    __slots__ = ("missing",)
+
+    def __init__(self, missing = False):
+        super().__init__()
+        self.missing = missing
+
+    def addColumns(self, columns):
+        super().addColumns(columns)
+        self.missing = False
+
+    def add(self, sums, count):
+        super().add(sums, count)
+        self.missing = self.count == 0
+
+    ## The sketches of the first run of the hour are taken
+    # over instead of copied: they must not be changed afterwards
+    def addSketches(self, sketches):
+        for index, sketch in enumerate(sketches):
+            if self.sketches[index].count == 0:
+                self.sketches[index] = sketch
+            else:
+                self.sketches[index].merge(sketch)
+
+    @classmethod
+    def fromBytes(cls, buffer):
+        bucket = super().fromBytes(buffer)
+        bucket.missing = bucket.count == 0
+        return bucket
+
+    def finalize(self):
+        if self.missing:
+            self.averages = [0] * self.channelsNumber
+            return self.averages
+
+        return super().finalize()
+
+
+## Class used to mantain averages values, the channels
+# are followed by latitude and longitude
+class DailyAverage(ChannelAccumulator):
+    __slots__ = ()
+
+    channelsNumber = len(dailyNames)
+    decimals = (2,) * len(channelNames) + (7, 7)
+
+    latitudeIndex = len(channelNames)
+    longitudeIndex = len(channelNames) + 1
 
 
 ## Class used to maintain a structured date
 class StructuredDate:
+    __slots__ = ("year", "month", "day", "hour")
+
     def __init__(self):
         self.year    = 0
         self.month   = 0
         self.day     = 0
-        self.hour    = 0
\ No newline at end of file
+        self.hour    = 0
@@ -0,0 +1,203 @@
+import os
+import io
+import gzip
+import json
+import mmap
+import hashlib
+import tempfile
+import threading
+import contextlib
+from __app__.shared_code.Metrics import metrics
+
+
+## Raw csv cache settings. The cached responses are
+# gzip files named by the sha256 of their content,
+# an index file per request url holds the validators
+cacheEnabled = os.environ.get("RAW_CACHE_ENABLED", "true").lower() == "true"
+cacheDir = os.environ.get("RAW_CACHE_DIR", os.path.join(tempfile.gettempdir(), "air-monitor-raw"))
+cacheMaxBytes = int(os.environ.get("RAW_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+## Only replay the cached responses, without network
+# access: a request missing from the cache is an error
+cacheOffline = os.environ.get("RAW_CACHE_OFFLINE", "false").lower() == "true"
+
+blobSuffix = ".csv.gz"
+chunkSize = 64 * 1024
+
+evictionLock = threading.Lock()
+
+
+## Util function returning the path of the index of a url
+def indexPath(url):
+    return os.path.join(cacheDir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+
+## Util function returning the path of a cached response
+def blobPath(digest):
+    return os.path.join(cacheDir, digest + blobSuffix)
+
+
+## Function returning the index of a url, None if the url
+# is not cached or its response has been evicted
+def loadIndex(url):
+    try:
+        with open(indexPath(url), "r") as indexFile:
+            index = json.load(indexFile)
+    except (OSError, ValueError):
+        return None
+
+    if not os.path.exists(blobPath(index["digest"])):
+        return None
+
+    return index
+
+
+## Util function to atomically write a file of the cache
+def replaceFile(path, writeContent, mode = "wb"):
+    fd, tmpPath = tempfile.mkstemp(dir = cacheDir, suffix = ".tmp")
+    try:
+        with os.fdopen(fd, mode) as tmpFile:
+            writeContent(tmpFile)
+        os.replace(tmpPath, path)
+    except BaseException:
+        os.unlink(tmpPath)
+        raise
+
+
+## Function to store a response body in the cache,
+# compressed while it is read. The digest is returned
+def storeBody(rawStream):
+    hasher = hashlib.sha256()
+    downloaded = [0]
+
+    def writeBody(tmpFile):
+        with gzip.GzipFile(fileobj = tmpFile, mode = "wb", compresslevel = 6, mtime = 0) as gzipFile:
+            for chunk in iter(lambda: rawStream.read(chunkSize), b""):
+                hasher.update(chunk)
+                gzipFile.write(chunk)
+                downloaded[0] += len(chunk)
+
+    # The name is known once the whole body is read
+    tmpPath = os.path.join(cacheDir, "body-" + str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp")
+    replaceFile(tmpPath, writeBody)
+
+    digest = hasher.hexdigest()
+    os.replace(tmpPath, blobPath(digest))
+    metrics().count("bytesDownloaded", downloaded[0])
+
+    return digest
+
+
+## Function to evict the least recently used responses
+# until the cache size is below cacheMaxBytes. The
+# response just stored is always kept
+def evictBlobs(keepDigest):
+    with evictionLock:
+        blobs = []
+        for entry in os.scandir(cacheDir):
+            if entry.name.endswith(blobSuffix) and entry.name != keepDigest + blobSuffix:
+                stat = entry.stat()
+                blobs.append((stat.st_mtime, stat.st_size, entry.path))
+
+        totalBytes = os.path.getsize(blobPath(keepDigest)) + sum(size for mtime, size, path in blobs)
+        for mtime, size, path in sorted(blobs):
+            if totalBytes <= cacheMaxBytes:
+                break
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+            totalBytes -= size
+
+
+## Function to open a cached response as a text stream. The
+# gzip file is memory-mapped and decompressed while read.
+# The response can be evicted by another worker until it is
+# open: FileNotFoundError is raised on enter
+@contextlib.contextmanager
+def openBlob(digest):
+    path = blobPath(digest)
+
+    with open(path, "rb") as blobFile:
+        # Mark as recently used
+        os.utime(path)
+
+        with mmap.mmap(blobFile.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+            with gzip.GzipFile(fileobj = mapped, mode = "rb") as gzipFile:
+                yield io.TextIOWrapper(gzipFile, encoding = "utf-8", newline = "")
+
+
+## Function to download a response into the cache. A cached
+# response (index) is validated with If-None-Match and
+# If-Modified-Since. The index of the response is returned
+def fetchResponse(session, url, timeout, index, closedRange):
+    headers = {}
+    if index is not None:
+        if index.get("etag"):
+            headers["If-None-Match"] = index["etag"]
+        if index.get("lastModified"):
+            headers["If-Modified-Since"] = index["lastModified"]
+
+    with metrics().stage("download"), session.get(url, stream = True, timeout = timeout, headers = headers) as response:
+        response.raise_for_status()
+
+        if index is not None and response.status_code == 304:
+            metrics().count("rawCacheNotModified")
+            if closedRange:
+                # Unchanged since the range has been closed
+                index["complete"] = True
+                replaceFile(indexPath(url), lambda indexFile: json.dump(index, indexFile), "w")
+        else:
+            metrics().count("rawCacheMisses")
+            response.raw.decode_content = True
+            index = {
+                "url": url,
+                "digest": storeBody(response.raw),
+                "etag": response.headers.get("ETag"),
+                "lastModified": response.headers.get("Last-Modified"),
+                "complete": closedRange
+            }
+            replaceFile(indexPath(url), lambda indexFile: json.dump(index, indexFile), "w")
+            evictBlobs(index["digest"])
+
+    return index
+
+
+## Function to open the response of the upstream api as a
+# text stream. Responses fetched once their range was closed
+# (not including today) are complete: when cached they are
+# used without network access. The other ones are validated,
+# a range fetched while open may have got samples since.
+# A response evicted before it is open is downloaded again.
+# Without cache the response is streamed
+@contextlib.contextmanager
+def openResponse(session, url, timeout, closedRange = False):
+    if not cacheEnabled:
+        with session.get(url, stream = True, timeout = timeout) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            yield io.TextIOWrapper(response.raw, encoding = "utf-8", newline = "")
+        return
+
+    os.makedirs(cacheDir, exist_ok = True)
+    index = loadIndex(url)
+
+    if index is None and cacheOffline:
+        raise LookupError("Response not cached: " + url)
+
+    if index is None or not (index.get("complete") or cacheOffline):
+        index = fetchResponse(session, url, timeout, index, closedRange)
+    else:
+        metrics().count("rawCacheHits")
+
+    with contextlib.ExitStack() as stack:
+        try:
+            responseStream = stack.enter_context(openBlob(index["digest"]))
+        except FileNotFoundError:
+            # Evicted by another worker since the index has been read
+            if cacheOffline:
+                raise LookupError("Response evicted from the cache: " + url)
+
+            metrics().count("rawCacheEvicted")
+            index = fetchResponse(session, url, timeout, None, closedRange)
+            responseStream = stack.enter_context(openBlob(index["digest"]))
+
+        yield responseStream
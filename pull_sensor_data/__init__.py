@@ -1,34 +1,65 @@
 import logging
 import csv
-import json
-import requests
+import os
+import itertools
 import datetime
-import pytz
+import typing
 import azure.functions as func
-import azure.storage.table
 from __app__.pull_sensor_data.DataStructures import DailyAverage, StructuredDate
-from azure.storage.table import TableService, Entity
+from __app__.pull_sensor_data.Aggregation import aggregateRows
+from __app__.pull_sensor_data.RawCache import openResponse
+from __app__.shared_code.TableWriter import BatchWriter
+from __app__.shared_code.TableLayout import devicesTableName, samplesTableName, buildPartitionKey, buildRowKey, parseDay
+from __app__.shared_code.TableClient import getTableService
+from __app__.shared_code.ResponseEncoding import dumpJson
+from __app__.shared_code.SampleCodec import formatVersion, encodeHours, hoursNumber
+from __app__.shared_code.QuantileSketch import QuantileSketch, encodeSketches, sketchProperty
+from __app__.shared_code.Channels import channelNames
+from __app__.shared_code.Checkpoints import checkpointsTableName
+from __app__.shared_code.DevicePositions import positionsTableName, updatePosition
+from __app__.shared_code.IngestQueue import buildUnitMessage
+from __app__.shared_code.Rollups import rollupsTableName, dailyResolution, buildRollupEntity, updatePeriodRollups
+from __app__.shared_code.AirQuality import airQualityTableName, updateAirQuality
+from __app__.shared_code.Metrics import invocation, metrics, timed
+
+
+## Fetch stage settings
+maxWorkers = int(os.environ.get("PULL_MAX_WORKERS", "8"))
+maxHostConnections = int(os.environ.get("PULL_MAX_HOST_CONNECTIONS", "8"))
+connectTimeout = float(os.environ.get("PULL_CONNECT_TIMEOUT", "10"))
+readTimeout = float(os.environ.get("PULL_READ_TIMEOUT", "60"))
+maxRetries = int(os.environ.get("PULL_MAX_RETRIES", "3"))
+
+## Store the json samples together with the binary columns
+storeJson = os.environ.get("SAMPLES_STORE_JSON", "true").lower() == "true"
 
 
 ## Util function to build the request URL
-# given the device name and the date
-def buildRequestUrl(deviceName, year, month, day):
+# given the device name and the date. An end date
+# can be given to request a range of days at once
+def buildRequestUrl(deviceName, year, month, day, year2 = None, month2 = None, day2 = None):
     requestYear = year
     requestMonth = month
     requestDay = day
 
+    if year2 is None:
+        year2 = requestYear
+        month2 = requestMonth
+        day2 = requestDay
+
     url = "http://www.sensorwebhub.org:8080/swhrest/rest/download/get_geodata_csv?year="+ requestYear 
     url += "&month=" + requestMonth 
     url += "&day=" + requestDay
-    url += "&year2=" + requestYear
-    url += "&month2=" + requestMonth 
-    url += "&day2=" + requestDay + "&station_id=" + deviceName + "&user_id=guest&pwd_id=guest&language=it"
+    url += "&year2=" + year2
+    url += "&month2=" + month2 
+    url += "&day2=" + day2 + "&station_id=" + deviceName + "&user_id=guest&pwd_id=guest&language=it"
 
     return url
 
 
 ## Function to build the JSON which will be
 # put in Azure db
+@timed("buildJson")
 def buildJson(samplesDict, dailyAverages, date):
     # Build the json as average daily values and average for each hour
     jsonObjects = []
@@ -37,268 +68,323 @@ def buildJson(samplesDict, dailyAverages, date):
     # Keys (hour) are from the most recent to the most old
     # Let's reverse them...
     for key in reversed(list(samplesDict.keys())):
-        dictValues = samplesDict[key]
+        bucket = samplesDict[key]
+        averages = bucket.averages
 
         jsonObject = {
             'time': key,
-            'missingData': dictValues[11],
-            'avgTemp': dictValues[0],
-            'avgCo2': dictValues[1],
-            'avgRad': dictValues[2],
-            'avg03': dictValues[3],
-            'avgNo2': dictValues[4],
-            'avgCo': dictValues[5],
-            'avgVoc': dictValues[6],
-            'avgPm2_5': dictValues[7],
-            'avgPm10': dictValues[8],
-            'avgDs18': dictValues[9],
-            'samplxH': dictValues[10]
+            'missingData': "true" if bucket.missing else "false",
+            'avgTemp': averages[0],
+            'avgCo2': averages[1],
+            'avgRad': averages[2],
+            'avg03': averages[3],
+            'avgNo2': averages[4],
+            'avgCo': averages[5],
+            'avgVoc': averages[6],
+            'avgPm2_5': averages[7],
+            'avgPm10': averages[8],
+            'avgDs18': averages[9],
+            'samplxH': bucket.count
         }
         jsonObjects.append(jsonObject)
 
+    dailyValues = dailyAverages.averages
+
     completeJson = {
         'day': date,
-        'latitude': dailyAverages.avgLatitude,
-        'longitude': dailyAverages.avgLongitude,
-        'avgDailyTemp': dailyAverages.avgDailyTemp,
-        'avgDailyCo2': dailyAverages.avgDailyCo2,
-        'avgDailyRad': dailyAverages.avgDailyRad,
-        'avgDailyO3': dailyAverages.avgDailyO3,
-        'avgDailyNo2': dailyAverages.avgDailyNo2,
-        'avgDailyCo': dailyAverages.avgDailyCo,
-        'avgDailyVoc': dailyAverages.avgDailyVoc,
-        'avgDailyPm2_5': dailyAverages.avgDailyPm2_5,
-        'avgDailyPm10': dailyAverages.avgDailyPm10,
-        'avgDailyDs18': dailyAverages.avgDailyDs18,
+        'latitude': dailyValues[DailyAverage.latitudeIndex],
+        'longitude': dailyValues[DailyAverage.longitudeIndex],
+        'avgDailyTemp': dailyValues[0],
+        'avgDailyCo2': dailyValues[1],
+        'avgDailyRad': dailyValues[2],
+        'avgDailyO3': dailyValues[3],
+        'avgDailyNo2': dailyValues[4],
+        'avgDailyCo': dailyValues[5],
+        'avgDailyVoc': dailyValues[6],
+        'avgDailyPm2_5': dailyValues[7],
+        'avgDailyPm10': dailyValues[8],
+        'avgDailyDs18': dailyValues[9],
         'data': jsonObjects
     }
-    jsonResult = json.dumps(completeJson)
+    jsonResult = dumpJson(completeJson)
+    metrics().count("jsonBytes", len(jsonResult))
 
     return jsonResult
 
 
-## Function to parse the resulting csv file from request url
-def parseCsv(listCsv, samplesDict, dailyAverages, processedDate):
-    isFirstRow = True
-    lastHour = 0
-    hourDiff = 0
-
-    for row in listCsv:
-        # Reading data
-        longitude   = row[1]
-        latitude    = row[2]
-        date        = row[3]
-        co2         = row[4]
-        temperature = row[5]
-        rad         = row[6]
-        o3          = row[7]
-        no2         = row[8]
-        co          = row[9]
-        voc         = row[10]
-        pm2_5       = row[11]
-        pm10        = row[12]
-        ds18        = row[13]
-
-        # Splitting date
-        dateArray = date.split('-')
-        processedDate.year = dateArray[0]
-        processedDate.month = dateArray[1]
-        processedDate.day = dateArray[2].split(' ')[0]
-        processedDate.hour = dateArray[2].split(' ')[1].split(':')[0]
-
-        # Evaluate the sum to eval average daily values
-        dailyAverages.avgLongitude += float(longitude)
-        dailyAverages.avgLatitude += float(latitude)
-        dailyAverages.avgDailyTemp += float(temperature)
-        dailyAverages.avgDailyCo2 += float(co2)
-        dailyAverages.avgDailyRad += float(rad)
-        dailyAverages.avgDailyO3 += float(o3)
-        dailyAverages.avgDailyNo2 += float(no2)
-        dailyAverages.avgDailyCo += float(co)
-        dailyAverages.avgDailyVoc += float(voc)
-        dailyAverages.avgDailyPm2_5 += float(pm2_5)
-        dailyAverages.avgDailyPm10 += float(pm10)
-        dailyAverages.avgDailyDs18 += float(ds18)
-
-        newHour = int(processedDate.hour)
-        if isFirstRow:
-            lastHour = newHour
-            isFirstRow = False
-
-            if newHour != 23:
-                # Fill data
-                for h in range(23, newHour, -1):
-                    mapKey = processedDate.year + '-' + processedDate.month + '-' + processedDate.day + '_' + str(h).zfill(2)
-                    samplesDict[mapKey] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, "true"]
-                    fillData = True
-
-        else:
-            hourDiff = lastHour - newHour
-            fillData = False
-
-            # Fill missing data
-            if hourDiff > 1:
-                for h in range(lastHour - 1, newHour, -1):
-                    mapKey = processedDate.year + '-' + processedDate.month + '-' + processedDate.day + '_' + str(h).zfill(2)
-                    samplesDict[mapKey] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, "true"]
-                    fillData = True
-
-            lastHour = newHour
-
-            if fillData:
-                continue
-
-
-        # Build the key for dict as 'YYYY-mm-DD_hh'
-        mapKey = processedDate.year + '-' + processedDate.month + '-' + processedDate.day + '_' + processedDate.hour
-
-        # Build the dict to mantain the sum of all data per hour 
-        # and the number of samples
-        if mapKey in samplesDict:
-            dictValues = samplesDict[mapKey]
-
-            newTemp = float(dictValues[0]) + float(temperature)
-            newCo2 = float(dictValues[1]) + float(co2)
-            newRad = float(dictValues[2]) + float(rad)
-            newO3 = float(dictValues[3]) + float(o3)
-            newNo2 = float(dictValues[4]) + float(no2)
-            newCo = float(dictValues[5]) + float(co)
-            newVoc = float(dictValues[6]) + float(voc)
-            newPm2_5 = float(dictValues[7]) + float(pm2_5)
-            newPm10 = float(dictValues[8]) + float(pm10)
-            newDs18 = float(dictValues[9]) + float(ds18)
-
-            totalValues = int(dictValues[10]) + 1
-
-            samplesDict[mapKey] = [newTemp, newCo2, newRad, newO3, newNo2, newCo, newVoc, newPm2_5, newPm10, newDs18, totalValues, "false"]
-        else:
-            samplesDict[mapKey] = [temperature, co2, rad, o3, no2, co, voc, pm2_5, pm10, ds18, 1, "false"]
-
-    if lastHour != 0:
-        # Fill data
-        for h in range(lastHour - 1, -1, -1):
-            mapKey = processedDate.year + '-' + processedDate.month + '-' + processedDate.day + '_' + str(h).zfill(2)
-            samplesDict[mapKey] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, "true"]
-            fillData = True
+## Function to encode the hourly buckets of a day
+# in the binary columnar format
+@timed("buildColumns")
+def buildColumns(samplesDict):
+    hours = {}
+    for key, bucket in samplesDict.items():
+        if not bucket.missing:
+            hours[int(key.rsplit('_', 1)[1])] = (bucket.averages, bucket.count)
+
+    return encodeHours(hours)
+
+
+## Function to encode the quantile sketches of the hourly
+# buckets of a day: one property per channel, holding the
+# sketches of the 24 hours (empty for the missing ones)
+@timed("buildSketches")
+def buildSketches(samplesDict):
+    emptySketches = [QuantileSketch() for name in channelNames]
+    hourlySketches = [emptySketches] * hoursNumber
+    for key, bucket in samplesDict.items():
+        hourlySketches[int(key.rsplit('_', 1)[1])] = bucket.sketches
+
+    sketchProperties = {}
+    for index, name in enumerate(channelNames):
+        sketchProperties[sketchProperty(name)] = encodeSketches([sketches[index] for sketches in hourlySketches])
+
+    return sketchProperties
+
+
+## Util function to split the csv rows by day.
+# Rows of the same day are contiguous, so every day
+# is yielded lazily as the rows are read
+def splitCsvByDay(csvRows):
+    # Skip blank lines
+    csvRows = filter(None, csvRows)
+    return itertools.groupby(csvRows, key = lambda row: row[3].split(' ')[0])
+
+
+## Function to parse the resulting csv file from request url.
+# Rows can be any iterable (e.g. a streamed csv reader),
+# the number of parsed rows is returned
+@timed("parseCsv")
+def parseCsv(csvRows, samplesDict, dailyAverages, processedDate):
+    rowsNumber = aggregateRows(csvRows, samplesDict, dailyAverages, processedDate)
+    metrics().count("rowsParsed", rowsNumber)
+
+    return rowsNumber
 
 
 ## Function for evaluate mean values of the given dict
+@timed("averageSamples")
 def averageSamples(samplesDict):
-    for key in samplesDict:
-        dictValues = samplesDict[key]
-
-        if dictValues[11] == "true":
-            samplesDict[key] = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, "true"]
-            continue
-
-        totalValues = int(dictValues[10])
-
-        ## Round values
-        avgTemp = float("{:.2f}".format(float(dictValues[0]) / totalValues))
-        avgCo2 = float("{:.2f}".format(float(dictValues[1]) / totalValues))
-        avgRad = float("{:.2f}".format(float(dictValues[2]) / totalValues))
-        avgO3 = float("{:.2f}".format(float(dictValues[3]) / totalValues))
-        avgNo2 = float("{:.2f}".format(float(dictValues[4]) / totalValues))
-        avgCo = float("{:.2f}".format(float(dictValues[5]) / totalValues))
-        avgVoc = float("{:.2f}".format(float(dictValues[6]) / totalValues))
-        avgPm2_5 = float("{:.2f}".format(float(dictValues[7]) / totalValues))
-        avgPm10 = float("{:.2f}".format(float(dictValues[8]) / totalValues))
-        avgDs18 = float("{:.2f}".format(float(dictValues[9]) / totalValues))
-    
-        samplesDict[key] = [avgTemp, avgCo2, avgRad, avgO3, avgNo2, avgCo, avgVoc, avgPm2_5, avgPm10, avgDs18, totalValues, "false"]
+    for bucket in samplesDict.values():
+        bucket.finalize()
 
     return samplesDict
 
 
-## Main function
-def main(mytimer: func.TimerRequest) -> None:
-    logging.info('Python timer function fired.')
+## Util function to build the http session shared
+# by all the fetch workers. The connection pool is bounded
+# so that the upstream host never sees more than
+# poolSize concurrent connections. The http modules are
+# imported on first use, not when the functions are loaded
+def buildSession(poolSize, retries):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retryPolicy = Retry(
+        total = retries,
+        connect = retries,
+        read = retries,
+        backoff_factor = 0.5,
+        status_forcelist = [500, 502, 503, 504]
+    )
+    adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = poolSize, max_retries = retryPolicy, pool_block = True)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+## Util function to build the date used by the request url
+def buildDate(day):
+    return {"year": str(day.year), "month": str(day.month), "day": str(day.day)}
+
+
+## Function to aggregate the rows of a single day and
+# build the entities to be stored: the hourly samples
+# and the daily rollup
+def buildDayEntities(deviceName, dayRows):
+    samplesDict = {}
+
+    processedDate = StructuredDate()
+    dailyAverages = DailyAverage()
+
+    # Parse csv
+    rowsNumber = parseCsv(dayRows, samplesDict, dailyAverages, processedDate)
+    if rowsNumber == 0:
+        return None
+
+    jsonDate = processedDate.year + '-' + processedDate.month + '-' + processedDate.day
 
+    return buildStoredEntities(deviceName, jsonDate, samplesDict, dailyAverages)
+
+
+## Function to build the entities to be stored given
+# the accumulated values of a day
+def buildStoredEntities(deviceName, jsonDate, samplesDict, dailyAverages):
+    from azure.storage.table import Entity, EntityProperty, EdmType
+
+    # Averaging daily values
+    dailyAverages.finalize()
+
+    # Averaging dict values (per hour)
+    averageSamples(samplesDict)
+
+    # Build the json as average daily values and average for each hour
+    responseJson = buildJson(samplesDict, dailyAverages, jsonDate)
+
+    # One partition per device, one row per day: the
+    # same day of the same device always gets the same key
+    query = Entity()
+    query.PartitionKey = buildPartitionKey(deviceName)
+    query.RowKey = buildRowKey(jsonDate)
+    query.DeviceName = deviceName
+    query.SampleFormat = formatVersion
+    query.SampleColumns = EntityProperty(EdmType.BINARY, buildColumns(samplesDict))
+    if storeJson:
+        query.SampleValues = responseJson
+
+    for propertyName, sketches in buildSketches(samplesDict).items():
+        query[propertyName] = EntityProperty(EdmType.BINARY, sketches)
+
+    dailyRollup = buildRollupEntity(deviceName, dailyResolution, parseDay(query.RowKey), dailyAverages.sums, dailyAverages.count, dailyAverages.sketches)
+
+    return query, dailyRollup
+
+
+## Function to download and parse data of a single device
+# for the given date (or range of dates, if endDate is given).
+# The csv is read through the raw response cache and decoded
+# incrementally: rows are aggregated while they are read,
+# one day at a time.
+# The entities to be stored are returned
+def processDevice(session, device, startDate, endDate = None):
+    if endDate is None:
+        endDate = startDate
+
+    # Build url in order to get data from sensor
+    url = buildRequestUrl(device, startDate["year"], startDate["month"], startDate["day"],
+                          endDate["year"], endDate["month"], endDate["day"])
+
+    # Days before today won't change anymore
+    lastDay = datetime.date(int(endDate["year"]), int(endDate["month"]), int(endDate["day"]))
+    closedRange = lastDay < datetime.date.today()
+
+    dayEntities = []
+    with openResponse(session, url, (connectTimeout, readTimeout), closedRange) as responseStream:
+        # Getting csv
+        csvRows = csv.reader(responseStream, delimiter=',')
+
+        # First row is the csv header
+        header = next(csvRows, None)
+        if not header:
+            return dayEntities
+
+        deviceName = header[0]
+
+        for dayDate, dayRows in splitCsvByDay(csvRows):
+            entities = buildDayEntities(deviceName, dayRows)
+            if entities is not None:
+                dayEntities.append(entities)
+
+    return dayEntities
+
+
+## Function to download, parse and store data of a single
+# device for the given range of days, rollups included.
+# The number of stored days is returned
+def ingestRange(session, tableService, device, startDate, endDate = None):
+    dayEntities = processDevice(session, device, startDate, endDate)
+
+    updatedDays = {}
+    latestRollups = {}
+    with metrics().stage("storeEntities"):
+        with BatchWriter(tableService, samplesTableName) as samplesWriter, BatchWriter(tableService, rollupsTableName) as rollupsWriter:
+            for sampleEntity, dailyRollup in dayEntities:
+                samplesWriter.upsert(sampleEntity)
+                rollupsWriter.upsert(dailyRollup)
+                updatedDays.setdefault(sampleEntity.DeviceName, set()).add(parseDay(sampleEntity.RowKey))
+
+                latestRollup = latestRollups.get(sampleEntity.DeviceName)
+                if latestRollup is None or latestRollup.Day < dailyRollup.Day:
+                    latestRollups[sampleEntity.DeviceName] = dailyRollup
+
+    metrics().count("entitiesWritten", 2 * len(dayEntities))
+
+    with metrics().stage("updateRollups"):
+        for deviceName, days in updatedDays.items():
+            updatePeriodRollups(tableService, deviceName, days)
+
+        # Mobile stations: the position of the last ingested day
+        for deviceName, dailyRollup in latestRollups.items():
+            updatePosition(tableService, deviceName, parseDay(dailyRollup.Day), dailyRollup.AvgLatitude, dailyRollup.AvgLongitude)
+
+    # Rolling windows of the regulated pollutants
+    with metrics().stage("updateAirQuality"):
+        for deviceName, days in updatedDays.items():
+            updateAirQuality(tableService, deviceName, days)
+
+    return len(dayEntities)
+
+
+## Function to dispatch one ingest unit for each registered device.
+# Units are put on the output binding or on any object with the
+# same set method (see IngestQueue.MemoryQueue). The shared
+# table client is used unless given
+def dispatchUnits(units, invocationMetrics, tableService = None):
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
 
     dt = datetime.datetime.today()
-    year = str(dt.year)
-    month = str(dt.month)
-    day = str(dt.day)
 
     logging.info('Python timer trigger function ran at %s', utc_timestamp)
 
-    deviceName = ""
-    
-    accountName = ""
-    accountKey = ""
-
     # Retrieve devices from db
     devices = []
-    table_name = 'AirSamples'
-    table_service = None
+    table_service = tableService
     try:
-        table_service = TableService(account_name=accountName, account_key=accountKey)
-        entities = table_service.query_entities(table_name, filter = "PartitionKey eq 'Device'")
-        for entity in entities:
-            print(entity.DeviceName)
-            devices.append(entity.DeviceName)
-           
+        if table_service is None:
+            table_service = getTableService()
+        table_service.create_table(samplesTableName)
+        table_service.create_table(rollupsTableName)
+        table_service.create_table(checkpointsTableName)
+        table_service.create_table(positionsTableName)
+        table_service.create_table(airQualityTableName)
+        with invocationMetrics.stage("queryDevices"):
+            entities = table_service.query_entities(devicesTableName, filter = "PartitionKey eq 'Device'")
+            for entity in entities:
+                devices.append(entity.DeviceName)
+
     except Exception as error:
         logging.info(error)
 
     # Get day
     dates = [
-        {"year": year, "month": month, "day": day}
+        dt.date()
     ]
 
-    # Request data from configured sensors
+    # Messages of the same run share the dispatch id, so
+    # the workers can detect duplicated deliveries
+    dispatchId = utc_timestamp[:16]
+
+    messages = []
     for device in devices:
         for date in dates:
-            # Build url in order to get data from sensor
-            url = buildRequestUrl(device, date["year"], date["month"], date["day"])
-
-            samplesDict = {}
-
-            processedDate = StructuredDate()
-            dailyAverages = DailyAverage()
-
-            with requests.Session() as session:
-                response = session.get(url)
-                decodedResponse = response.content.decode('utf-8')
+            messages.append(buildUnitMessage(device, date, dispatchId))
 
-                # Getting csv
-                responseCsv = csv.reader(decodedResponse.splitlines(), delimiter=',')
-                listCsv = list(responseCsv)
+    units.set(messages)
+    invocationMetrics.count("devices", len(devices))
+    invocationMetrics.count("messages", len(messages))
+    logging.info("Dispatched " + str(len(messages)) + " ingest units")
 
-                deviceName  = listCsv[0][0]
 
-                # Remove first element (csv header)
-                listCsv.pop(0)
-
-                if len(listCsv) == 0:
-                    continue
-
-                # Parse csv
-                parseCsv(listCsv, samplesDict, dailyAverages, processedDate)
-
-                # Averaging daily values
-                dailyAverages.averageValues(len(listCsv))
-
-                # Averaging dict values (per hour)
-                averageSamples(samplesDict)
-
-                jsonDate = processedDate.year + '-' + processedDate.month + '-' + processedDate.day
-
-                newDt = int(datetime.datetime.utcnow().replace(tzinfo=pytz.utc).timestamp())
-
-                # Build the json as average daily values and average for each hour
-                responseJson = buildJson(samplesDict, dailyAverages, jsonDate)
-
-                rowKey = jsonDate
-
-                query = Entity()
-                query.PartitionKey = "AirSample"
-                query.RowKey = str(newDt)
-                query.DeviceName = deviceName
-                query.SampleValues = responseJson
+## Main function
+# The timer only dispatches the work: one message per
+# device/day is put on the ingest queue and processed
+# by the ingest_worker function, scaled out by the platform
+def main(mytimer: func.TimerRequest, units: func.Out[typing.List[str]]) -> None:
+    logging.info('Python timer function fired.')
 
-                # Insert value in db
-                table_service.insert_entity('AirSamples', query)
-                logging.info("Inserted entity in table storage")
\ No newline at end of file
+    with invocation("pull_sensor_data") as invocationMetrics:
+        dispatchUnits(units, invocationMetrics)
\ No newline at end of file
@@ -0,0 +1,227 @@
+import logging
+import csv
+import io
+import datetime
+import concurrent.futures
+import azure.functions as func
+from __app__.pull_sensor_data import buildSession, buildDate, buildRequestUrl, buildStoredEntities
+from __app__.pull_sensor_data import maxWorkers, maxHostConnections, maxRetries, connectTimeout, readTimeout
+from __app__.pull_sensor_data.DataStructures import HourlyBucket, DailyAverage
+from __app__.pull_sensor_data.Aggregation import accumulateRows, buildSamplesDict, parseRowDate, dateColumn
+from __app__.shared_code.TableLayout import devicesTableName, samplesTableName, dayFormat, quoteValue
+from __app__.shared_code.TableClient import getTableService
+from __app__.shared_code.Rollups import rollupsTableName, updatePeriodRollups
+from __app__.shared_code.AirQuality import airQualityTableName, updateAirQuality
+from __app__.shared_code.SampleCodec import propertyBytes, hoursNumber
+from __app__.shared_code.QuantileSketch import encodeSketches, decodeSketches, sketchProperty
+from __app__.shared_code.Channels import channelNames
+from __app__.shared_code.DevicePositions import positionsTableName, updatePosition
+from __app__.shared_code.Metrics import invocation, metrics, withMetrics
+
+
+## Table holding the partial aggregates of the days being
+# ingested: one partition per device, one row per day
+stateTableName = "IngestState"
+
+## Format of the stored high-water mark, the one of the csv dates
+highWaterMarkFormat = "%Y-%m-%d %H:%M:%S"
+
+
+## Class holding the partial aggregates of a device/day:
+# the sums, counts and sketches of every hour and of the whole
+# day, and the date of the most recent ingested sample
+class PartialDay:
+
+    def __init__(self, deviceName, day):
+        self.deviceName = deviceName
+        self.day = day
+        self.hourlyBuckets = [HourlyBucket(missing = True) for h in range(hoursNumber)]
+        self.dailyAverages = DailyAverage()
+        self.highWaterMark = None
+        self.finalized = False
+
+    ## Restore the aggregates given the stored entity
+    def load(self, entity):
+        buffer = memoryview(propertyBytes(entity.Accumulators))
+        self.dailyAverages = DailyAverage.fromBytes(buffer)
+
+        offset = DailyAverage.packedSize()
+        for h in range(hoursNumber):
+            self.hourlyBuckets[h] = HourlyBucket.fromBytes(buffer[offset:])
+            offset += HourlyBucket.packedSize()
+
+        # One property per channel: the sketch of the day
+        # followed by the ones of the hours
+        accumulators = [self.dailyAverages] + self.hourlyBuckets
+        for index, name in enumerate(channelNames):
+            if sketchProperty(name) in entity:
+                sketches = decodeSketches(propertyBytes(entity[sketchProperty(name)]))
+                for accumulator, sketch in zip(accumulators, sketches):
+                    accumulator.sketches[index] = sketch
+
+        self.highWaterMark = parseRowDate(entity.HighWaterMark) if entity.HighWaterMark else None
+        self.finalized = entity.Finalized
+
+    ## Build the entity used to store the aggregates
+    def toEntity(self):
+        from azure.storage.table import Entity, EntityProperty, EdmType
+
+        accumulators = self.dailyAverages.toBytes() + b"".join(bucket.toBytes() for bucket in self.hourlyBuckets)
+
+        entity = Entity()
+        entity.PartitionKey = self.deviceName
+        entity.RowKey = self.day.strftime(dayFormat)
+        entity.HighWaterMark = self.highWaterMark.strftime(highWaterMarkFormat) if self.highWaterMark else ""
+        entity.Finalized = self.finalized
+        entity.Accumulators = EntityProperty(EdmType.BINARY, accumulators)
+
+        accumulators = [self.dailyAverages] + self.hourlyBuckets
+        for index, name in enumerate(channelNames):
+            sketches = [accumulator.sketches[index] for accumulator in accumulators]
+            entity[sketchProperty(name)] = EntityProperty(EdmType.BINARY, encodeSketches(sketches))
+
+        return entity
+
+    ## Build the samples dict of the hours up to the most
+    # recent one with samples (all of them once finalized)
+    def samplesDict(self):
+        lastHour = hoursNumber - 1
+        if not self.finalized:
+            lastHour = max([h for h in range(hoursNumber) if self.hourlyBuckets[h].count > 0], default = -1)
+
+        return buildSamplesDict(self.day.strftime(dayFormat) + '_', self.hourlyBuckets, lastHour)
+
+
+## Function to load the partial aggregates of a device/day,
+# None is returned if the day has never been ingested
+def loadPartialDay(tableService, deviceName, day):
+    requestQuery = "PartitionKey eq " + quoteValue(deviceName) + " and RowKey eq " + quoteValue(day.strftime(dayFormat))
+    for entity in tableService.query_entities(stateTableName, filter = requestQuery):
+        partialDay = PartialDay(deviceName, day)
+        partialDay.load(entity)
+        return partialDay
+
+    return None
+
+
+## Function to fetch the samples of a day newer than the
+# high-water mark. Hours can be listed out of order, so
+# every row of the csv is checked against the mark
+def fetchNewSamples(session, partialDay):
+    date = buildDate(partialDay.day)
+    url = buildRequestUrl(partialDay.deviceName, date["year"], date["month"], date["day"])
+
+    with session.get(url, stream = True, timeout = (connectTimeout, readTimeout)) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+
+        responseStream = io.TextIOWrapper(response.raw, encoding = 'utf-8', newline = '')
+        csvRows = csv.reader(responseStream, delimiter=',')
+
+        # First row is the csv header
+        header = next(csvRows, None)
+        if not header:
+            return 0
+
+        highWaterMark = partialDay.highWaterMark
+        newRows = filter(None, csvRows)
+        if highWaterMark is not None:
+            newRows = (row for row in newRows if parseRowDate(row[dateColumn]) > highWaterMark)
+
+        with metrics().stage("downloadAndParse"):
+            rowsNumber, latestDate = accumulateRows(newRows, partialDay.hourlyBuckets, partialDay.dailyAverages)
+        metrics().count("rowsParsed", rowsNumber)
+
+    if rowsNumber:
+        partialDay.highWaterMark = latestDate
+
+    return rowsNumber
+
+
+## Function to merge the new samples of a device/day into the
+# stored aggregates and to update the stored samples and
+# rollups of the day. When finalize is set the day is closed:
+# all of its hours are stored and it won't be fetched again.
+# The number of new samples is returned
+def ingestIncrement(session, tableService, deviceName, day, finalize = False):
+    partialDay = loadPartialDay(tableService, deviceName, day) or PartialDay(deviceName, day)
+    if partialDay.finalized:
+        return 0
+
+    rowsNumber = fetchNewSamples(session, partialDay)
+    if rowsNumber == 0 and not finalize:
+        return 0
+
+    partialDay.finalized = finalize
+
+    # Averages don't change the sums and the counts,
+    # so the aggregates can be stored afterwards
+    samplesDict = partialDay.samplesDict()
+    if partialDay.dailyAverages.count > 0:
+        sampleEntity, dailyRollup = buildStoredEntities(deviceName, day.strftime(dayFormat), samplesDict, partialDay.dailyAverages)
+        tableService.insert_or_replace_entity(samplesTableName, sampleEntity)
+        tableService.insert_or_replace_entity(rollupsTableName, dailyRollup)
+        updatePeriodRollups(tableService, deviceName, [day])
+        updateAirQuality(tableService, deviceName, [day])
+        updatePosition(tableService, deviceName, day, dailyRollup.AvgLatitude, dailyRollup.AvgLongitude)
+
+    tableService.insert_or_replace_entity(stateTableName, partialDay.toEntity())
+
+    return rowsNumber
+
+
+## Function to ingest the new samples of a device: the
+# previous day is closed first, if it is still open
+def ingestDevice(session, tableService, deviceName, today):
+    yesterday = today - datetime.timedelta(days = 1)
+
+    rowsNumber = 0
+    previousDay = loadPartialDay(tableService, deviceName, yesterday)
+    if previousDay is not None and not previousDay.finalized:
+        rowsNumber += ingestIncrement(session, tableService, deviceName, yesterday, finalize = True)
+
+    rowsNumber += ingestIncrement(session, tableService, deviceName, today)
+
+    return rowsNumber
+
+
+## Function to ingest the new samples of all the registered devices
+def ingestDevices():
+    today = datetime.datetime.today().date()
+
+    # Retrieve devices from db
+    devices = []
+    tableService = getTableService()
+    try:
+        tableService.create_table(samplesTableName)
+        tableService.create_table(rollupsTableName)
+        tableService.create_table(stateTableName)
+        tableService.create_table(positionsTableName)
+        tableService.create_table(airQualityTableName)
+        entities = tableService.query_entities(devicesTableName, filter = "PartitionKey eq 'Device'")
+        for entity in entities:
+            devices.append(entity.DeviceName)
+
+    except Exception as error:
+        logging.info(error)
+        return
+
+    session = buildSession(maxHostConnections, maxRetries)
+    with concurrent.futures.ThreadPoolExecutor(max_workers = maxWorkers) as executor:
+        futures = {executor.submit(withMetrics(ingestDevice), session, tableService, device, today): device for device in devices}
+
+        for future in concurrent.futures.as_completed(futures):
+            device = futures[future]
+            try:
+                rowsNumber = future.result()
+                logging.info("Ingested " + str(rowsNumber) + " new samples of " + device)
+            except Exception as error:
+                logging.error("Incremental ingest of " + device + " failed: " + str(error))
+
+
+## Main function
+def main(mytimer: func.TimerRequest) -> None:
+    logging.info('Python timer function fired.')
+
+    with invocation("pull_sensor_incremental"):
+        ingestDevices()
\ No newline at end of file
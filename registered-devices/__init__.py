@@ -1,40 +1,44 @@
 import logging
-import json
-import requests
 import azure.functions as func
-import azure.storage.table
-from azure.storage.table import TableService, Entity
+from __app__.shared_code.TableClient import getTableServiceOrError
+from __app__.shared_code.ResponseCache import buildCacheKey, cachedResponse
+from __app__.shared_code.ResponseEncoding import responseFormats, dumpJson, toColumns
+from __app__.shared_code.Metrics import invocation
 
 
 ## Function to query Azure db to get all
-# configured devices
-def getStoredDevices(tableName, tableService):
+# configured devices, as a list or as columns
+def getStoredDevices(tableName, tableService, responseFormat = "rows"):
     response = {}
     jsonResponse = {}
     devices = []
     deviceEntry = {}
 
-    try:
-        # Query db
-        entities = tableService.query_entities(tableName, filter = "PartitionKey eq 'Device'")
+    with invocation("registered-devices") as invocationMetrics:
+        try:
+            # Query db
+            entities = tableService.query_entities(tableName, filter = "PartitionKey eq 'Device'")
 
-        for entity in entities:
-            print(entity)
-            deviceEntry = {
-                "deviceName" : entity.DeviceName,
-                "latitude"   : entity.Latitude,
-                "longitude"  : entity.Longitude
-            }
-            devices.append(deviceEntry)
+            for entity in entities:
+                deviceEntry = {
+                    "deviceName" : entity.DeviceName,
+                    "latitude"   : entity.Latitude,
+                    "longitude"  : entity.Longitude
+                }
+                devices.append(deviceEntry)
 
-        logging.info(devices)
+            # Build json response
+            if responseFormat == "columns":
+                response = toColumns(devices, ["deviceName", "latitude", "longitude"])
+            else:
+                response = { "devices" : devices }
+            jsonResponse = dumpJson(response)
 
-        # Build json response
-        response = { "devices" : devices }
-        jsonResponse = json.dumps(response) 
+        except Exception as error:
+            logging.info(error)
 
-    except Exception as error:
-        logging.info(error)
+        invocationMetrics.count("devices", len(devices))
+        invocationMetrics.count("jsonBytes", len(jsonResponse))
 
     return jsonResponse
 
@@ -43,22 +47,20 @@ def getStoredDevices(tableName, tableService):
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
-    accountName = ""
-    accountKey = ""
-
     # Instantiate db connection
     tableName = 'AirSamples'
-    tableService = None
-    try:
-        tableService = TableService(account_name=accountName, account_key=accountKey)    
-    except Exception as error:
-        logging.info(error)
+    tableService, errorResponse = getTableServiceOrError()
+    if errorResponse is not None:
+        return errorResponse
+
+    responseFormat = req.params.get('format', "rows")
+    if responseFormat not in responseFormats:
         return func.HttpResponse(
-            "Unable to connect to Azure Table",
-            status_code=500)
+            "Unable to parse requested format: should be one of " + ", ".join(responseFormats),
+            status_code=400)
 
     logging.info('Requested registered devices')
 
-    # Return response
-    jsonResponse = getStoredDevices(tableName, tableService)
-    return func.HttpResponse(jsonResponse, mimetype="application/json")
\ No newline at end of file
+    # Return response, devices only change with the daily ingest
+    cacheKey = buildCacheKey("registered-devices", { "format": responseFormat })
+    return cachedResponse(req, cacheKey, lambda: getStoredDevices(tableName, tableService, responseFormat))
\ No newline at end of file
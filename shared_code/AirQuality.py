@@ -0,0 +1,259 @@
+import os
+import json
+import math
+import datetime
+from collections import deque
+from .Channels import channelNames
+from .TableLayout import samplesTableName, dayFormat, buildPartitionKey, buildRangeQuery, parseDay
+from .TableQuery import queryPages
+from .TableWriter import BatchWriter
+from .SampleCodec import SampleColumns, propertyBytes, hourlyKeys, hoursNumber
+
+
+## Table holding the daily air quality of the devices: one
+# partition per device, one row per day ('YYYY-mm-dd' key)
+airQualityTableName = "DeviceAirQuality"
+
+## Regulated pollutants and the hours of their rolling means
+windowHours = {"O3": 8, "Co": 8, "Pm2_5": 24, "Pm10": 24}
+pollutantNames = tuple(windowHours)
+
+## A rolling mean is valid with at least 75% of its hours
+minWindowHours = {name: math.ceil(hours * 0.75) for name, hours in windowHours.items()}
+
+## Limit values of the daily statistic of each pollutant: the
+# max 8-hour mean for O3 and CO, the 24-hour mean for PM. Default
+# values are the EU directive ones (ug/m3, CO in mg/m3)
+limitValues = {
+    "O3": float(os.environ.get("AIR_QUALITY_LIMIT_O3", "120")),
+    "Co": float(os.environ.get("AIR_QUALITY_LIMIT_CO", "10")),
+    "Pm2_5": float(os.environ.get("AIR_QUALITY_LIMIT_PM2_5", "25")),
+    "Pm10": float(os.environ.get("AIR_QUALITY_LIMIT_PM10", "50"))
+}
+
+## AQI breakpoints (US EPA) of the daily statistic of each
+# pollutant, as (concentration, index) pairs from (0, 0). The
+# O3 and CO ppm breakpoints are converted to ug/m3 and mg/m3
+# (1.963 ug/m3 per O3 ppb, 1.145 mg/m3 per CO ppm)
+aqiBreakpoints = {
+    "O3": ((106.0, 50), (137.4, 100), (166.9, 150), (206.1, 200), (392.6, 300)),
+    "Co": ((5.04, 50), (10.76, 100), (14.2, 150), (17.63, 200), (34.81, 300), (57.71, 500)),
+    "Pm2_5": ((9.0, 50), (35.4, 100), (55.4, 150), (125.4, 200), (225.4, 300), (325.4, 500)),
+    "Pm10": ((54.0, 50), (154.0, 100), (254.0, 150), (354.0, 200), (424.0, 300), (604.0, 500))
+}
+
+## Class maintaining the mean of the last hours of a series
+# with running sums: pushing an hour is O(1). Missing hours
+# (None) take their place in the window without a value.
+# Hourly values have two decimals: sums are kept in
+# hundredths, so adding and removing values never drifts
+class RollingMean:
+    __slots__ = ("hours", "values", "total", "count")
+
+    def __init__(self, hours):
+        self.hours  = hours
+        self.values = deque()
+        self.total  = 0
+        self.count  = 0
+
+    def push(self, value):
+        if len(self.values) == self.hours:
+            oldest = self.values.popleft()
+            if oldest is not None:
+                self.total -= oldest
+                self.count -= 1
+
+        if value is not None:
+            value = round(value * 100)
+            self.total += value
+            self.count += 1
+
+        self.values.append(value)
+
+    ## Mean of the window, None without enough hours
+    def mean(self, minHours):
+        if self.count < minHours:
+            return None
+
+        return self.total / self.count / 100
+
+
+## Util function returning the AQI of a concentration, linearly
+# interpolated between the breakpoints of the pollutant
+def aqiIndex(name, concentration):
+    lowConcentration, lowIndex = 0.0, 0
+    for highConcentration, highIndex in aqiBreakpoints[name]:
+        if concentration <= highConcentration:
+            return round(lowIndex + (concentration - lowConcentration) * (highIndex - lowIndex) / (highConcentration - lowConcentration))
+        lowConcentration, lowIndex = highConcentration, highIndex
+
+    # Beyond the index
+    return lowIndex
+
+
+## Function to evaluate the air quality of a day given its
+# hourly values and the ones of the previous day (one list
+# of 24 hours per pollutant, None for the missing hours).
+# Rolling means ending at every hour of the day are evaluated,
+# the windows are started with the last hours of the previous
+# day. The statistics of the day are returned per pollutant
+def evaluateDay(previousHours, hours):
+    statistics = {}
+
+    for name in pollutantNames:
+        window = RollingMean(windowHours[name])
+        for value in previousHours[name][hoursNumber - windowHours[name] + 1:]:
+            window.push(value)
+
+        peak = None
+        exceedHours = 0
+        for value in hours[name]:
+            window.push(value)
+            mean = window.mean(minWindowHours[name])
+            if mean is None:
+                continue
+
+            if peak is None or mean > peak:
+                peak = mean
+            if mean > limitValues[name]:
+                exceedHours += 1
+
+        # The 24-hour statistic is the mean of the calendar day
+        daily = peak
+        if windowHours[name] == hoursNumber:
+            daily = window.mean(minWindowHours[name])
+
+        statistics[name] = {
+            "daily": daily,
+            "peak": peak,
+            "exceedHours": exceedHours,
+            "exceeds": daily is not None and daily > limitValues[name],
+            "aqi": aqiIndex(name, daily) if daily is not None else None
+        }
+
+    return statistics
+
+
+## Util function returning the hours of a day without samples
+def emptyHours():
+    return {name: [None] * hoursNumber for name in pollutantNames}
+
+
+## Function to build the air quality entity of a device/day.
+# Statistics without enough hours are not stored
+def buildAirQualityEntity(deviceName, day, statistics):
+    from azure.storage.table import Entity
+
+    entity = Entity()
+    entity.PartitionKey = buildPartitionKey(deviceName)
+    entity.RowKey = day.strftime(dayFormat)
+    entity.DeviceName = deviceName
+    entity.Day = day.strftime(dayFormat)
+
+    aqi = None
+    for name in pollutantNames:
+        values = statistics[name]
+        entity["ExceedHours" + name] = values["exceedHours"]
+        entity["Exceeds" + name] = values["exceeds"]
+
+        if values["daily"] is not None:
+            entity["Daily" + name] = round(values["daily"], 2)
+            entity["Peak" + name] = round(values["peak"], 2)
+            entity["Aqi" + name] = values["aqi"]
+
+            if aqi is None or values["aqi"] > aqi:
+                aqi = values["aqi"]
+                entity.AqiPollutant = name
+
+    if aqi is not None:
+        entity.Aqi = aqi
+
+    return entity
+
+
+## Function returning the hourly values of the pollutants of
+# the stored days between startDay and endDay, as a dict
+# day -> values (one list of 24 hours per pollutant)
+def loadHourlyValues(tableService, deviceName, startDay, endDay):
+    indexes = {name: channelNames.index(name) for name in pollutantNames}
+
+    days = {}
+    requestQuery = buildRangeQuery(deviceName, startDay.strftime(dayFormat), endDay.strftime(dayFormat))
+    for entity in queryPages(tableService, samplesTableName, requestQuery):
+        hours = {}
+        if "SampleColumns" in entity:
+            columns = SampleColumns(propertyBytes(entity.SampleColumns))
+            for name, index in indexes.items():
+                channel = columns.channel(index)
+                hours[name] = [None if columns.isMissing(h) else round(channel[h], 2) for h in range(hoursNumber)]
+        else:
+            hourlySamples = {int(hourSample["time"].rsplit("_", 1)[1]): hourSample for hourSample in json.loads(entity.SampleValues)["data"]
+                             if hourSample["missingData"] != "true"}
+            for name, index in indexes.items():
+                hours[name] = [hourlySamples[h][hourlyKeys[index]] if h in hourlySamples else None for h in range(hoursNumber)]
+
+        days[parseDay(entity.RowKey)] = hours
+
+    return days
+
+
+## Function to update the stored air quality of the given days
+# of a device. The first hours of a day depend on the previous
+# one, so the day after each updated day is evaluated again.
+# Runs of consecutive days are read at once, together with the
+# day before them: each day is evaluated in a single pass. The
+# number of updated days is returned
+def updateAirQuality(tableService, deviceName, days):
+    oneDay = datetime.timedelta(days = 1)
+    days = sorted(set(days) | {day + oneDay for day in days})
+
+    runs = []
+    for day in days:
+        if runs and runs[-1][1] == day - oneDay:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+
+    updated = 0
+    with BatchWriter(tableService, airQualityTableName) as writer:
+        for startDay, endDay in runs:
+            hourlyValues = loadHourlyValues(tableService, deviceName, startDay - oneDay, endDay)
+
+            day = startDay
+            while day <= endDay:
+                hours = hourlyValues.get(day)
+                if hours is not None:
+                    previousHours = hourlyValues.get(day - oneDay) or emptyHours()
+                    writer.upsert(buildAirQualityEntity(deviceName, day, evaluateDay(previousHours, hours)))
+                    updated += 1
+
+                day += oneDay
+
+    return updated
+
+
+## Function to query the stored air quality of a device
+# for the days between startDay and endDay (included)
+def queryAirQuality(tableService, deviceName, startDay, endDay):
+    requestQuery = buildRangeQuery(deviceName, startDay.strftime(dayFormat), endDay.strftime(dayFormat))
+    return queryPages(tableService, airQualityTableName, requestQuery)
+
+
+## Util function returning the statistics of an air quality
+# entity with the keys used by the responses, None for the
+# statistics without enough hours
+def airQualityValues(entity):
+    values = {
+        "day"           : entity.Day,
+        "aqi"           : entity.get("Aqi"),
+        "aqiPollutant"  : entity.get("AqiPollutant")
+    }
+
+    for name in pollutantNames:
+        values["daily" + name] = entity.get("Daily" + name)
+        values["peak" + name] = entity.get("Peak" + name)
+        values["aqi" + name] = entity.get("Aqi" + name)
+        values["exceedHours" + name] = entity["ExceedHours" + name]
+        values["exceeds" + name] = entity["Exceeds" + name]
+
+    return values
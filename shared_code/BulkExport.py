@@ -0,0 +1,174 @@
+import os
+import json
+import zlib
+import base64
+import binascii
+import datetime
+from .TableLayout import devicesTableName, samplesTableName, dayFormat, buildRangeQuery, parseDay
+from .TableQuery import queryPages
+from .SampleCodec import decodeHourlySamples, propertyBytes, hourlyKeys
+from .ResponseEncoding import dumpJson, gzipLevel
+from .Metrics import metrics
+
+
+## Formats of the exported records: one json object per
+# line or csv rows, both one record per device hour
+exportFormats = ("ndjson", "csv")
+exportMimetypes = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+## Keys of the exported records, also the csv header
+exportKeys = ("deviceName", "time") + hourlyKeys + ("samplxH",)
+
+## Uncompressed bytes of an export page. A page ends with
+# the first day going over it, the following days are left
+# to the next page. Days are read 1000 at a time (the table
+# storage max)
+maxPageBytes = int(os.environ.get("EXPORT_MAX_PAGE_BYTES", str(16 * 1024 * 1024)))
+exportPageSize = 1000
+
+
+## Util function to encode the cursor of the next page: the
+# last exported day of a device, as an opaque url safe token
+def encodeCursor(deviceName, day):
+    token = dumpJson([deviceName, day]).encode("utf-8")
+    return base64.urlsafe_b64encode(token).decode("ascii").rstrip("=")
+
+
+## Util function to decode a cursor to the device and the
+# last exported day, None is returned if it is not valid
+def decodeCursor(cursor):
+    try:
+        token = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        deviceName, day = json.loads(token.decode("utf-8"))
+        if not deviceName.isalnum():
+            return None
+        return deviceName, parseDay(day)
+    except (binascii.Error, UnicodeDecodeError, TypeError, AttributeError, ValueError):
+        return None
+
+
+## Function returning the sorted names of the registered devices
+def queryDeviceNames(tableService):
+    entities = queryPages(tableService, devicesTableName, "PartitionKey eq 'Device'", select = "DeviceName")
+    return sorted(set(entity.DeviceName for entity in entities))
+
+
+## Util function returning the hours of a stored day with
+# samples, whatever the layout the day is stored with
+def sampledHours(entity):
+    if "SampleValues" in entity:
+        hourlySamples = json.loads(entity.SampleValues)["data"]
+    else:
+        hourlySamples = decodeHourlySamples(propertyBytes(entity.SampleColumns), entity.RowKey)
+
+    return [hourSample for hourSample in hourlySamples if hourSample["missingData"] != "true"]
+
+
+## Generator returning the stored days of the devices (sorted
+# by name) between startDay and endDay, device by device, as
+# (device name, day, sampled hours). Days are read page by
+# page following the continuation tokens, only one page is
+# kept in memory. With a cursor the export is resumed after
+# its device and day
+def iterExportDays(tableService, deviceNames, startDay, endDay, cursor = None):
+    for deviceName in deviceNames:
+        fromDay = startDay
+        if cursor is not None:
+            cursorDevice, cursorDay = cursor
+            if deviceName < cursorDevice:
+                continue
+            if deviceName == cursorDevice:
+                fromDay = max(startDay, cursorDay + datetime.timedelta(days = 1))
+
+        if fromDay > endDay:
+            continue
+
+        requestQuery = buildRangeQuery(deviceName, fromDay.strftime(dayFormat), endDay.strftime(dayFormat))
+        for entity in queryPages(tableService, samplesTableName, requestQuery, pageSize = exportPageSize):
+            yield deviceName, entity.RowKey, sampledHours(entity)
+
+
+## Util function encoding the hours of a device as ndjson lines
+def ndjsonRecords(deviceName, hourlySamples):
+    lines = []
+    for hourSample in hourlySamples:
+        record = {"deviceName": deviceName}
+        for key in exportKeys[1:]:
+            record[key] = hourSample[key]
+        lines.append(dumpJson(record) + "\n")
+
+    return "".join(lines)
+
+
+## Util function encoding the hours of a device as csv rows.
+# Device names are alphanumeric and the other fields are
+# times and numbers, so no field needs to be quoted
+def csvRecords(deviceName, hourlySamples):
+    return "".join(deviceName + "," + ",".join(str(hourSample[key]) for key in exportKeys[1:]) + "\n"
+                   for hourSample in hourlySamples)
+
+
+exportEncoders = {"ndjson": ndjsonRecords, "csv": csvRecords}
+
+
+## Class collecting the chunks of an export page, compressed
+# as they are written when gzip is requested: the uncompressed
+# page is never kept as a whole
+class PageWriter:
+    __slots__ = ("chunks", "compressor", "rawBytes")
+
+    def __init__(self, compress = False):
+        self.chunks     = []
+        self.compressor = zlib.compressobj(gzipLevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+        self.rawBytes   = 0
+
+    def write(self, text):
+        data = text.encode("utf-8")
+        self.rawBytes += len(data)
+
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        if data:
+            self.chunks.append(data)
+
+    ## Return the body of the page
+    def close(self):
+        if self.compressor is not None:
+            self.chunks.append(self.compressor.flush())
+
+        return b"".join(self.chunks)
+
+
+## Function building a page of the export of the devices between
+# startDay and endDay, starting after the given cursor (None for
+# the first page). The body and the cursor of the next page are
+# returned, the cursor is None once the export is completed. The
+# csv header is only written in the first page, so the pages can
+# be concatenated
+def buildExportPage(tableService, deviceNames, startDay, endDay, exportFormat = "ndjson", cursor = None,
+                    compress = False, maxBytes = maxPageBytes):
+    encodeRecords = exportEncoders[exportFormat]
+    writer = PageWriter(compress)
+
+    if exportFormat == "csv" and cursor is None:
+        writer.write(",".join(exportKeys) + "\n")
+
+    nextCursor = None
+    records = 0
+    for deviceName, day, hourlySamples in iterExportDays(tableService, deviceNames, startDay, endDay, cursor):
+        if nextCursor is not None:
+            # There is at least another day: the page ends here
+            break
+
+        writer.write(encodeRecords(deviceName, hourlySamples))
+        records += len(hourlySamples)
+
+        if writer.rawBytes >= maxBytes:
+            nextCursor = encodeCursor(deviceName, day)
+    else:
+        nextCursor = None
+
+    metrics().count("exportRecords", records)
+    metrics().count("exportBytes", writer.rawBytes)
+
+    return writer.close(), nextCursor
@@ -0,0 +1,13 @@
+## Names of the sampled channels, in the order used
+# by the accumulators and by the stored rollups
+channelNames = ("Temp", "Co2", "Rad", "O3", "No2", "Co", "Voc", "Pm2_5", "Pm10", "Ds18")
+
+## Channels followed by the position of the device,
+# as kept by the daily accumulators
+positionNames = ("Latitude", "Longitude")
+dailyNames = channelNames + positionNames
+
+
+## Util function returning the response key of a channel
+def responseKey(channelName):
+    return "avg" + channelName
@@ -0,0 +1,45 @@
+import hashlib
+import datetime
+from .TableLayout import quoteValue
+from .TableQuery import queryPages
+
+
+## Table holding the completed units of the ingestion jobs:
+# one partition per job, one row per completed unit
+checkpointsTableName = "IngestCheckpoints"
+
+
+## Util function to build a stable job id given its kind
+# and the params identifying it
+def buildJobId(kind, *params):
+    digest = hashlib.sha1("|".join(params).encode("utf-8")).hexdigest()
+    return kind + "-" + digest[:20]
+
+
+## Function returning the keys of the completed units of a job
+def loadCheckpoints(tableService, jobId):
+    requestQuery = "PartitionKey eq " + quoteValue(jobId)
+    entities = queryPages(tableService, checkpointsTableName, requestQuery, select = "RowKey")
+
+    return set(entity.RowKey for entity in entities)
+
+
+## Function to check if a single unit of a job has been completed
+def isCompleted(tableService, jobId, unitKey):
+    requestQuery = "PartitionKey eq " + quoteValue(jobId) + " and RowKey eq " + quoteValue(unitKey)
+    entities = tableService.query_entities(checkpointsTableName, filter = requestQuery, select = "RowKey")
+
+    return any(True for entity in entities)
+
+
+## Function to mark a unit of a job as completed
+def saveCheckpoint(tableService, jobId, unitKey, **values):
+    from azure.storage.table import Entity
+
+    entity = Entity()
+    entity.PartitionKey = jobId
+    entity.RowKey = unitKey
+    entity.CompletedAt = datetime.datetime.utcnow().replace(tzinfo = datetime.timezone.utc).isoformat()
+    entity.update(values)
+
+    tableService.insert_or_replace_entity(checkpointsTableName, entity)
@@ -0,0 +1,45 @@
+from .TableLayout import dayFormat, quoteValue
+
+
+## Table holding the last known position of the devices,
+# updated by the ingestion: one row per device
+positionsTableName = "DevicePositions"
+positionsPartition = "Position"
+
+
+## Function returning the last known positions of the
+# devices, as a dict device -> (latitude, longitude). The
+# table is created by the first ingestion
+def loadPositions(tableService):
+    from azure.common import AzureMissingResourceHttpError
+
+    try:
+        entities = tableService.query_entities(positionsTableName, filter = "PartitionKey eq " + quoteValue(positionsPartition))
+        return {entity.RowKey: (entity.Latitude, entity.Longitude) for entity in entities}
+    except AzureMissingResourceHttpError:
+        return {}
+
+
+## Function to update the position of a device given the
+# averages of an ingested day. Older days (e.g. backfills)
+# don't overwrite the position of a more recent one
+def updatePosition(tableService, deviceName, day, latitude, longitude):
+    from azure.storage.table import Entity
+
+    dayStr = day.strftime(dayFormat)
+
+    requestQuery = "PartitionKey eq " + quoteValue(positionsPartition) + " and RowKey eq " + quoteValue(deviceName)
+    for entity in tableService.query_entities(positionsTableName, filter = requestQuery, select = "Day"):
+        if entity.Day > dayStr:
+            return False
+
+    entity = Entity()
+    entity.PartitionKey = positionsPartition
+    entity.RowKey = deviceName
+    entity.Day = dayStr
+    entity.Latitude = latitude
+    entity.Longitude = longitude
+
+    tableService.insert_or_replace_entity(positionsTableName, entity)
+
+    return True
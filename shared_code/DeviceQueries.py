@@ -0,0 +1,229 @@
+import json
+import datetime
+from array import array
+from .TableLayout import devicesTableName, buildRangeQuery, parseDay
+from .Rollups import chooseResolution, queryRollups, queryCoveringRollups, readRollupSketches, rollupValues
+from .TableQuery import queryPages
+from .SampleCodec import SampleColumns, decodeHourlySamples, propertyBytes, hourlyKeys, hoursNumber
+from .Channels import channelNames, responseKey
+from .Downsampling import chooseSourceResolution, downsampleSeries
+from .ResponseEncoding import dumpJson
+from .QuantileSketch import QuantileSketch
+
+
+## Beginning of the hourly samples in the stored json
+dataMarker = '"data":['
+
+## Maximum number of points of a downsampled response
+maxPoints = 10000
+
+## Quantiles returned for each channel, besides min and max
+quantileLevels = (("p50", 0.5), ("p95", 0.95))
+
+
+## Util function returning the hourly samples of a stored
+# day as json list items. The stored json is written compact,
+# as the response, and ends with the hourly samples: they are
+# copied as they are without parsing. Days stored before with
+# the default separators are encoded again
+def hourlySamplesJson(sampleValues):
+    start = sampleValues.rfind(dataMarker)
+    if start == -1 or not sampleValues.endswith("]}"):
+        sample = json.loads(sampleValues)
+        return dumpJson(sample["data"])[1:-1]
+
+    return sampleValues[start + len(dataMarker):-2]
+
+
+## Generator emitting the json response chunk by chunk.
+# The resolution is chosen up front from the requested days,
+# so results are read page by page in a single pass
+def iterDeviceInfo(tableName, tableService, devName, startTime, endTime):
+    requestedDays = daysBetween(startTime, endTime)
+
+    # If the dataset need to be shorter (a lot of data has been requested)
+    # the coarsest precomputed resolution is used
+    resolution = chooseResolution(requestedDays)
+
+    yield '{"samples":['
+    separator = ""
+
+    if resolution is None:
+        # Samples are partitioned by device and keyed by day
+        requestQuery = buildRangeQuery(devName, startTime, endTime)
+        entities = queryPages(tableService, tableName, requestQuery)
+
+        for entity in entities:
+            if "SampleValues" in entity:
+                hourlySamples = hourlySamplesJson(entity.SampleValues)
+            else:
+                # Only the binary columns are stored
+                hourlySamples = dumpJson(decodeHourlySamples(propertyBytes(entity.SampleColumns), entity.RowKey))[1:-1]
+
+            if hourlySamples:
+                yield separator + hourlySamples
+                separator = ","
+    else:
+        entities = queryRollups(tableService, devName, resolution, parseDay(startTime), parseDay(endTime))
+
+        for entity in entities:
+            dailySample = {
+                "time"          : entity.Day,
+                "missingData"   : "false"
+            }
+            dailySample.update(rollupValues(entity))
+            yield separator + dumpJson(dailySample)
+            separator = ","
+
+    yield "]}"
+
+
+## Function to read the series of the requested days with
+# the given resolution (None means hourly data). Missing
+# hours are skipped. The times, their positions in hours,
+# one column per channel and the response keys are returned
+def loadSeries(tableName, tableService, devName, startTime, endTime, resolution):
+    times = []
+    x = array('d')
+    columns = [array('d') for name in channelNames]
+
+    if resolution is None:
+        requestQuery = buildRangeQuery(devName, startTime, endTime)
+
+        for entity in queryPages(tableService, tableName, requestQuery):
+            dayHours = parseDay(entity.RowKey).toordinal() * hoursNumber
+
+            if "SampleColumns" in entity:
+                sampleColumns = SampleColumns(propertyBytes(entity.SampleColumns))
+                hours = [h for h in range(hoursNumber) if not sampleColumns.isMissing(h)]
+                for index, column in enumerate(columns):
+                    channel = sampleColumns.channel(index)
+                    column.extend(channel[h] for h in hours)
+            else:
+                hourlySamples = [hourSample for hourSample in json.loads(entity.SampleValues)["data"] if hourSample["missingData"] != "true"]
+                hours = [int(hourSample["time"].rsplit("_", 1)[1]) for hourSample in hourlySamples]
+                for key, column in zip(hourlyKeys, columns):
+                    column.extend(hourSample[key] for hourSample in hourlySamples)
+
+            times.extend(entity.RowKey + "_" + str(h).zfill(2) for h in hours)
+            x.extend(dayHours + h for h in hours)
+
+        return times, x, columns, hourlyKeys
+
+    for entity in queryRollups(tableService, devName, resolution, parseDay(startTime), parseDay(endTime)):
+        times.append(entity.Day)
+        x.append(parseDay(entity.Day).toordinal() * hoursNumber)
+        for name, column in zip(channelNames, columns):
+            column.append(entity["Avg" + name])
+
+    return times, x, columns, [responseKey(name) for name in channelNames]
+
+
+## Function to read the series of the requested days, downsampled
+# to the requested number of points. The series is read with the
+# coarsest resolution still giving enough points. Without points
+# the default resolution of the requested days is used
+def loadDownsampledSeries(tableName, tableService, devName, startTime, endTime, points = None, mode = "mean", channelIndex = 0):
+    requestedDays = daysBetween(startTime, endTime)
+    if points is None:
+        times, x, columns, keys = loadSeries(tableName, tableService, devName, startTime, endTime, chooseResolution(requestedDays))
+        return times, columns, keys
+
+    resolution = chooseSourceResolution(requestedDays, points)
+    times, x, columns, keys = loadSeries(tableName, tableService, devName, startTime, endTime, resolution)
+    times, columns = downsampleSeries(times, x, columns, points, mode, channelIndex)
+
+    return times, columns, keys
+
+
+## Function returning the series of the requested days in
+# a column-oriented shape: one list of values per key
+def buildSeriesColumns(tableName, tableService, devName, startTime, endTime, points = None, mode = "mean", channelIndex = 0):
+    times, columns, keys = loadDownsampledSeries(tableName, tableService, devName, startTime, endTime, points, mode, channelIndex)
+
+    seriesColumns = {"time": times}
+    for key, column in zip(keys, columns):
+        seriesColumns[key] = [round(value, 2) for value in column]
+
+    return seriesColumns
+
+
+## Generator emitting the json response downsampled to the
+# requested number of points
+def iterDownsampledInfo(tableName, tableService, devName, startTime, endTime, points, mode, channelIndex):
+    times, columns, keys = loadDownsampledSeries(tableName, tableService, devName, startTime, endTime, points, mode, channelIndex)
+
+    yield '{"samples":['
+    separator = ""
+
+    for i, time in enumerate(times):
+        sample = {
+            "time"          : time,
+            "missingData"   : "false"
+        }
+        for key, column in zip(keys, columns):
+            sample[key] = round(column[i], 2)
+
+        yield separator + dumpJson(sample)
+        separator = ","
+
+    yield "]}"
+
+
+## Function returning the quantiles of each channel over the
+# requested days, evaluated merging the sketches of the rollups
+# covering them: no sample is read, whatever the range
+def queryQuantiles(tableService, devName, startTime, endTime):
+    sketches = [QuantileSketch() for name in channelNames]
+
+    for entity in queryCoveringRollups(tableService, devName, parseDay(startTime), parseDay(endTime)):
+        entitySketches = readRollupSketches(entity)
+        if entitySketches is not None:
+            for sketch, entitySketch in zip(sketches, entitySketches):
+                sketch.merge(entitySketch)
+
+    quantiles = {}
+    for name, sketch in zip(channelNames, sketches):
+        values = {"samples": sketch.count}
+        for key, q in (("min", 0),) + quantileLevels + (("max", 1),):
+            value = sketch.quantile(q)
+            values[key] = round(value, 2) if value is not None else None
+
+        quantiles[name] = values
+
+    return quantiles
+
+
+## Util function to add a member to an encoded json object
+def appendMember(jsonObject, key, value):
+    return jsonObject[:-1] + "," + dumpJson(key) + ":" + dumpJson(value) + "}"
+
+
+## Util function to evaluate date difference
+def daysBetween(d1, d2):
+    d1 = datetime.datetime.strptime(d1, "%Y-%m-%d")
+    d2 = datetime.datetime.strptime(d2, "%Y-%m-%d")
+    return abs((d2 - d1).days)
+
+
+## Util function to evaluate if requested date
+# format is corrects
+def dateValidation(dateStr):
+    dateFormat = "%Y-%m-%d"
+
+    try:
+      datetime.datetime.strptime(dateStr, dateFormat)
+      return True
+    except ValueError:
+      return False
+
+
+## Function returning the registered devices with their position
+def queryDevices(tableService):
+    entities = tableService.query_entities(devicesTableName, filter = "PartitionKey eq 'Device'")
+
+    return [{
+        "deviceName" : entity.DeviceName,
+        "latitude"   : entity.Latitude,
+        "longitude"  : entity.Longitude
+    } for entity in entities]
@@ -0,0 +1,90 @@
+import math
+from array import array
+from .Rollups import resolutionThresholds
+
+
+## Supported downsampling modes: an aggregate of every
+# bucket, or the point of the bucket chosen by the
+# largest-triangle-three-buckets algorithm
+downsampleModes = ("mean", "min", "max", "lttb")
+
+## Approximate days covered by a value of each resolution
+resolutionDays = {"M": 30, "W": 7, "D": 1}
+
+bucketReducers = {
+    "mean": lambda values: math.fsum(values) / len(values),
+    "min": min,
+    "max": max
+}
+
+
+## Util function to choose the coarsest resolution giving at
+# least the requested number of points. None means hourly data
+def chooseSourceResolution(requestedDays, points):
+    for resolution, minDays in resolutionThresholds:
+        if requestedDays >= minDays and requestedDays // resolutionDays[resolution] >= points:
+            return resolution
+
+    return None
+
+
+## Util function returning the (start, end) bounds of the
+# buckets splitting length values, as equal as possible
+def bucketBounds(length, points):
+    return [(length * b // points, length * (b + 1) // points) for b in range(points)]
+
+
+## Function returning the indexes of the points kept by the
+# largest-triangle-three-buckets algorithm. The first and the
+# last points are always kept, every bucket in between keeps
+# the point forming the largest triangle with the point kept
+# from the previous bucket and the average of the next one
+def lttbIndexes(x, y, points):
+    length = len(y)
+    if points >= length:
+        return list(range(length))
+    if points < 3:
+        return [0, length - 1][:points]
+
+    bounds = bucketBounds(length - 2, points - 2)
+    indexes = [0]
+
+    for b, (start, end) in enumerate(bounds):
+        if b + 1 < len(bounds):
+            nextStart, nextEnd = bounds[b + 1]
+            nextStart += 1
+            nextEnd += 1
+        else:
+            nextStart, nextEnd = length - 1, length
+
+        cx = math.fsum(x[nextStart:nextEnd]) / (nextEnd - nextStart)
+        cy = math.fsum(y[nextStart:nextEnd]) / (nextEnd - nextStart)
+        ax = x[indexes[-1]]
+        ay = y[indexes[-1]]
+
+        # Doubled area, the ranking doesn't change
+        indexes.append(max(range(start + 1, end + 1),
+                           key = lambda j: abs((ax - cx) * (y[j] - ay) - (ax - x[j]) * (cy - ay))))
+
+    indexes.append(length - 1)
+
+    return indexes
+
+
+## Function to downsample a series to the requested number of
+# points. The series is given as the times, their positions
+# (x) and one column per channel; channelIndex is the channel
+# driving the lttb selection. The downsampled times and
+# columns are returned, shorter series are returned as they are
+def downsampleSeries(times, x, columns, points, mode, channelIndex = 0):
+    if len(times) <= points:
+        return times, columns
+
+    if mode == "lttb":
+        indexes = lttbIndexes(x, columns[channelIndex], points)
+        return [times[i] for i in indexes], [array('d', [column[i] for i in indexes]) for column in columns]
+
+    reducer = bucketReducers[mode]
+    bounds = bucketBounds(len(times), points)
+
+    return [times[start] for start, end in bounds], [array('d', [reducer(column[start:end]) for start, end in bounds]) for column in columns]
@@ -0,0 +1,79 @@
+import json
+import logging
+from collections import deque
+from .TableLayout import dayFormat, parseDay
+
+
+## Queue of the ingestion units (one message per device/day)
+ingestQueueName = "ingest-units"
+
+## Deliveries of a message before it is moved to the
+# poison queue, the same value is set in host.json
+maxDequeueCount = 5
+
+
+## Util function to build the message of a unit
+def buildUnitMessage(device, day, dispatchId):
+    return json.dumps({
+        "device"    : device,
+        "day"       : day.strftime(dayFormat),
+        "dispatch"  : dispatchId
+    })
+
+
+## Util function to parse the message of a unit,
+# ValueError is raised for malformed messages
+def parseUnitMessage(body):
+    try:
+        unit = json.loads(body)
+        device = unit["device"]
+        day = parseDay(unit["day"])
+        dispatchId = str(unit.get("dispatch", ""))
+    except (KeyError, TypeError, AttributeError) as error:
+        raise ValueError("Malformed unit message: " + str(error))
+
+    if not isinstance(device, str) or not device.isalnum():
+        raise ValueError("Malformed device name in unit message")
+
+    return device, day, dispatchId
+
+
+## In-memory stand-in of the storage queue, with the same
+# delivery semantics of the functions runtime: a failing
+# message is delivered again until maxDequeueCount, then
+# it is moved to the poison messages. It can be given
+# to the dispatcher in place of its output binding and
+# drained into the worker, to run the fan-out offline
+class MemoryQueue:
+    def __init__(self, maxDequeueCount = maxDequeueCount):
+        self.maxDequeueCount    = maxDequeueCount
+        self.messages           = deque()
+        self.poison             = []
+
+    def put(self, body):
+        self.messages.append((body, 1))
+
+    ## Same interface of the func.Out output binding
+    def set(self, messages):
+        for body in messages:
+            self.put(body)
+
+    ## Deliver the messages to handler(body, dequeueCount)
+    # until the queue is empty
+    def drain(self, handler):
+        delivered = 0
+
+        while self.messages:
+            body, dequeueCount = self.messages.popleft()
+            delivered += 1
+
+            try:
+                handler(body, dequeueCount)
+            except Exception as error:
+                if dequeueCount >= self.maxDequeueCount:
+                    logging.info("Moving message to poison queue: " + str(error))
+                    self.poison.append(body)
+                else:
+                    self.messages.append((body, dequeueCount + 1))
+
+        return delivered
@@ -0,0 +1,169 @@
+import os
+import sys
+import json
+import time
+import logging
+import functools
+import threading
+import contextlib
+import contextvars
+from collections import Counter
+
+
+## Metrics settings. When the profile interval (seconds) is
+# set, the stacks of the invocation thread are sampled at
+# that interval
+metricsEnabled = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+profileInterval = float(os.environ.get("METRICS_PROFILE_INTERVAL", "0"))
+profileTop = int(os.environ.get("METRICS_PROFILE_TOP", "10"))
+
+metricsLogger = logging.getLogger("metrics")
+
+
+## Class collecting the metrics of an invocation: the time
+# spent in each stage and the counters. Stages and counters
+# can be updated by the threads working for the invocation
+class InvocationMetrics:
+
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, stageName):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(stageName, time.perf_counter() - start)
+
+    def addTime(self, stageName, seconds):
+        with self.lock:
+            self.stages[stageName] = self.stages.get(stageName, 0.0) + seconds
+
+    def count(self, counterName, value = 1):
+        with self.lock:
+            self.counters[counterName] = self.counters.get(counterName, 0) + value
+
+    def asDict(self):
+        return {
+            "metric": "invocation",
+            "name": self.name,
+            "tags": self.tags,
+            "durationMs": round((time.perf_counter() - self.start) * 1000, 3),
+            "stagesMs": {stageName: round(seconds * 1000, 3) for stageName, seconds in self.stages.items()},
+            "counters": dict(self.counters)
+        }
+
+
+## Metrics used outside of an invocation or when disabled
+class NullMetrics:
+    nullStage = contextlib.nullcontext()
+
+    def stage(self, stageName):
+        return self.nullStage
+
+    def addTime(self, stageName, seconds):
+        pass
+
+    def count(self, counterName, value = 1):
+        pass
+
+
+nullMetrics = NullMetrics()
+currentMetrics = contextvars.ContextVar("currentMetrics", default = nullMetrics)
+
+
+## Util function returning the metrics of the running invocation
+def metrics():
+    return currentMetrics.get()
+
+
+## Sampling profiler: a thread collecting the function at the
+# top of the stack of the sampled thread at every interval
+class StackSampler(threading.Thread):
+
+    def __init__(self, threadId, interval):
+        super().__init__(daemon = True)
+        self.threadId = threadId
+        self.interval = interval
+        self.samples = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            if frame is not None:
+                code = frame.f_code
+                self.samples[os.path.basename(code.co_filename) + ":" + code.co_name + ":" + str(frame.f_lineno)] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return [{"frame": frame, "samples": samples} for frame, samples in self.samples.most_common(profileTop)]
+
+
+## Context manager collecting the metrics of an invocation.
+# On exit the metrics are logged as a single json record
+@contextlib.contextmanager
+def invocation(name, **tags):
+    if not metricsEnabled:
+        yield nullMetrics
+        return
+
+    invocationMetrics = InvocationMetrics(name, tags)
+    token = currentMetrics.set(invocationMetrics)
+
+    sampler = None
+    if profileInterval > 0:
+        sampler = StackSampler(threading.get_ident(), profileInterval)
+        sampler.start()
+
+    try:
+        yield invocationMetrics
+    finally:
+        currentMetrics.reset(token)
+
+        record = invocationMetrics.asDict()
+        if sampler is not None:
+            record["profile"] = sampler.stop()
+
+        metricsLogger.info(json.dumps(record))
+
+
+## Decorator timing the calls of a function as a stage of the
+# running invocation. Functions are left as they are when the
+# metrics are disabled
+def timed(stageName):
+    def decorator(function):
+        if not metricsEnabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with currentMetrics.get().stage(stageName):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+## Util function to run a function in another thread (e.g.
+# submitted to an executor) within the current invocation
+def withMetrics(function):
+    invocationMetrics = currentMetrics.get()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = currentMetrics.set(invocationMetrics)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            currentMetrics.reset(token)
+
+    return wrapper
@@ -0,0 +1,239 @@
+import os
+import math
+import struct
+import bisect
+
+
+## Sketch settings. Quantiles are estimated within the relative
+# accuracy, values closer to zero than zeroThreshold are counted
+# as zero: both define the bins of the stored sketches, so they
+# can't change once sketches are stored. The max number of bins
+# of a sketch is a setting: 400 bins cover values from 0.01 to
+# 80000 without folding and keep the 24 hourly sketches of a
+# channel below 64KB
+relativeAccuracy = 0.02
+zeroThreshold = 0.01
+maxBins = int(os.environ.get("SKETCH_MAX_BINS", "400"))
+
+gamma = (1 + relativeAccuracy) / (1 - relativeAccuracy)
+multiplier = 1 / math.log(gamma)
+
+## Binary representation of a sketch:
+#
+#   header      zero count (uint32), min, max (float32),
+#               positive bins, negative bins (uint16)
+#   keys        bin keys (int16 x bins), positive bins first
+#   counts      bin counts (uint32 x bins)
+#
+# Everything is little endian
+headerStruct = struct.Struct("<IffHH")
+
+
+## Util function to count sorted magnitudes (all above the
+# zero threshold) in their bins. Bins are walked instead of
+# values: one logarithm for each bin, the values of a bin are
+# counted by bisection. Magnitudes of the same channel in a
+# run are close, so runs only fill a few bins. With rounding
+# the bound of a bin can be slightly below the value the key
+# comes from: the value is counted in its bin anyway
+def countBins(bins, magnitudes):
+    start = 0
+    while start < len(magnitudes):
+        key = math.ceil(math.log(magnitudes[start]) * multiplier)
+        end = max(bisect.bisect_right(magnitudes, gamma ** key, start), start + 1)
+        bins[key] = bins.get(key, 0) + end - start
+        start = end
+
+
+## Util function returning the value estimated for a bin
+def binValue(key):
+    return 2 * gamma ** key / (gamma + 1)
+
+
+## Util function to fold the bins of a store below floorKey
+# into the floorKey bin
+def foldBins(bins, floorKey):
+    folded = 0
+    for key in [key for key in bins if key < floorKey]:
+        folded += bins.pop(key)
+
+    if folded:
+        bins[floorKey] = bins.get(floorKey, 0) + folded
+
+
+## Mergeable quantile sketch of the values of a channel
+# (DDSketch): values are counted in bins with logarithmic
+# bounds, so any quantile is estimated within the relative
+# accuracy and two sketches are merged adding their bins.
+# The exact min and max are kept as well
+class QuantileSketch:
+    __slots__ = ("positive", "negative", "zeroCount", "count", "min", "max")
+
+    def __init__(self):
+        self.positive   = {}
+        self.negative   = {}
+        self.zeroCount  = 0
+        self.count      = 0
+        self.min        = math.inf
+        self.max        = -math.inf
+
+    ## Add a column of values
+    def addColumn(self, values):
+        if len(values) == 0:
+            return
+
+        values = sorted(values)
+        low = bisect.bisect_left(values, -zeroThreshold)
+        high = bisect.bisect_right(values, zeroThreshold)
+
+        countBins(self.positive, values[high:])
+        if low:
+            countBins(self.negative, [-value for value in reversed(values[:low])])
+
+        self.zeroCount += high - low
+        self.count += len(values)
+        self.min = min(self.min, values[0])
+        self.max = max(self.max, values[-1])
+        self.collapse()
+
+    ## Combine with another sketch (hours, days, periods...)
+    def merge(self, other):
+        if other.count == 0:
+            return
+
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+
+        self.zeroCount += other.zeroCount
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.collapse()
+
+    ## Bound the number of bins: the bins of the values closest
+    # to zero are folded together, so the accuracy of the
+    # highest values (the ones alerts are about) is kept
+    def collapse(self):
+        if len(self.positive) + len(self.negative) <= maxBins:
+            return
+
+        positiveKeys = sorted(self.positive)
+        negativeKeys = sorted(self.negative)
+
+        for floorKey in sorted(set(positiveKeys + negativeKeys)):
+            bins = 0
+            for keys in (positiveKeys, negativeKeys):
+                below = bisect.bisect_left(keys, floorKey)
+                bins += len(keys) - below
+                if below and (below == len(keys) or keys[below] != floorKey):
+                    bins += 1
+
+            if bins <= maxBins:
+                break
+
+        foldBins(self.positive, floorKey)
+        foldBins(self.negative, floorKey)
+
+    ## Estimate the value at the given quantile (0 - 1),
+    # None is returned if the sketch is empty
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = 0
+        value = None
+
+        for key in sorted(self.negative, reverse = True):
+            seen += self.negative[key]
+            if seen > rank:
+                value = -binValue(key)
+                break
+
+        if value is None:
+            seen += self.zeroCount
+            if seen > rank:
+                value = 0.0
+
+        if value is None:
+            for key in sorted(self.positive):
+                seen += self.positive[key]
+                if seen > rank:
+                    value = binValue(key)
+                    break
+
+        if value is None:
+            value = self.max
+
+        return min(max(value, self.min), self.max)
+
+    ## Binary representation of the sketch. Bins are sorted, so
+    # the same bins give the same bytes whatever the merge order
+    def toBytes(self):
+        keys = sorted(self.positive) + sorted(self.negative)
+        counts = [self.positive[key] for key in keys[:len(self.positive)]] + [self.negative[key] for key in keys[len(self.positive):]]
+
+        header = headerStruct.pack(self.zeroCount, self.min, self.max, len(self.positive), len(self.negative))
+        return header + struct.pack("<%dh%dI" % (len(keys), len(counts)), *keys, *counts)
+
+    ## Build a sketch given its binary representation at offset,
+    # the sketch and the offset of what follows are returned
+    @classmethod
+    def fromBytes(cls, buffer, offset = 0):
+        sketch = cls()
+        sketch.zeroCount, sketch.min, sketch.max, positiveBins, negativeBins = headerStruct.unpack_from(buffer, offset)
+        offset += headerStruct.size
+
+        bins = positiveBins + negativeBins
+        binsStruct = struct.Struct("<%dh%dI" % (bins, bins))
+        values = binsStruct.unpack_from(buffer, offset)
+        offset += binsStruct.size
+
+        keys = values[:bins]
+        counts = values[bins:]
+        sketch.positive = dict(zip(keys[:positiveBins], counts[:positiveBins]))
+        sketch.negative = dict(zip(keys[positiveBins:], counts[positiveBins:]))
+        sketch.count = sketch.zeroCount + sum(counts)
+
+        return sketch, offset
+
+
+## Util function returning a sketch for each given column
+def sketchColumns(columns):
+    sketches = []
+    for column in columns:
+        sketch = QuantileSketch()
+        sketch.addColumn(column)
+        sketches.append(sketch)
+
+    return sketches
+
+
+## Function to encode a list of sketches
+def encodeSketches(sketches):
+    return b"".join(sketch.toBytes() for sketch in sketches)
+
+
+## Function to decode a list of sketches
+def decodeSketches(blob):
+    buffer = memoryview(blob)
+
+    sketches = []
+    offset = 0
+    while offset < len(buffer):
+        sketch, offset = QuantileSketch.fromBytes(buffer, offset)
+        sketches.append(sketch)
+
+    return sketches
+
+
+## Util function returning the name of the entity
+# property holding the sketches of a channel
+def sketchProperty(channelName):
+    return "Sketch" + channelName
@@ -0,0 +1,187 @@
+import os
+import time
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+import azure.functions as func
+from .ResponseEncoding import minCompressBytes, chooseEncoding, compressBody
+
+
+## Cache settings. Entries expire at the first refresh time
+# (UTC, after the daily ingest) or after maxTtl seconds,
+# the interval of the incremental ingest
+maxEntries = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+maxBytes = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+maxTtl = int(os.environ.get("RESPONSE_CACHE_MAX_TTL", str(15 * 60)))
+refreshTime = os.environ.get("RESPONSE_CACHE_REFRESH_TIME", "00:05")
+
+
+## Class used to mantain a cached response, together
+# with its compressed variants (content coding -> body)
+class CacheEntry:
+    __slots__ = ("body", "etag", "expires", "variants")
+
+    def __init__(self, body, etag, expires):
+        self.body       = body
+        self.etag       = etag
+        self.expires    = expires
+        self.variants   = {}
+
+    def size(self):
+        return len(self.body) + sum(len(variant) for variant in self.variants.values())
+
+    ## The etag of a variant, each coding has its own
+    def variantEtag(self, coding):
+        if coding is None:
+            return self.etag
+
+        return self.etag[:-1] + "-" + coding + '"'
+
+
+## Util function returning the timestamp of the next refresh
+def nextRefresh(now):
+    hour, minute = refreshTime.split(":")
+    current = datetime.datetime.fromtimestamp(now, datetime.timezone.utc)
+    refresh = current.replace(hour = int(hour), minute = int(minute), second = 0, microsecond = 0)
+    if refresh <= current:
+        refresh += datetime.timedelta(days = 1)
+
+    return min(refresh.timestamp(), now + maxTtl)
+
+
+## Util function to build the key of a request given
+# the function name and its (normalized) params
+def buildCacheKey(functionName, params):
+    normalized = sorted((key.strip().lower(), value.strip()) for key, value in params.items() if value is not None)
+    return functionName + "?" + "&".join(key + "=" + value for key, value in normalized)
+
+
+## Class implementing a LRU cache of encoded responses,
+# bounded both in number of entries and in bytes
+class ResponseCache:
+    def __init__(self, maxEntries = maxEntries, maxBytes = maxBytes):
+        self.maxEntries = maxEntries
+        self.maxBytes   = maxBytes
+        self.entries    = OrderedDict()
+        self.size       = 0
+        self.lock       = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            if entry.expires <= time.time():
+                self.remove(key)
+                return None
+
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        now = time.time()
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        entry = CacheEntry(body, etag, nextRefresh(now))
+
+        # Too big responses are not cached
+        if len(body) > self.maxBytes:
+            return entry
+
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = entry
+            self.size += len(body)
+            self.evict()
+
+        return entry
+
+    ## Returns the body of the entry compressed with the given
+    # coding, compressing it only the first time
+    def variant(self, key, entry, coding):
+        body = entry.variants.get(coding)
+        if body is not None:
+            return body
+
+        body = compressBody(entry.body, coding)
+        with self.lock:
+            if coding not in entry.variants:
+                entry.variants[coding] = body
+                # Cached entries account for their variants too
+                if self.entries.get(key) is entry:
+                    self.size += len(body)
+                    self.evict()
+
+        return body
+
+    ## Remove the least recently used entries until the cache
+    # is within its bounds, to be called holding the lock
+    def evict(self):
+        while self.entries and (len(self.entries) > self.maxEntries or self.size > self.maxBytes):
+            oldestKey = next(iter(self.entries))
+            self.remove(oldestKey)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+## Cache shared by the invocations of the worker process
+responseCache = ResponseCache()
+
+
+## Util function to check the If-None-Match header of a request
+def etagMatches(req, etag):
+    ifNoneMatch = req.headers.get("If-None-Match")
+    if not ifNoneMatch:
+        return False
+
+    for candidate in ifNoneMatch.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+
+    return False
+
+
+## Function returning the cached response of a request, building
+# it with buildBody if needed. Only string bodies are cached,
+# compressed as accepted by the client. Clients sending a
+# matching If-None-Match get a 304
+def cachedResponse(req, cacheKey, buildBody, mimetype = "application/json"):
+    entry = responseCache.get(cacheKey)
+
+    if entry is None:
+        body = buildBody()
+        if not isinstance(body, (str, bytes)):
+            return func.HttpResponse(body, mimetype = mimetype)
+
+        entry = responseCache.put(cacheKey, body)
+
+    coding = chooseEncoding(req) if len(entry.body) >= minCompressBytes else None
+    headers = {
+        "ETag": entry.variantEtag(coding),
+        "Cache-Control": "public, max-age=" + str(max(0, int(entry.expires - time.time()))),
+        "Vary": "Accept-Encoding"
+    }
+
+    if etagMatches(req, headers["ETag"]):
+        return func.HttpResponse(status_code = 304, headers = headers)
+
+    if coding is None:
+        return func.HttpResponse(entry.body, mimetype = mimetype, headers = headers)
+
+    headers["Content-Encoding"] = coding
+    return func.HttpResponse(responseCache.variant(cacheKey, entry, coding), mimetype = mimetype, headers = headers)
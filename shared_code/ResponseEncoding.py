@@ -0,0 +1,111 @@
+import os
+import json
+import gzip
+import importlib.util
+import azure.functions as func
+
+# Optional faster backends, used when installed. Brotli
+# is only imported when a response is compressed with it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+brotliAvailable = importlib.util.find_spec("brotli") is not None
+
+
+## Encoding settings. Smaller bodies are not compressed
+minCompressBytes = int(os.environ.get("RESPONSE_MIN_COMPRESS_BYTES", "1024"))
+gzipLevel = int(os.environ.get("RESPONSE_GZIP_LEVEL", "6"))
+brotliQuality = int(os.environ.get("RESPONSE_BROTLI_QUALITY", "5"))
+
+## Shapes of the responses: a list of samples or
+# a list of values for each key
+responseFormats = ("rows", "columns")
+
+
+## Util function to encode a value as compact json
+def dumpJson(value):
+    if orjson is not None:
+        return orjson.dumps(value).decode("utf-8")
+
+    return json.dumps(value, separators = (",", ":"))
+
+
+## Util function converting a list of dicts with the same keys
+# to the column-oriented shape: one list of values per key
+def toColumns(rows, keys = None):
+    if keys is None:
+        keys = list(rows[0]) if rows else []
+
+    return {key: [row[key] for row in rows] for key in keys}
+
+
+## Util function returning the quality of each coding
+# listed in an Accept-Encoding header
+def parseAcceptEncoding(header):
+    qualities = {}
+    for item in header.split(","):
+        parts = item.strip().split(";")
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding] = quality
+
+    return qualities
+
+
+## Function choosing the content coding of a response given
+# the request Accept-Encoding: brotli (if available), gzip
+# or None for the identity
+def chooseEncoding(req):
+    qualities = parseAcceptEncoding(req.headers.get("Accept-Encoding") or "")
+
+    candidates = ["gzip"]
+    if brotliAvailable:
+        candidates.insert(0, "br")
+
+    best = None
+    bestQuality = 0.0
+    for coding in candidates:
+        quality = qualities.get(coding, qualities.get("*", 0.0))
+        if quality > bestQuality:
+            best = coding
+            bestQuality = quality
+
+    return best
+
+
+## Util function to compress a body with the given coding
+def compressBody(body, coding):
+    if coding == "br":
+        import brotli
+        return brotli.compress(body, quality = brotliQuality)
+
+    return gzip.compress(body, compresslevel = gzipLevel, mtime = 0)
+
+
+## Function building an http response compressed with the
+# coding accepted by the client, if the body is large enough
+def encodedResponse(req, body, mimetype = "application/json", status_code = 200, headers = None):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+
+    coding = chooseEncoding(req) if len(body) >= minCompressBytes else None
+    if coding is not None:
+        body = compressBody(body, coding)
+        headers["Content-Encoding"] = coding
+
+    return func.HttpResponse(body, status_code = status_code, mimetype = mimetype, headers = headers)
@@ -0,0 +1,185 @@
+import datetime
+from .Channels import channelNames, dailyNames, responseKey
+from .TableLayout import dayFormat, quoteValue, buildPartitionKey
+from .TableQuery import queryPages
+from .SampleCodec import propertyBytes
+from .QuantileSketch import QuantileSketch, encodeSketches, decodeSketches
+
+
+## Table holding the precomputed daily, weekly and monthly
+# values: one partition per device, rows keyed by resolution
+# and period start day (e.g. 'W_2020-03-02')
+rollupsTableName = "DeviceRollups"
+
+dailyResolution = "D"
+weeklyResolution = "W"
+monthlyResolution = "M"
+
+## Minimum number of requested days for each resolution,
+# from the coarsest one. Shorter requests use hourly data
+resolutionThresholds = (
+    (monthlyResolution, 1825),
+    (weeklyResolution, 730),
+    (dailyResolution, 20)
+)
+
+## Number of decimals of the stored averages
+averageDecimals = (2,) * len(channelNames) + (7, 7)
+
+
+## Util function to choose the coarsest resolution
+# for the requested days. None means hourly data
+def chooseResolution(requestedDays):
+    for resolution, minDays in resolutionThresholds:
+        if requestedDays >= minDays:
+            return resolution
+
+    return None
+
+
+## Util function returning the first day of the
+# period containing day
+def periodStart(day, resolution):
+    if resolution == weeklyResolution:
+        return day - datetime.timedelta(days = day.weekday())
+    if resolution == monthlyResolution:
+        return day.replace(day = 1)
+
+    return day
+
+
+## Util function returning the last day of the
+# period starting at startDay
+def periodEnd(startDay, resolution):
+    if resolution == weeklyResolution:
+        return startDay + datetime.timedelta(days = 6)
+    if resolution == monthlyResolution:
+        nextMonth = (startDay.replace(day = 1) + datetime.timedelta(days = 32)).replace(day = 1)
+        return nextMonth - datetime.timedelta(days = 1)
+
+    return startDay
+
+
+## Util function to build the row key of a period
+def buildRollupRowKey(resolution, startDay):
+    return resolution + "_" + startDay.strftime(dayFormat)
+
+
+## Function to build a rollup entity given the sums of the
+# channels and of the position, the number of samples and
+# optionally the quantile sketches of the channels
+def buildRollupEntity(deviceName, resolution, startDay, sums, count, sketches = None):
+    from azure.storage.table import Entity, EntityProperty, EdmType
+
+    entity = Entity()
+    entity.PartitionKey = buildPartitionKey(deviceName)
+    entity.RowKey = buildRollupRowKey(resolution, startDay)
+    entity.DeviceName = deviceName
+    entity.Day = startDay.strftime(dayFormat)
+    entity.Samples = count
+
+    for name, total, digits in zip(dailyNames, sums, averageDecimals):
+        entity["Sum" + name] = total
+        entity["Avg" + name] = round(total / count, digits) if count else 0
+
+    if sketches is not None:
+        entity.Sketches = EntityProperty(EdmType.BINARY, encodeSketches(sketches))
+
+    return entity
+
+
+## Util function returning the sums and the
+# number of samples stored in a rollup entity
+def readRollupSums(entity):
+    return [entity["Sum" + name] for name in dailyNames], entity.Samples
+
+
+## Util function returning the quantile sketches of the channels
+# stored in a rollup entity, None for the rollups stored without
+def readRollupSketches(entity):
+    if "Sketches" not in entity:
+        return None
+
+    return decodeSketches(propertyBytes(entity.Sketches))
+
+
+## Util function returning the averages of a rollup
+# entity with the keys used by the responses
+def rollupValues(entity):
+    values = {}
+    for name in channelNames:
+        values[responseKey(name)] = entity["Avg" + name]
+
+    return values
+
+
+## Function to query the rollups of a device with the given
+# resolution, for the periods overlapping startDay - endDay
+def queryRollups(tableService, deviceName, resolution, startDay, endDay = None):
+    startKey = buildRollupRowKey(resolution, periodStart(startDay, resolution))
+    endKey = resolution + "_9999-12-31"
+    if endDay is not None:
+        endKey = buildRollupRowKey(resolution, endDay)
+
+    requestQuery = "PartitionKey eq " + quoteValue(buildPartitionKey(deviceName))
+    requestQuery += " and RowKey ge " + quoteValue(startKey) + " and RowKey le " + quoteValue(endKey)
+
+    return queryPages(tableService, rollupsTableName, requestQuery)
+
+
+## Generator of the rollups covering the days from startDay to
+# endDay (included) with the fewest entities: the months fully
+# included and the daily rollups of the remaining days
+def queryCoveringRollups(tableService, deviceName, startDay, endDay):
+    oneDay = datetime.timedelta(days = 1)
+
+    firstMonth = startDay
+    if startDay.day != 1:
+        firstMonth = periodEnd(startDay, monthlyResolution) + oneDay
+
+    # First month not fully included
+    lastMonth = periodStart(endDay + oneDay, monthlyResolution)
+
+    if firstMonth >= lastMonth:
+        yield from queryRollups(tableService, deviceName, dailyResolution, startDay, endDay)
+        return
+
+    if startDay < firstMonth:
+        yield from queryRollups(tableService, deviceName, dailyResolution, startDay, firstMonth - oneDay)
+
+    yield from queryRollups(tableService, deviceName, monthlyResolution, firstMonth, lastMonth - oneDay)
+
+    if lastMonth <= endDay:
+        yield from queryRollups(tableService, deviceName, dailyResolution, lastMonth, endDay)
+
+
+## Function to rebuild the weekly and monthly rollups of the
+# periods containing the given days. Periods are rebuilt by
+# merging the sums, counts and sketches of their daily rollups,
+# so updating the same day twice never counts it twice
+def updatePeriodRollups(tableService, deviceName, days):
+    periods = set()
+    for day in days:
+        for resolution in (weeklyResolution, monthlyResolution):
+            periods.add((resolution, periodStart(day, resolution)))
+
+    for resolution, startDay in sorted(periods):
+        sums = [0.0] * len(dailyNames)
+        count = 0
+        sketches = [QuantileSketch() for name in channelNames]
+
+        dailyEntities = queryRollups(tableService, deviceName, dailyResolution, startDay, periodEnd(startDay, resolution))
+        for entity in dailyEntities:
+            dailySums, dailyCount = readRollupSums(entity)
+            sums = [total + value for total, value in zip(sums, dailySums)]
+            count += dailyCount
+
+            dailySketches = readRollupSketches(entity)
+            if dailySketches is not None:
+                for sketch, dailySketch in zip(sketches, dailySketches):
+                    sketch.merge(dailySketch)
+
+        entity = buildRollupEntity(deviceName, resolution, startDay, sums, count, sketches)
+        tableService.insert_or_replace_entity(rollupsTableName, entity)
+
+    return len(periods)
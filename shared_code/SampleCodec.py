@@ -0,0 +1,143 @@
+import sys
+import struct
+from array import array
+from .Channels import channelNames
+
+
+## Binary columnar encoding of the hourly samples of a day:
+#
+#   header      version (uint8), channels (uint8), hours (uint16),
+#               missing hours bitmask (uint32)
+#   counts      samples of each hour (uint32 x hours)
+#   channels    hourly averages, one float32 column per channel
+#
+# Everything is little endian. Averages are stored rounded
+# to two decimals, float32 keeps them exact up to 131072
+formatVersion = 1
+hoursNumber = 24
+
+headerStruct = struct.Struct("<BBHI")
+countsOffset = headerStruct.size
+channelsOffset = countsOffset + 4 * hoursNumber
+columnSize = 4 * hoursNumber
+
+nativeLittleEndian = sys.byteorder == "little"
+
+## Keys of the channels in the stored hourly json
+hourlyKeys = ('avgTemp', 'avgCo2', 'avgRad', 'avg03', 'avgNo2',
+              'avgCo', 'avgVoc', 'avgPm2_5', 'avgPm10', 'avgDs18')
+
+
+## Function to encode the hours of a day. Hours are given as
+# a dict hour -> (averages, samples), absent hours are missing
+def encodeHours(hours):
+    missingMask = 0
+    counts = array('I', bytes(4 * hoursNumber))
+    columns = [array('f', bytes(columnSize)) for name in channelNames]
+
+    for hour in range(hoursNumber):
+        values = hours.get(hour)
+        if values is None:
+            missingMask |= 1 << hour
+            continue
+
+        averages, count = values
+        counts[hour] = count
+        for column, value in zip(columns, averages):
+            column[hour] = value
+
+    if not nativeLittleEndian:
+        counts.byteswap()
+        for column in columns:
+            column.byteswap()
+
+    chunks = [headerStruct.pack(formatVersion, len(channelNames), hoursNumber, missingMask), counts.tobytes()]
+    chunks += [column.tobytes() for column in columns]
+
+    return b"".join(chunks)
+
+
+## Class giving access to an encoded day without copying it:
+# channels and counts are decoded on demand
+class SampleColumns:
+    __slots__ = ("buffer", "missingMask")
+
+    def __init__(self, blob):
+        self.buffer = memoryview(blob)
+
+        version, channels, hours, self.missingMask = headerStruct.unpack_from(self.buffer)
+        if version != formatVersion or channels != len(channelNames) or hours != hoursNumber:
+            raise ValueError("Unsupported samples format " + str(version))
+
+    def isMissing(self, hour):
+        return (self.missingMask >> hour) & 1 == 1
+
+    def view(self, start, end, typeCode):
+        if nativeLittleEndian:
+            return self.buffer[start:end].cast(typeCode)
+
+        values = array(typeCode, self.buffer[start:end].tobytes())
+        values.byteswap()
+        return values
+
+    ## Samples of each hour
+    def counts(self):
+        return self.view(countsOffset, channelsOffset, 'I')
+
+    ## Hourly averages of the channel at the given index
+    def channel(self, index):
+        start = channelsOffset + index * columnSize
+        return self.view(start, start + columnSize, 'f')
+
+
+## Util function returning the stored bytes of a binary
+# property (entities read back give an EntityProperty)
+def propertyBytes(value):
+    return getattr(value, "value", value)
+
+
+## Function to decode an encoded day as the hourly samples
+# stored in the json format
+def decodeHourlySamples(blob, day):
+    columns = SampleColumns(blob)
+    counts = columns.counts()
+    channels = [columns.channel(index) for index in range(len(channelNames))]
+
+    hourlySamples = []
+    for hour in range(hoursNumber):
+        if columns.isMissing(hour):
+            averages = [0] * len(channelNames)
+        else:
+            averages = [round(channel[hour], 2) for channel in channels]
+
+        hourlySamples.append({
+            'time': day + "_" + str(hour).zfill(2),
+            'missingData': "true" if columns.isMissing(hour) else "false",
+            'avgTemp': averages[0],
+            'avgCo2': averages[1],
+            'avgRad': averages[2],
+            'avg03': averages[3],
+            'avgNo2': averages[4],
+            'avgCo': averages[5],
+            'avgVoc': averages[6],
+            'avgPm2_5': averages[7],
+            'avgPm10': averages[8],
+            'avgDs18': averages[9],
+            'samplxH': counts[hour]
+        })
+
+    return hourlySamples
+
+
+## Function to encode the hourly samples stored in the json format
+def encodeHourlySamples(hourlySamples):
+    hours = {}
+    for hourSample in hourlySamples:
+        if hourSample["missingData"] == "true":
+            continue
+
+        hour = int(hourSample["time"].rsplit("_", 1)[1])
+        averages = [hourSample[key] for key in hourlyKeys]
+        hours[hour] = (averages, hourSample["samplxH"])
+
+    return encodeHours(hours)
@@ -0,0 +1,165 @@
+import os
+import math
+import time
+import heapq
+import threading
+from .DeviceQueries import queryDevices
+from .DevicePositions import loadPositions
+
+
+## Index settings. The index is rebuilt after indexTtl
+# seconds, the interval of the incremental ingest
+cellDegrees = float(os.environ.get("SPATIAL_INDEX_CELL_DEGREES", "0.1"))
+indexTtl = int(os.environ.get("SPATIAL_INDEX_TTL", str(15 * 60)))
+
+earthRadius = 6371.0
+
+spatialIndex = None
+spatialIndexLock = threading.Lock()
+
+
+## Util function returning the distance in km between two points
+def haversine(lat1, lon1, lat2, lon2):
+    dLat = math.radians(lat2 - lat1)
+    dLon = math.radians(lon2 - lon1)
+    a = math.sin(dLat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dLon / 2) ** 2
+
+    return 2 * earthRadius * math.asin(min(1.0, math.sqrt(a)))
+
+
+## Util function to parse a 'minLat,minLon,maxLat,maxLon'
+# bounding box, None is returned if it is not valid. Values
+# out of range (nan and infinities too) are not valid
+def parseBoundingBox(boxStr):
+    try:
+        minLat, minLon, maxLat, maxLon = [float(value) for value in boxStr.split(",")]
+    except ValueError:
+        return None
+
+    if not all(-90 <= value <= 90 for value in (minLat, maxLat)):
+        return None
+    if not all(-180 <= value <= 180 for value in (minLon, maxLon)):
+        return None
+
+    if minLat > maxLat or minLon > maxLon:
+        return None
+
+    return minLat, minLon, maxLat, maxLon
+
+
+## Grid index over the device positions: devices are bucketed
+# in square cells of cellDegrees, lookups only visit the cells
+# overlapping the requested area
+class GridIndex:
+
+    def __init__(self, devices, cellSize = cellDegrees):
+        self.cellSize = cellSize
+        self.devices = devices
+        self.cells = {}
+        self.builtAt = time.time()
+
+        for device in devices:
+            self.cells.setdefault(self.cellOf(device["latitude"], device["longitude"]), []).append(device)
+
+    def cellOf(self, latitude, longitude):
+        return (math.floor(latitude / self.cellSize), math.floor(longitude / self.cellSize))
+
+    ## Devices inside the bounding box
+    def inBox(self, minLat, minLon, maxLat, maxLon):
+        minRow, minCol = self.cellOf(minLat, minLon)
+        maxRow, maxCol = self.cellOf(maxLat, maxLon)
+
+        # Large boxes: visiting the populated cells is cheaper
+        if (maxRow - minRow + 1) * (maxCol - minCol + 1) > len(self.cells):
+            cells = [cell for (row, col), cell in self.cells.items() if minRow <= row <= maxRow and minCol <= col <= maxCol]
+        else:
+            cells = [self.cells[(row, col)] for row in range(minRow, maxRow + 1) for col in range(minCol, maxCol + 1) if (row, col) in self.cells]
+
+        return [device for cell in cells for device in cell
+                if minLat <= device["latitude"] <= maxLat and minLon <= device["longitude"] <= maxLon]
+
+    ## Cells at the given ring (chebyshev distance) around a cell
+    def ringCells(self, centerRow, centerCol, ring):
+        if ring == 0:
+            return [(centerRow, centerCol)]
+
+        cells = []
+        for offset in range(-ring, ring + 1):
+            cells.append((centerRow - ring, centerCol + offset))
+            cells.append((centerRow + ring, centerCol + offset))
+        for offset in range(-ring + 1, ring):
+            cells.append((centerRow + offset, centerCol - ring))
+            cells.append((centerRow + offset, centerCol + ring))
+
+        return cells
+
+    ## The k nearest devices to the point, as (distance, device)
+    # pairs. Rings of cells around the point are visited until
+    # the next ring can't hold anything closer than the k-th
+    # device; when rings get larger than the populated cells
+    # every device is a candidate
+    def nearest(self, latitude, longitude, k):
+        if k <= 0:
+            return []
+
+        centerRow, centerCol = self.cellOf(latitude, longitude)
+        candidates = []
+        ring = 0
+
+        while True:
+            if k >= len(self.devices) or 8 * ring > len(self.cells):
+                candidates = self.devices
+                break
+
+            for cell in self.ringCells(centerRow, centerCol, ring):
+                candidates.extend(self.cells.get(cell, ()))
+
+            if len(candidates) >= k:
+                kthDistance = heapq.nsmallest(k, (haversine(latitude, longitude, d["latitude"], d["longitude"]) for d in candidates))[-1]
+
+                # Lower bound of the distance of the devices in the next
+                # rings, at least ring cells away along one axis
+                boundLatitude = min(90.0, abs(latitude) + (ring + 2) * self.cellSize)
+                separation = min(math.pi, math.radians(ring * self.cellSize))
+                bound = 2 * earthRadius * math.cos(math.radians(boundLatitude)) * math.sin(separation / 2)
+                if bound >= kthDistance:
+                    break
+
+            ring += 1
+
+        distances = [(haversine(latitude, longitude, d["latitude"], d["longitude"]), d) for d in candidates]
+
+        return heapq.nsmallest(k, distances, key = lambda item: item[0])
+
+
+## Function building the index of the registered devices, the
+# last known positions (mobile stations) override the
+# registered ones
+def buildSpatialIndex(tableService):
+    positions = loadPositions(tableService)
+
+    devices = []
+    for device in queryDevices(tableService):
+        latitude, longitude = positions.get(device["deviceName"], (device["latitude"], device["longitude"]))
+        devices.append({
+            "deviceName" : device["deviceName"],
+            "latitude"   : latitude,
+            "longitude"  : longitude
+        })
+
+    return GridIndex(devices)
+
+
+## Function returning the index shared by the invocations of
+# the worker process, rebuilt when older than indexTtl
+def getSpatialIndex(tableService):
+    global spatialIndex
+
+    index = spatialIndex
+    if index is None or time.time() - index.builtAt > indexTtl:
+        with spatialIndexLock:
+            if spatialIndex is None or time.time() - spatialIndex.builtAt > indexTtl:
+                spatialIndex = buildSpatialIndex(tableService)
+            index = spatialIndex
+
+    return index
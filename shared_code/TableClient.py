@@ -0,0 +1,115 @@
+import os
+import socket
+import logging
+import threading
+import azure.functions as func
+
+
+## Storage settings. Like the settings of the other modules and
+# functions, they are read once from the function app settings
+# (environment variables) when the module is loaded: the values
+# given here are the defaults. A connection string (e.g.
+# 'UseDevelopmentStorage=true' for Azurite) takes precedence
+# over account name and key
+accountName = os.environ.get("TABLE_ACCOUNT_NAME", "")
+accountKey = os.environ.get("TABLE_ACCOUNT_KEY", "")
+connectionString = os.environ.get("TABLE_CONNECTION_STRING") or None
+poolSize = int(os.environ.get("TABLE_POOL_SIZE", "16"))
+keepAliveSeconds = int(os.environ.get("TABLE_KEEPALIVE_SECONDS", "60"))
+socketTimeout = float(os.environ.get("TABLE_SOCKET_TIMEOUT", "20"))
+retryAttempts = int(os.environ.get("TABLE_RETRY_ATTEMPTS", "3"))
+retryBackoff = float(os.environ.get("TABLE_RETRY_BACKOFF", "1"))
+
+tableService = None
+tableServiceLock = threading.Lock()
+
+
+## Util function returning the socket options used to keep
+# the idle pooled connections alive between invocations
+def keepAliveOptions(idleSeconds):
+    from urllib3.connection import HTTPConnection
+
+    options = list(HTTPConnection.default_socket_options)
+    options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idleSeconds))
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, idleSeconds))
+
+    return options
+
+
+## Util function to build the http session used by the client,
+# with a bounded pool of kept alive connections. The http and
+# storage modules are imported here, on the first use of the
+# client, so they don't weigh on the functions loading
+def buildSession():
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class KeepAliveAdapter(HTTPAdapter):
+        def __init__(self, idleSeconds, **kwargs):
+            self.socketOptions = keepAliveOptions(idleSeconds)
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs["socket_options"] = self.socketOptions
+            super().init_poolmanager(*args, **kwargs)
+
+    adapter = KeepAliveAdapter(keepAliveSeconds, pool_connections = 4, pool_maxsize = poolSize)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+## Function to build a new client
+def createTableService():
+    from azure.storage.table import TableService
+    from azure.storage.retry import ExponentialRetry
+
+    client = TableService(
+        account_name = accountName or None,
+        account_key = accountKey or None,
+        connection_string = connectionString,
+        request_session = buildSession(),
+        socket_timeout = socketTimeout
+    )
+    client.retry = ExponentialRetry(initial_backoff = retryBackoff, max_attempts = retryAttempts).retry
+
+    return client
+
+
+## Function returning the client shared by all the invocations
+# of the worker process. It is created on first use, later
+# invocations reuse it together with its open connections
+def getTableService():
+    global tableService
+
+    if tableService is None:
+        with tableServiceLock:
+            if tableService is None:
+                tableService = createTableService()
+
+    return tableService
+
+
+## Function returning the error response of the http
+# functions when the table storage can't be reached
+def connectionErrorResponse(error):
+    logging.info(error)
+    return func.HttpResponse(
+            "Unable to connect to Azure Table",
+            status_code=500)
+
+
+## Function returning the shared client to the http functions,
+# together with the error response to return when it can't
+# be created (None otherwise)
+def getTableServiceOrError():
+    try:
+        return getTableService(), None
+    except Exception as error:
+        return None, connectionErrorResponse(error)
@@ -0,0 +1,56 @@
+import datetime
+
+
+## Table holding the registered devices (PartitionKey 'Device')
+# and the samples stored with the legacy layout
+devicesTableName = "AirSamples"
+
+## Table holding the daily samples: one partition per
+# device, one row per day with the 'YYYY-mm-dd' date as key
+samplesTableName = "DeviceSamples"
+
+## Partition of the legacy samples
+legacySamplesPartition = "AirSample"
+
+dayFormat = "%Y-%m-%d"
+
+
+## Util function to escape a value used in a query filter
+def quoteValue(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+## Util function to normalize a 'YYYY-mm-dd' date,
+# days and months are zero padded so keys can be sorted
+def normalizeDay(dateStr):
+    return datetime.datetime.strptime(dateStr, dayFormat).strftime(dayFormat)
+
+
+## Util function to convert a 'YYYY-mm-dd' date to a date
+def parseDay(dateStr):
+    return datetime.datetime.strptime(dateStr, dayFormat).date()
+
+
+## Util function to build the partition key of a device
+def buildPartitionKey(deviceName):
+    return deviceName
+
+
+## Util function to build the row key of a day
+def buildRowKey(dateStr):
+    return normalizeDay(dateStr)
+
+
+## Util function to build the filter selecting the days
+# of a device between startDay and endDay (included).
+# Both ends are optional
+def buildRangeQuery(deviceName, startDay = None, endDay = None):
+    requestQuery = "PartitionKey eq " + quoteValue(buildPartitionKey(deviceName))
+
+    if startDay is not None:
+        requestQuery += " and RowKey ge " + quoteValue(buildRowKey(startDay))
+
+    if endDay is not None:
+        requestQuery += " and RowKey le " + quoteValue(buildRowKey(endDay))
+
+    return requestQuery
@@ -0,0 +1,27 @@
+from .Metrics import metrics
+
+
+## Number of entities requested for each page
+defaultPageSize = 200
+
+
+## Generator returning the entities matching requestQuery
+# page by page, following the continuation tokens. Only
+# one page at a time is kept in memory
+def queryPages(tableService, tableName, requestQuery, pageSize = defaultPageSize, select = None):
+    marker = None
+
+    while True:
+        page = tableService.query_entities(tableName, filter = requestQuery, select = select,
+                                           num_results = pageSize, marker = marker)
+        entitiesNumber = 0
+        for entity in page:
+            entitiesNumber += 1
+            yield entity
+
+        metrics().count("pagesRead")
+        metrics().count("entitiesRead", entitiesNumber)
+
+        marker = page.next_marker
+        if not marker:
+            break
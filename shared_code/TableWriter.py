@@ -0,0 +1,80 @@
+## Max number of entities in an entity group transaction
+maxBatchSize = 100
+
+## Max payload of an entity group transaction is 4MB,
+# batches are committed well before reaching it
+maxBatchBytes = 3 * 1024 * 1024
+
+
+## Util function estimating the size of an entity once
+# serialized, binary properties are sent base64 encoded
+def entitySize(entity):
+    size = 0
+    for name, value in entity.items():
+        value = getattr(value, "value", value)
+        if isinstance(value, (bytes, bytearray)):
+            size += len(name) + 4 * (len(value) + 2) // 3
+        else:
+            size += len(name) + len(str(value))
+
+    return size
+
+
+## Class used to group table writes into entity group
+# transactions (one per partition, up to batchSize entities
+# and maxBytes of payload).
+# Entities are inserted or replaced, so writing the same
+# entity twice is safe. Any object exposing commit_batch
+# (TableService, an in-memory stand-in) can be used
+class BatchWriter:
+    def __init__(self, tableService, tableName, batchSize = maxBatchSize, maxBytes = maxBatchBytes):
+        self.tableService   = tableService
+        self.tableName      = tableName
+        self.batchSize      = batchSize
+        self.maxBytes       = maxBytes
+        self.pending        = {}
+        self.pendingBytes   = {}
+        self.written        = 0
+
+    ## Queue an entity, the partition is committed
+    # as soon as a full batch is available
+    def upsert(self, entity):
+        size = entitySize(entity)
+        if self.pendingBytes.get(entity.PartitionKey, 0) + size > self.maxBytes:
+            self.commitPartition(entity.PartitionKey)
+
+        partition = self.pending.setdefault(entity.PartitionKey, {})
+        self.pendingBytes[entity.PartitionKey] = self.pendingBytes.get(entity.PartitionKey, 0) + size
+
+        # A batch can't contain the same key twice: the last write wins
+        partition[entity.RowKey] = entity
+
+        if len(partition) >= self.batchSize:
+            self.commitPartition(entity.PartitionKey)
+
+    ## Commit the queued entities of a partition
+    def commitPartition(self, partitionKey):
+        entities = self.pending.pop(partitionKey, None)
+        self.pendingBytes.pop(partitionKey, None)
+        if not entities:
+            return
+
+        from azure.storage.table import TableBatch
+
+        batch = TableBatch()
+        for entity in entities.values():
+            batch.insert_or_replace_entity(entity)
+
+        self.tableService.commit_batch(self.tableName, batch)
+        self.written += len(entities)
+
+    ## Commit all the queued entities
+    def flush(self):
+        for partitionKey in list(self.pending.keys()):
+            self.commitPartition(partitionKey)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.flush()
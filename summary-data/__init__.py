@@ -1,11 +1,13 @@
 import logging
-import json
-import requests
 import datetime
-import pytz
 import azure.functions as func
-import azure.storage.table
-from azure.storage.table import TableService, Entity
+from __app__.shared_code.TableLayout import parseDay
+from __app__.shared_code.Rollups import rollupsTableName, dailyResolution, queryRollups, rollupValues
+from __app__.shared_code.TableClient import getTableServiceOrError
+from __app__.shared_code.Channels import channelNames, responseKey
+from __app__.shared_code.ResponseCache import buildCacheKey, cachedResponse
+from __app__.shared_code.ResponseEncoding import responseFormats, dumpJson, toColumns
+from __app__.shared_code.Metrics import invocation
 
 
 ## Util function to evaluate date difference
@@ -16,52 +18,46 @@ def daysBetween(d1, d2):
 
 
 ## Util function to get a date daysNumber days
-# before today
+# before today. Days are UTC ones, as the refresh
+# time of the cached responses
 def daysAgo(daysNumber):
-    today = datetime.date.today()
+    today = datetime.datetime.now(datetime.timezone.utc).date()
     lastWeek = today - datetime.timedelta(days = daysNumber)
-    startingDate = lastWeek.strftime("%Y-%m-%d") + " 00:00:00"
+    startingDate = lastWeek.strftime("%Y-%m-%d")
     return startingDate
 
 
-## Function to query Azure db using requested device name
-def getDeviceSummary(tableName, tableService, devName):
+## Function to query Azure db using requested device name,
+# the samples since startingDate (by default 16 days ago)
+# are returned as a list or as columns
+def getDeviceSummary(tableName, tableService, devName, responseFormat = "rows", startingDate = None):
     response = {}
     jsonResponse = {}
     samples = []
     dailySample = {}
 
-    startingDate = datetime.datetime.strptime(daysAgo(16), "%Y-%m-%d %H:%M:%S")
-    startingDate = str(int(startingDate.replace(tzinfo=pytz.utc).timestamp()))
-
-    requestQuery = "PartitionKey eq 'AirSample' and DeviceName eq '" + devName +  "' and RowKey ge '" + startingDate + "'"
-
-    try:
-        # Query db
-        entities = tableService.query_entities(tableName, filter = requestQuery)
-        for entity in entities:
-            sample = json.loads(entity.SampleValues)
-            dailySample = {
-                "time"      : sample["day"],
-                "avgTemp"   : sample["avgDailyTemp"],
-                "avgCo2"    : sample["avgDailyCo2"],
-                "avgRad"    : sample["avgDailyRad"],
-                "avgO3"     : sample["avgDailyO3"],
-                "avgNo2"    : sample["avgDailyNo2"],
-                "avgCo"     : sample["avgDailyCo"],
-                "avgVoc"    : sample["avgDailyVoc"],
-                "avgPm2_5"  : sample["avgDailyPm2_5"],
-                "avgPm10"   : sample["avgDailyPm10"],
-                "avgDs18"   : sample["avgDailyDs18"]
-            }
-            samples.append(dailySample.copy())
-
-        # Build json responses
-        response = { "samples" : samples }
-        jsonResponse = json.dumps(response) 
-
-    except Exception as error:
-        logging.info(error)
+    startingDate = parseDay(startingDate or daysAgo(16))
+
+    with invocation("summary-data", device = devName) as invocationMetrics:
+        try:
+            # Query the daily values of the device
+            entities = queryRollups(tableService, devName, dailyResolution, startingDate)
+            for entity in entities:
+                dailySample = { "time" : entity.Day }
+                dailySample.update(rollupValues(entity))
+                samples.append(dailySample)
+
+            # Build json responses
+            if responseFormat == "columns":
+                response = toColumns(samples, ["time"] + [responseKey(name) for name in channelNames])
+            else:
+                response = { "samples" : samples }
+            jsonResponse = dumpJson(response)
+
+        except Exception as error:
+            logging.info(error)
+
+        invocationMetrics.count("jsonBytes", len(jsonResponse))
 
     return jsonResponse
 
@@ -70,9 +66,6 @@ def getDeviceSummary(tableName, tableService, devName):
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info('Python HTTP trigger function processed a request.')
 
-    accountName = ""
-    accountKey = ""
-
     # Get params
     deviceName = req.params.get('device-name')
     if not deviceName or deviceName == "" or not deviceName.isalnum():
@@ -80,19 +73,23 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 "Unable to parse requested device name",
                 status_code = 400)
 
-    # Instantiate db connection
-    tableName = 'AirSamples'
-    tableService = None
-    try:
-        tableService = TableService(account_name=accountName, account_key=accountKey)  
-    except Exception as error:
-        logging.info(error)
+    responseFormat = req.params.get('format', "rows")
+    if responseFormat not in responseFormats:
         return func.HttpResponse(
-                "Unable to connect to Azure Table",
-                status_code=500)
+                "Unable to parse requested format: should be one of " + ", ".join(responseFormats),
+                status_code = 400)
+
+    # Instantiate db connection
+    tableName = rollupsTableName
+    tableService, errorResponse = getTableServiceOrError()
+    if errorResponse is not None:
+        return errorResponse
 
     logging.info("Requested summary data for device " + deviceName)
 
-    # Return response
-    jsonResponse = getDeviceSummary(tableName, tableService, deviceName)
-    return func.HttpResponse(jsonResponse, mimetype="application/json")
\ No newline at end of file
+    # Return response, summaries only change with the daily ingest.
+    # The key holds the start of the window, so a cached summary
+    # is never used once the day has changed
+    startingDate = daysAgo(16)
+    cacheKey = buildCacheKey("summary-data", { "device-name": deviceName, "format": responseFormat, "from": startingDate })
+    return cachedResponse(req, cacheKey, lambda: getDeviceSummary(tableName, tableService, deviceName, responseFormat, startingDate))
\ No newline at end of file
@@ -0,0 +1,17 @@
+## Test setup: the modules of the function app are imported as
+# the __app__ package, as the functions host loads them, and the
+# shared code is importable from the project root
+import os
+import sys
+import types
+
+
+projectRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if projectRoot not in sys.path:
+    sys.path.insert(0, projectRoot)
+
+if "__app__" not in sys.modules:
+    appPackage = types.ModuleType("__app__")
+    appPackage.__path__ = [projectRoot]
+    sys.modules["__app__"] = appPackage
@@ -0,0 +1,70 @@
+import datetime
+import importlib
+import threading
+import time
+
+import pytest
+
+backfill = importlib.import_module("__app__.backfill-data")
+
+
+## Stand-in of ingestRange recording the concurrent chunks of
+# each device and the order of the chunks
+class IngestRecorder:
+    def __init__(self, failing = ()):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.maxRunning = {}
+        self.chunks = {}
+        self.failing = failing
+
+    def __call__(self, session, tableService, device, startDate, endDate):
+        with self.lock:
+            self.running[device] = self.running.get(device, 0) + 1
+            self.maxRunning[device] = max(self.maxRunning.get(device, 0), self.running[device])
+            self.chunks.setdefault(device, []).append(startDate["day"])
+
+        time.sleep(0.01)
+
+        with self.lock:
+            self.running[device] -= 1
+
+        if (device, startDate["day"]) in self.failing:
+            raise RuntimeError("failed")
+        return 1
+
+
+@pytest.fixture
+def checkpoints(monkeypatch):
+    saved = set()
+    monkeypatch.setattr(backfill, "loadCheckpoints", lambda tableService, jobId: set(saved))
+    monkeypatch.setattr(backfill, "saveCheckpoint", lambda tableService, jobId, unitKey, **values: saved.add(unitKey))
+    return saved
+
+
+def runBackfill(monkeypatch, recorder, devices):
+    monkeypatch.setattr(backfill, "ingestRange", recorder)
+    return backfill.runBackfill(None, devices, datetime.date(2021, 3, 1), datetime.date(2021, 3, 28), 7)
+
+
+def test_chunks_of_a_device_run_serially(monkeypatch, checkpoints):
+    recorder = IngestRecorder()
+    result = runBackfill(monkeypatch, recorder, ["dev1", "dev2", "dev3"])
+
+    assert result["storedDays"] == 12
+    assert result["failed"] == []
+    assert set(recorder.maxRunning.values()) == {1}
+    assert all(chunks == ["1", "8", "15", "22"] for chunks in recorder.chunks.values())
+
+
+def test_failed_chunks_are_retried(monkeypatch, checkpoints):
+    result = runBackfill(monkeypatch, IngestRecorder(failing = {("dev1", "8")}), ["dev1", "dev2"])
+
+    assert result["failed"] == ["dev1_2021-03-08"]
+    assert len(checkpoints) == 7
+
+    recorder = IngestRecorder()
+    result = runBackfill(monkeypatch, recorder, ["dev1", "dev2"])
+
+    assert result["skipped"] == 7
+    assert recorder.chunks == {"dev1": ["8"]}
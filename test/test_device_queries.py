@@ -0,0 +1,43 @@
+import json
+
+from benchmarks.memory_table import MemoryTableService
+from shared_code.DeviceQueries import hourlySamplesJson, iterDeviceInfo
+from shared_code.SampleCodec import hourlyKeys
+
+
+def buildSampleValues(day, **dumpOptions):
+    hourlySamples = []
+    for hour in range(24):
+        hourSample = {"time": day + "_" + str(hour).zfill(2), "missingData": "false"}
+        hourSample.update((key, hour + 0.25) for key in hourlyKeys)
+        hourSample["samplxH"] = 60
+        hourlySamples.append(hourSample)
+
+    return json.dumps({"day": day, "avgDailyTemp": 1.5, "data": hourlySamples}, **dumpOptions)
+
+
+def test_compact_days_are_copied():
+    sampleValues = buildSampleValues("2021-03-01", separators = (",", ":"))
+
+    assert "[" + hourlySamplesJson(sampleValues) + "]" == json.dumps(json.loads(sampleValues)["data"], separators = (",", ":"))
+
+
+def test_days_stored_with_default_separators_are_compacted():
+    sampleValues = buildSampleValues("2021-03-01")
+    hourlySamples = hourlySamplesJson(sampleValues)
+
+    assert ", " not in hourlySamples and ": " not in hourlySamples
+    assert json.loads("[" + hourlySamples + "]") == json.loads(sampleValues)["data"]
+
+
+def test_hourly_response_is_compact():
+    tableService = MemoryTableService()
+    for day, dumpOptions in (("2021-03-01", {}), ("2021-03-02", {"separators": (",", ":")})):
+        tableService.insert_or_replace_entity("DeviceSamples", {"PartitionKey": "dev1", "RowKey": day,
+                                                                "SampleValues": buildSampleValues(day, **dumpOptions)})
+
+    response = "".join(iterDeviceInfo("DeviceSamples", tableService, "dev1", "2021-03-01", "2021-03-02"))
+
+    assert response.startswith('{"samples":[{"time":"2021-03-01_00","missingData":"false",')
+    assert ", " not in response and ": " not in response
+    assert len(json.loads(response)["samples"]) == 48
@@ -0,0 +1,40 @@
+import importlib
+import json
+import logging
+
+import azure.functions as func
+
+from __app__.shared_code.Metrics import metrics
+
+devicesData = importlib.import_module("__app__.devices-data")
+
+
+def buildRequest(**params):
+    params = dict({"from": "2021-03-01", "to": "2021-03-07"}, **params)
+    return func.HttpRequest("GET", "/api/devices-data", params = params, body = b"")
+
+
+def test_spatial_index_failure_is_an_error_response(monkeypatch):
+    def failingIndex(tableService):
+        raise RuntimeError("table unavailable")
+
+    monkeypatch.setattr(devicesData, "getTableServiceOrError", lambda: (None, None))
+    monkeypatch.setattr(devicesData, "getSpatialIndex", failingIndex)
+
+    assert devicesData.main(buildRequest(bbox = "43,11,44,12")).status_code == 500
+
+
+def test_device_reads_are_counted_in_the_invocation(monkeypatch, caplog):
+    def getDeviceJson(tableService, devName, *args):
+        metrics().count("deviceReads")
+        return "{}"
+
+    monkeypatch.setattr(devicesData, "getDeviceJson", getDeviceJson)
+
+    with caplog.at_level(logging.INFO, logger = "metrics"):
+        response = devicesData.getDevicesInfo(None, ["dev1", "dev2", "dev3"], "2021-03-01", "2021-03-07", "rows")
+
+    records = [json.loads(record.getMessage()) for record in caplog.records if record.name == "metrics"]
+    assert json.loads(response) == {"devices": {"dev1": {}, "dev2": {}, "dev3": {}}, "failed": []}
+    assert records[-1]["name"] == "devices-data"
+    assert records[-1]["counters"]["deviceReads"] == 3
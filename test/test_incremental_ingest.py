@@ -0,0 +1,97 @@
+import datetime
+import importlib
+
+import pytest
+from azure.storage.table import EntityProperty
+
+from benchmarks.memory_table import MemoryTableService
+from benchmarks.sensor_csv import CsvResponse, formatCsv, generateDayRows
+
+from __app__ import pull_sensor_data
+from __app__.pull_sensor_data.Aggregation import dateColumn
+
+incremental = importlib.import_module("__app__.pull_sensor_incremental")
+
+day = datetime.date(2021, 3, 10)
+
+
+## Stand-in of the api: the samples of the day collected up to
+# the cutoff are returned, in the given order
+class DaySession:
+    def __init__(self, rows):
+        self.rows = rows
+        self.cutoff = "9999"
+
+    def get(self, url, stream = False, timeout = None, headers = None):
+        rows = [row for row in self.rows if row[dateColumn] <= self.cutoff]
+        return CsvResponse(formatCsv("dev1", rows).encode("utf-8"))
+
+
+def entityValues(entity):
+    return {name: value.value if isinstance(value, EntityProperty) else value for name, value in entity.items()}
+
+
+def storedValues(tableService, tableName, rowKey):
+    entities = list(tableService.query_entities(tableName, filter = "PartitionKey eq 'dev1' and RowKey eq '" + rowKey + "'"))
+    assert len(entities) == 1
+    return entityValues(entities[0])
+
+
+def ingestIncrements(rows, cutoffs):
+    session = DaySession(rows)
+    tableService = MemoryTableService()
+
+    for cutoff in cutoffs:
+        session.cutoff = cutoff
+        incremental.ingestIncrement(session, tableService, "dev1", day)
+
+    session.cutoff = "9999"
+    incremental.ingestIncrement(session, tableService, "dev1", day, finalize = True)
+
+    return tableService
+
+
+## The gaps and the out of order hours of the day
+@pytest.fixture(params = [(0.0, 0.0), (0.2, 0.0), (0.2, 0.3)])
+def dayRows(request):
+    gapProbability, swapProbability = request.param
+    return generateDayRows("dev1", day, samplesPerHour = 12, gapProbability = gapProbability,
+                           swapProbability = swapProbability, seed = 7)
+
+
+@pytest.mark.parametrize("cutoffs", [[], ["2021-03-10 07:40:00", "2021-03-10 16:05:00", "2021-03-10 23:50:00"]])
+def test_incremental_and_nightly_entities_match(dayRows, cutoffs):
+    sampleEntity, dailyRollup = pull_sensor_data.buildDayEntities("dev1", iter(dayRows))
+
+    tableService = ingestIncrements(dayRows, cutoffs)
+
+    assert storedValues(tableService, "DeviceSamples", sampleEntity.RowKey) == entityValues(sampleEntity)
+
+    # Sums of several batches are only rounded differently
+    storedRollup = storedValues(tableService, "DeviceRollups", dailyRollup.RowKey)
+    expectedRollup = entityValues(dailyRollup)
+    sums = [name for name in expectedRollup if name.startswith("Sum")]
+    assert [storedRollup.pop(name) for name in sums] == pytest.approx([expectedRollup.pop(name) for name in sums], rel = 1e-12)
+    assert storedRollup == expectedRollup
+
+
+def test_out_of_order_rows_are_not_skipped():
+    rows = generateDayRows("dev1", day, samplesPerHour = 12, gapProbability = 0.0, swapProbability = 0.0, seed = 7)
+    session = DaySession(rows)
+    tableService = MemoryTableService()
+
+    session.cutoff = "2021-03-10 11:59:59"
+    assert incremental.ingestIncrement(session, tableService, "dev1", day) == 12 * 12
+
+    # The new hours are listed apart, after the known ones,
+    # and the dates of the last one have no leading zeros
+    hourRows = lambda hour: [row for row in rows if row[dateColumn].startswith("2021-03-10 " + hour + ":")]
+    unpadded = [row[:dateColumn] + [row[dateColumn].replace("-03-", "-3-")] + row[dateColumn + 1:] for row in hourRows("13")]
+    session.rows = hourRows("12") + [row for row in rows if row[dateColumn] <= session.cutoff] + unpadded
+    session.cutoff = "9999"
+    assert incremental.ingestIncrement(session, tableService, "dev1", day) == 2 * 12
+
+    partialDay = incremental.loadPartialDay(tableService, "dev1", day)
+    assert partialDay.highWaterMark == datetime.datetime(2021, 3, 10, 13, 55)
+    assert partialDay.dailyAverages.count == 14 * 12
+    assert [bucket.count for bucket in partialDay.hourlyBuckets[11:15]] == [12, 12, 12, 0]
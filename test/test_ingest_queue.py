@@ -0,0 +1,90 @@
+import datetime
+import importlib
+
+import pytest
+from azure.storage.table import Entity
+
+from benchmarks.memory_table import MemoryTableService
+from benchmarks.sensor_csv import CsvSession
+from shared_code.IngestQueue import MemoryQueue, buildUnitMessage, parseUnitMessage
+from shared_code.Metrics import nullMetrics
+
+pull = importlib.import_module("__app__.pull_sensor_data")
+worker = importlib.import_module("__app__.ingest_worker")
+
+
+## Session failing the requests of some devices
+class FailingSession(CsvSession):
+    def __init__(self, failingDevices, **options):
+        super().__init__(**options)
+        self.failingDevices = failingDevices
+
+    def get(self, url, **kwargs):
+        if any("station_id=" + device + "&" in url for device in self.failingDevices):
+            self.requests += 1
+            raise ConnectionError("unreachable")
+        return super().get(url, **kwargs)
+
+
+@pytest.fixture
+def tableService(monkeypatch):
+    from __app__.pull_sensor_data import RawCache
+
+    monkeypatch.setattr(RawCache, "cacheEnabled", False)
+
+    tableService = MemoryTableService()
+    for device in ("dev1", "dev2", "dev3"):
+        tableService.insert_or_replace_entity("AirSamples", Entity(PartitionKey = "Device", RowKey = device, DeviceName = device))
+
+    return tableService
+
+
+def storedDevices(tableService):
+    return sorted(entity.PartitionKey for entity in tableService.query_entities("DeviceSamples"))
+
+
+def test_dispatch_to_workers(tableService):
+    queue = MemoryQueue()
+    pull.dispatchUnits(queue, nullMetrics, tableService)
+
+    assert len(queue.messages) == 3
+
+    session = CsvSession(samplesPerHour = 6)
+    delivered = queue.drain(lambda body, dequeueCount: worker.handleUnit(body, dequeueCount, tableService, session))
+
+    assert delivered == 3
+    assert queue.poison == []
+    assert storedDevices(tableService) == ["dev1", "dev2", "dev3"]
+
+
+def test_duplicated_units_are_skipped(tableService):
+    queue = MemoryQueue()
+    message = buildUnitMessage("dev1", datetime.date.today(), "run")
+    queue.set([message, message])
+
+    handled = []
+    session = CsvSession(samplesPerHour = 6)
+    queue.drain(lambda body, dequeueCount: handled.append(worker.handleUnit(body, dequeueCount, tableService, session)))
+
+    assert handled == [True, False]
+    assert session.requests == 1
+
+
+def test_failing_units_are_poisoned(tableService):
+    queue = MemoryQueue()
+    pull.dispatchUnits(queue, nullMetrics, tableService)
+
+    session = FailingSession({"dev2"}, samplesPerHour = 6)
+    delivered = queue.drain(lambda body, dequeueCount: worker.handleUnit(body, dequeueCount, tableService, session))
+
+    assert delivered == 2 + queue.maxDequeueCount
+    assert [parseUnitMessage(body)[0] for body in queue.poison] == ["dev2"]
+    assert storedDevices(tableService) == ["dev1", "dev3"]
+
+
+def test_malformed_messages_are_discarded(tableService):
+    queue = MemoryQueue()
+    queue.set(['{"device": "dev1"}', "not json"])
+
+    assert queue.drain(lambda body, dequeueCount: worker.handleUnit(body, dequeueCount, tableService, CsvSession())) == 2
+    assert queue.poison == []
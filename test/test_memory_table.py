@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+from azure.common import AzureConflictHttpError
+from azure.storage.table import Entity, EntityProperty, EdmType, TableBatch
+
+from benchmarks.memory_table import MemoryTableService
+from benchmarks.sensor_csv import CsvSession
+from shared_code.TableWriter import BatchWriter
+
+
+def buildEntity(rowKey, **values):
+    entity = Entity(PartitionKey = "dev1", RowKey = rowKey)
+    entity.update(values)
+    return entity
+
+
+def test_batch_round_trip():
+    tableService = MemoryTableService()
+
+    with BatchWriter(tableService, "Samples", batchSize = 2) as writer:
+        for day in range(5):
+            writer.upsert(buildEntity(str(day), Day = str(day), Count = day, Average = day / 3,
+                                      Columns = EntityProperty(EdmType.BINARY, bytes([day] * 8))))
+
+    entities = list(tableService.query_entities("Samples", filter = "PartitionKey eq 'dev1'"))
+
+    assert writer.written == 5
+    assert [entity.RowKey for entity in entities] == ["0", "1", "2", "3", "4"]
+    assert entities[3].Count == 3
+    assert entities[3].Average == 1.0
+    assert entities[3].Columns.value == bytes([3] * 8)
+
+
+def test_batch_operations():
+    tableService = MemoryTableService()
+    tableService.insert_or_replace_entity("Samples", buildEntity("a", Value = 1, Other = 1))
+
+    batch = TableBatch()
+    batch.insert_or_merge_entity(buildEntity("a", Value = 2))
+    batch.insert_or_replace_entity(buildEntity("b", Value = 3))
+    tableService.commit_batch("Samples", batch)
+
+    entities = {entity.RowKey: entity for entity in tableService.query_entities("Samples")}
+    assert (entities["a"].Value, entities["a"].Other, entities["b"].Value) == (2, 1, 3)
+
+    # A failing batch changes nothing
+    batch = TableBatch()
+    batch.delete_entity("dev1", "b")
+    batch.insert_entity(buildEntity("a", Value = 4))
+    with pytest.raises(AzureConflictHttpError):
+        tableService.commit_batch("Samples", batch)
+
+    assert len(list(tableService.query_entities("Samples"))) == 2
+
+
+def test_ingest_range(monkeypatch):
+    from __app__ import pull_sensor_data
+    from __app__.pull_sensor_data import RawCache
+
+    monkeypatch.setattr(RawCache, "cacheEnabled", False)
+
+    tableService = MemoryTableService()
+    endDay = datetime.date(2021, 3, 10)
+    startDay = endDay - datetime.timedelta(days = 2)
+
+    storedDays = pull_sensor_data.ingestRange(CsvSession(samplesPerHour = 6), tableService, "dev1",
+                                              pull_sensor_data.buildDate(startDay), pull_sensor_data.buildDate(endDay))
+
+    samples = list(tableService.query_entities("DeviceSamples", filter = "PartitionKey eq 'dev1'"))
+    assert storedDays == 3
+    assert [entity.RowKey for entity in samples] == ["2021-03-08", "2021-03-09", "2021-03-10"]
+    assert len(list(tableService.query_entities("DeviceAirQuality"))) == 3
@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from shared_code.QuantileSketch import QuantileSketch, relativeAccuracy, zeroThreshold, encodeSketches, decodeSketches
+
+
+## Util function returning the value of the sorted values at
+# the rank the sketch estimates for the quantile q
+def exactQuantile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+def assertClose(estimate, exact):
+    assert abs(estimate - exact) <= relativeAccuracy * abs(exact) + zeroThreshold + 1e-9
+
+
+def test_bin_bound_below_value():
+    # gamma ** key rounds below this value
+    sketch = QuantileSketch()
+    sketch.addColumn([1.9740567482259106])
+
+    assert sketch.count == 1
+    assert sketch.quantile(0.5) == pytest.approx(1.9740567482259106, rel = relativeAccuracy)
+
+
+def test_empty_sketch():
+    sketch = QuantileSketch()
+    sketch.addColumn([])
+
+    assert sketch.quantile(0.5) is None
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_quantiles(seed):
+    generator = random.Random(seed)
+    scale = 10 ** generator.uniform(-2, 4)
+    values = [generator.uniform(-0.2, 1) * scale for i in range(generator.randint(1, 2000))]
+    values += [generator.choice(values) for i in range(50)]
+
+    sketch = QuantileSketch()
+    for start in range(0, len(values), 97):
+        sketch.addColumn(values[start:start + 97])
+
+    assert sketch.count == len(values)
+    assert sketch.quantile(0) == min(values)
+    assert sketch.quantile(1) == max(values)
+    for q in (0.01, 0.25, 0.5, 0.75, 0.95, 0.99):
+        assertClose(sketch.quantile(q), exactQuantile(values, q))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_merge(seed):
+    generator = random.Random(seed)
+    columns = [[generator.lognormvariate(3, 1) for i in range(generator.randint(1, 300))] for c in range(24)]
+
+    merged = QuantileSketch()
+    for column in columns:
+        sketch = QuantileSketch()
+        sketch.addColumn(column)
+        merged.merge(sketch)
+
+    whole = QuantileSketch()
+    whole.addColumn([value for column in columns for value in column])
+
+    assert merged.count == whole.count
+    assert merged.positive == whole.positive
+    for q in (0.1, 0.5, 0.9):
+        assert merged.quantile(q) == whole.quantile(q)
+
+
+def test_encoding_round_trip():
+    generator = random.Random(0)
+    sketches = []
+    for c in range(3):
+        sketch = QuantileSketch()
+        sketch.addColumn([generator.uniform(-50, 50) for i in range(500)])
+        sketches.append(sketch)
+
+    decoded = decodeSketches(encodeSketches(sketches))
+
+    assert len(decoded) == len(sketches)
+    for sketch, other in zip(sketches, decoded):
+        assert other.count == sketch.count
+        assert other.positive == sketch.positive
+        assert other.negative == sketch.negative
+        assert other.zeroCount == sketch.zeroCount
+        assert other.quantile(0.5) == pytest.approx(sketch.quantile(0.5), rel = 1e-6)
@@ -0,0 +1,105 @@
+import io
+import os
+
+import pytest
+
+from __app__.pull_sensor_data import RawCache
+
+
+## Upstream api stand-in serving a body per url, with an ETag.
+# Requests with the current ETag are answered 304
+class FakeResponse:
+    def __init__(self, body, status_code, etag):
+        self.raw = io.BytesIO(body)
+        self.status_code = status_code
+        self.headers = {"ETag": etag}
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeSession:
+    def __init__(self):
+        self.bodies = {}
+        self.requests = []
+
+    def get(self, url, stream = False, timeout = None, headers = None):
+        headers = headers or {}
+        self.requests.append(headers)
+
+        body = self.bodies[url]
+        etag = '"' + str(hash(body)) + '"'
+        if headers.get("If-None-Match") == etag:
+            return FakeResponse(b"", 304, etag)
+        return FakeResponse(body, 200, etag)
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.setattr(RawCache, "cacheEnabled", True)
+    monkeypatch.setattr(RawCache, "cacheOffline", False)
+    monkeypatch.setattr(RawCache, "cacheDir", str(tmp_path))
+    return FakeSession()
+
+
+def readResponse(session, url, closedRange):
+    with RawCache.openResponse(session, url, 1, closedRange) as responseStream:
+        return responseStream.read()
+
+
+def test_closed_range_is_cached(session):
+    session.bodies["day"] = b"a,b\r\n1,2\r\n"
+
+    assert readResponse(session, "day", True) == "a,b\r\n1,2\r\n"
+    assert readResponse(session, "day", True) == "a,b\r\n1,2\r\n"
+    assert len(session.requests) == 1
+
+
+def test_range_fetched_open_is_validated(session):
+    # Fetched before the end of the day
+    session.bodies["day"] = b"a,b\r\n1,2\r\n"
+    assert readResponse(session, "day", False) == "a,b\r\n1,2\r\n"
+
+    # Retried once the day is closed: the late samples are read
+    session.bodies["day"] = b"a,b\r\n1,2\r\n3,4\r\n"
+    assert readResponse(session, "day", True) == "a,b\r\n1,2\r\n3,4\r\n"
+    assert len(session.requests) == 2
+
+    # Now complete
+    assert readResponse(session, "day", True) == "a,b\r\n1,2\r\n3,4\r\n"
+    assert len(session.requests) == 2
+
+
+def test_unchanged_range_is_complete_once_closed(session):
+    session.bodies["day"] = b"a,b\r\n1,2\r\n"
+    readResponse(session, "day", False)
+
+    assert readResponse(session, "day", True) == "a,b\r\n1,2\r\n"
+    assert "If-None-Match" in session.requests[1]
+
+    readResponse(session, "day", True)
+    assert len(session.requests) == 2
+
+
+def test_response_evicted_before_open_is_downloaded(session, monkeypatch):
+    session.bodies["day"] = b"a,b\r\n1,2\r\n"
+    readResponse(session, "day", True)
+
+    # Another worker evicts the response once its index is read
+    loadIndex = RawCache.loadIndex
+
+    def evictingLoadIndex(url):
+        index = loadIndex(url)
+        os.unlink(RawCache.blobPath(index["digest"]))
+        return index
+
+    monkeypatch.setattr(RawCache, "loadIndex", evictingLoadIndex)
+
+    assert readResponse(session, "day", True) == "a,b\r\n1,2\r\n"
+    assert session.requests[1] == {}
@@ -0,0 +1,61 @@
+import importlib
+import os
+
+import azure.functions as func
+
+from shared_code.ResponseCache import ResponseCache
+
+summaryData = importlib.import_module("__app__.summary-data")
+
+
+def randomBody(size):
+    # Not compressible, variants are as big as the body
+    return os.urandom(size)
+
+
+def test_entries_are_bounded():
+    cache = ResponseCache(maxEntries = 2, maxBytes = 1 << 20)
+    for key in ("a", "b", "c"):
+        cache.put(key, randomBody(100))
+
+    assert list(cache.entries) == ["b", "c"]
+    assert cache.size == 200
+
+
+def test_variants_are_bounded():
+    cache = ResponseCache(maxEntries = 10, maxBytes = 10000)
+    for key in ("a", "b", "c"):
+        cache.put(key, randomBody(3000))
+
+    for key in ("a", "b", "c"):
+        entry = cache.get(key)
+        if entry is not None:
+            cache.variant(key, entry, "gzip")
+        assert cache.size <= cache.maxBytes
+
+    assert cache.size == sum(entry.size() for entry in cache.entries.values())
+    assert list(cache.entries) == ["c"]
+
+
+def test_variant_of_evicted_entry():
+    cache = ResponseCache(maxEntries = 1, maxBytes = 10000)
+    entry = cache.put("a", randomBody(3000))
+    cache.put("b", randomBody(3000))
+
+    # Served, but not accounted: the entry is no longer cached
+    assert len(cache.variant("a", entry, "gzip")) > 0
+    assert cache.size == 3000
+
+
+def test_summary_is_not_cached_across_days(monkeypatch):
+    windows = []
+    monkeypatch.setattr(summaryData, "getTableServiceOrError", lambda: (None, None))
+    monkeypatch.setattr(summaryData, "getDeviceSummary",
+                        lambda tableName, tableService, devName, responseFormat, startingDate: windows.append(startingDate) or "{}")
+
+    request = func.HttpRequest("GET", "/api/summary-data", params = {"device-name": "cachedDevice"}, body = b"")
+    for startingDate in ("2021-03-01", "2021-03-01", "2021-03-02"):
+        monkeypatch.setattr(summaryData, "daysAgo", lambda daysNumber: startingDate)
+        summaryData.main(request)
+
+    assert windows == ["2021-03-01", "2021-03-02"]
@@ -0,0 +1,52 @@
+import importlib
+
+import azure.functions as func
+import pytest
+
+from shared_code.SpatialIndex import GridIndex, parseBoundingBox
+
+devicesInBox = importlib.import_module("__app__.devices-in-box")
+
+
+@pytest.mark.parametrize("boxStr, expected", [
+    ("43.7,11.1,43.9,11.3", (43.7, 11.1, 43.9, 11.3)),
+    ("-90,-180,90,180", (-90.0, -180.0, 90.0, 180.0)),
+])
+def test_valid_boxes(boxStr, expected):
+    assert parseBoundingBox(boxStr) == expected
+
+
+@pytest.mark.parametrize("boxStr", [
+    "",
+    "43.7,11.1,43.9",
+    "43.7,11.1,43.9,x",
+    "43.9,11.1,43.7,11.3",
+    "nan,11.1,43.9,11.3",
+    "43.7,nan,43.9,11.3",
+    "43.7,11.1,inf,11.3",
+    "-inf,11.1,43.9,11.3",
+    "43.7,11.1,43.9,infinity",
+    "-91,11.1,43.9,11.3",
+    "43.7,11.1,90.5,11.3",
+    "43.7,-181,43.9,11.3",
+    "43.7,11.1,43.9,180.1",
+])
+def test_invalid_boxes(boxStr):
+    assert parseBoundingBox(boxStr) is None
+
+
+@pytest.mark.parametrize("boxStr", ["nan,nan,nan,nan", "0,0,inf,inf", "-100,0,0,0", "0,0,0,200"])
+def test_invalid_box_request(boxStr):
+    request = func.HttpRequest("GET", "/api/devices-in-box", params = {"bbox": boxStr}, body = b"")
+
+    assert devicesInBox.main(request).status_code == 400
+
+
+def test_devices_in_box():
+    devices = [{"deviceName": "dev1", "latitude": 43.8, "longitude": 11.2},
+               {"deviceName": "dev2", "latitude": -33.9, "longitude": 151.2}]
+
+    index = GridIndex(devices)
+
+    assert [device["deviceName"] for device in index.inBox(*parseBoundingBox("43,11,44,12"))] == ["dev1"]
+    assert len(index.inBox(*parseBoundingBox("-90,-180,90,180"))) == 2
@@ -0,0 +1,49 @@
+import base64
+import importlib
+
+import pytest
+
+from shared_code import TableClient
+
+
+@pytest.fixture
+def account(monkeypatch):
+    monkeypatch.setattr(TableClient, "accountName", "testaccount")
+    monkeypatch.setattr(TableClient, "accountKey", base64.b64encode(b"test key").decode("ascii"))
+    monkeypatch.setattr(TableClient, "tableService", None)
+
+
+def test_create_table_service(account):
+    client = TableClient.createTableService()
+
+    assert client.__class__.__name__ == "TableService"
+    assert client.account_name == "testaccount"
+    assert client.request_session is not None
+    assert client.retry.__self__.max_attempts == TableClient.retryAttempts
+
+
+def test_get_table_service_is_shared(account):
+    assert TableClient.getTableService() is TableClient.getTableService()
+
+
+def test_connection_string_takes_precedence(monkeypatch):
+    monkeypatch.setenv("TABLE_CONNECTION_STRING", "UseDevelopmentStorage=true")
+    module = importlib.reload(TableClient)
+    try:
+        assert module.createTableService().account_name == "devstoreaccount1"
+    finally:
+        monkeypatch.delenv("TABLE_CONNECTION_STRING")
+        importlib.reload(TableClient)
+
+
+def test_connection_error_response(monkeypatch):
+    def failingClient():
+        raise ValueError("missing account")
+
+    monkeypatch.setattr(TableClient, "tableService", None)
+    monkeypatch.setattr(TableClient, "createTableService", failingClient)
+
+    tableService, errorResponse = TableClient.getTableServiceOrError()
+
+    assert tableService is None
+    assert errorResponse.status_code == 500
@@ -0,0 +1,117 @@
+## Tool to migrate the samples stored with the legacy layout
+# (PartitionKey 'AirSample', timestamp RowKey, DeviceName property)
+# to the device partitioned layout (PartitionKey device name,
+# 'YYYY-mm-dd' RowKey). Run it from the project root:
+#
+#   python -m tools.migrate_samples --account-name NAME --account-key KEY
+#
+# The migration can be run more than once: entities are
+# upserted, so an interrupted migration can simply be restarted.
+# Daily, weekly and monthly rollups and the daily air
+# quality are built as well
+import argparse
+import json
+import logging
+from azure.storage.table import TableService, Entity, EntityProperty, EdmType
+from shared_code.Channels import channelNames
+from shared_code.TableLayout import devicesTableName, samplesTableName, legacySamplesPartition, buildPartitionKey, buildRowKey, parseDay
+from shared_code.TableWriter import BatchWriter
+from shared_code.SampleCodec import formatVersion, encodeHourlySamples
+from shared_code.Rollups import rollupsTableName, dailyResolution, buildRollupEntity, updatePeriodRollups
+from shared_code.AirQuality import airQualityTableName, updateAirQuality
+
+
+## Function to build the entity with the new
+# layout given a legacy one
+def migrateEntity(legacyEntity):
+    sample = json.loads(legacyEntity.SampleValues)
+
+    entity = Entity()
+    entity.PartitionKey = buildPartitionKey(legacyEntity.DeviceName)
+    entity.RowKey = buildRowKey(sample["day"])
+    entity.DeviceName = legacyEntity.DeviceName
+    entity.SampleValues = legacyEntity.SampleValues
+    entity.SampleFormat = formatVersion
+    entity.SampleColumns = EntityProperty(EdmType.BINARY, encodeHourlySamples(sample["data"]))
+
+    return entity
+
+
+## Function to build the daily rollup of a legacy entity.
+# Only the averages are stored, so the sums are evaluated
+# back from the daily averages and the number of hourly samples
+def migrateRollup(deviceName, sample):
+    count = sum(hourSample["samplxH"] for hourSample in sample["data"])
+
+    averages = [sample["avgDaily" + name] for name in channelNames]
+    averages.append(sample["latitude"])
+    averages.append(sample["longitude"])
+    sums = [average * count for average in averages]
+
+    return buildRollupEntity(deviceName, dailyResolution, parseDay(sample["day"]), sums, count)
+
+
+## Function to copy every legacy entity into the new table.
+# Legacy entities are read in RowKey (insertion time) order,
+# so if a day has been stored more than once the most
+# recent copy wins
+def migrateSamples(tableService, sourceTable, targetTable, dryRun = False):
+    migrated = 0
+    skipped = 0
+
+    migratedDays = {}
+
+    tableService.create_table(targetTable)
+    tableService.create_table(rollupsTableName)
+    tableService.create_table(airQualityTableName)
+
+    requestQuery = "PartitionKey eq '" + legacySamplesPartition + "'"
+    entities = tableService.query_entities(sourceTable, filter = requestQuery)
+
+    with BatchWriter(tableService, targetTable) as writer, BatchWriter(tableService, rollupsTableName) as rollupsWriter:
+        for legacyEntity in entities:
+            try:
+                entity = migrateEntity(legacyEntity)
+                dailyRollup = migrateRollup(legacyEntity.DeviceName, json.loads(legacyEntity.SampleValues))
+            except Exception as error:
+                logging.warning("Skipping entity " + legacyEntity.RowKey + ": " + str(error))
+                skipped += 1
+                continue
+
+            if not dryRun:
+                writer.upsert(entity)
+                rollupsWriter.upsert(dailyRollup)
+            migratedDays.setdefault(legacyEntity.DeviceName, set()).add(parseDay(entity.RowKey))
+            migrated += 1
+
+    # Weekly and monthly rollups and the air quality,
+    # once all the daily values are stored
+    if not dryRun:
+        for deviceName, days in migratedDays.items():
+            updatePeriodRollups(tableService, deviceName, days)
+            updateAirQuality(tableService, deviceName, days)
+
+    return migrated, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Migrate AirSamples entities to the device partitioned layout")
+    parser.add_argument("--account-name", default = None)
+    parser.add_argument("--account-key", default = None)
+    parser.add_argument("--connection-string", default = None)
+    parser.add_argument("--source-table", default = devicesTableName)
+    parser.add_argument("--target-table", default = samplesTableName)
+    parser.add_argument("--dry-run", action = "store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO)
+
+    tableService = TableService(account_name = args.account_name, account_key = args.account_key,
+                                connection_string = args.connection_string)
+
+    migrated, skipped = migrateSamples(tableService, args.source_table, args.target_table, args.dry_run)
+    logging.info("Migrated " + str(migrated) + " entities, skipped " + str(skipped))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,21 @@
 import logging
 import datetime
 import azure.functions as func
+from __app__.shared_code.TableClient import getTableService
 
 ## Main function
-# A simple function to keep warm the other Azure functions
+# A simple function to keep warm the other Azure functions.
+# The table client (and the storage modules it imports on
+# first use) is created here, before a request needs it
 def main(mytimer: func.TimerRequest) -> None:
     logging.info('Python timer function fired.')
 
     utc_timestamp = datetime.datetime.utcnow().replace(
         tzinfo=datetime.timezone.utc).isoformat()
 
+    try:
+        getTableService()
+    except Exception as error:
+        logging.info(error)
+
     logging.info('Warm up done at %s', utc_timestamp)
\ No newline at end of file